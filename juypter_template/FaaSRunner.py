@@ -5,10 +5,14 @@
 # @author Wes Lloyd
 # 
 import random
-import collections
 import time
 from decimal import Decimal
 from threading import Thread
+from threading import Lock
+from concurrent.futures import ThreadPoolExecutor
+import asyncio
+import multiprocessing
+import multiprocessing.connection
 import FaaSET
 import pandas as pd
 import numpy as np
@@ -17,6 +21,18 @@ import json
 import requests
 import uuid
 
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+# Experiments are saved as one compressed Feather file when pyarrow is installed.
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    pa = None
+
 # Results of calls will be placed into this array.
 run_results = []
 
@@ -48,20 +64,10 @@ def callThread(thread_id, runs, function, myPayloads, experiment_name, tags):
         payload = myPayloads[i]
         print("Call Payload: " + str(payload))
         response = None
-        response = FaaSET.test(function=function, payload=payload, outPath=experiment_name, quiet=True, tags=tags)
+        outPath = experiment_name if pa == None else None
+        response = FaaSET.test(function=function, payload=payload, outPath=outPath, quiet=True, tags=tags)
         callPostProcessor(response, thread_id, i, payload)
         
-        
-def callProcess(http_endpoint, runs, myPayloads):
-    for i in range(0, runs): 
-        response = None
-        startTime = time.time()
-        response = requests.post(http_endpoint, json=myPayloads[i])
-        obj = response.json()
-        obj["callEndTime"] = time.time()
-        obj["callStartTime"] = startTime
-        obj["payload"] = myPayloads[i]
-        run_results.append(obj)
 
 #
 # Run a partest with multiple functions and an experiment all functions will be called concurrently.
@@ -108,6 +114,11 @@ def experiment(function,
     if len(run_results) == 0:
         print ("ERROR - ALL REQUESTS FAILED")
         return None
+
+    # Without pyarrow, FaaSET.test saved a file per run.
+    if pa != None:
+        name = function.__name__ if callable(function) else function
+        saveColumns("./functions/" + name + "/experiments/" + experiment_name + "/", toColumns(run_results))
     
     try:
         return pd.DataFrame(run_results)
@@ -115,6 +126,129 @@ def experiment(function,
         return run_results
 
 
+#
+# Worker process of fast_experiment. Waits for the shared start time, then keeps up to
+# `concurrency` requests in flight with an async HTTP client (aiohttp, or a thread pool
+# of requests sessions when aiohttp is not installed). Results are sent back to the
+# parent over `conn` in column batches of up to `batch_size` runs.
+#
+def callProcess(conn, process_id, http_endpoint, myPayloads, concurrency, start_time, batch_size):
+    try:
+        rows = []
+        def record(run_id, payload, callStartTime, startCounter, obj, error):
+            if not isinstance(obj, dict):
+                obj = {"response": obj}
+            elapsed = time.perf_counter() - startCounter
+            obj["processID"] = process_id
+            obj["runID"] = run_id
+            obj["callStartTime"] = callStartTime
+            obj["callEndTime"] = callStartTime + elapsed
+            obj["roundTripTime"] = elapsed * 1000
+            if "runtime" in obj:
+                obj["latency"] = obj["roundTripTime"] - obj["runtime"]
+            obj["payload"] = payload
+            if error != None:
+                obj["error"] = error
+            rows.append(obj)
+            if len(rows) >= batch_size:
+                conn.send(toColumns(rows))
+                rows.clear()
+
+        # Sleep most of the delay away, then spin so every process starts together.
+        time.sleep(max(0, (start_time - time.time()) * 0.9))
+        while time.time() < start_time:
+            continue
+
+        if aiohttp != None:
+            asyncio.run(callProcessAsync(http_endpoint, myPayloads, concurrency, record))
+        else:
+            callProcessThreads(http_endpoint, myPayloads, concurrency, record)
+
+        if len(rows) > 0:
+            conn.send(toColumns(rows))
+    finally:
+        conn.send(None)
+        conn.close()
+
+async def callProcessAsync(http_endpoint, myPayloads, concurrency, record):
+    nextRun = iter(range(len(myPayloads)))
+    async with aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=concurrency),
+                                     timeout=aiohttp.ClientTimeout(total=900)) as session:
+        async def client():
+            for i in nextRun:
+                callStartTime = time.time()
+                startCounter = time.perf_counter()
+                try:
+                    async with session.post(http_endpoint, json=myPayloads[i]) as response:
+                        obj = await response.json(content_type=None)
+                    record(i, myPayloads[i], callStartTime, startCounter, obj, None)
+                except Exception as e:
+                    record(i, myPayloads[i], callStartTime, startCounter, {}, str(e))
+        await asyncio.gather(*[client() for _ in range(concurrency)])
+
+def callProcessThreads(http_endpoint, myPayloads, concurrency, record):
+    lock = Lock()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    def call(i):
+        callStartTime = time.time()
+        startCounter = time.perf_counter()
+        try:
+            obj = session.post(http_endpoint, json=myPayloads[i], timeout=900).json()
+            error = None
+        except Exception as e:
+            obj = {}
+            error = str(e)
+        with lock:
+            record(i, myPayloads[i], callStartTime, startCounter, obj, error)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(call, range(len(myPayloads))))
+
+#
+# Convert a list of result dictionaries into columns (a dictionary of equal length lists).
+#
+def toColumns(rows):
+    columns = {}
+    for index, row in enumerate(rows):
+        for key, value in row.items():
+            if key not in columns:
+                columns[key] = [None] * index
+            columns[key].append(value)
+        for column in columns.values():
+            if len(column) <= index:
+                column.append(None)
+    return columns
+
+#
+# Append a batch of columns to a result set holding `count` runs. Columns missing from
+# either side are filled with None. Returns the new number of runs.
+#
+def appendColumns(columns, count, batch):
+    size = len(next(iter(batch.values()))) if len(batch) > 0 else 0
+    for key, values in batch.items():
+        if key not in columns:
+            columns[key] = [None] * count
+        columns[key].extend(values)
+    count += size
+    for column in columns.values():
+        if len(column) < count:
+            column.extend([None] * (count - len(column)))
+    return count
+
+#
+# Call an HTTP endpoint from many processes at once, for load and scalability tests.
+#
+# Each of the `processes` worker processes runs `runs_per_process` calls with up to
+# `concurrency` of them in flight, so processes * concurrency requests can be outstanding
+# at once without a single interpreter (and its GIL) becoming the bottleneck. Workers
+# busy-wait for a shared start time `start_delay` seconds in the future so load begins
+# as a burst, and stream their results back to this process as columns, which are merged
+# into one DataFrame. The results are also saved as a single column file in
+# ./functions/fast_experiment/experiments/<experiment_name>/ so load() can read them again.
+# end_delay is no longer needed, as results arrive over pipes rather than files, and is ignored.
+#
 def fast_experiment(http_endpoint, 
                     processes, 
                     runs_per_process, 
@@ -123,10 +257,9 @@ def fast_experiment(http_endpoint,
                     experiment_name="fast_experiment", 
                     start_delay=5,
                     end_delay=5,
-                    tags={}):
-    global run_results
-    run_results = []
-    
+                    tags={},
+                    concurrency=1,
+                    batch_size=100):
     random.seed(42)
 
     # Duplicate payloads so that the number of payloads >= number of runs.
@@ -139,69 +272,143 @@ def fast_experiment(http_endpoint,
     
     if (shuffle_payloads):
         random.shuffle(payloadList)
-        
-    child_processes = []
-    child_index = 0
-    
-    # if ./fast_experiment does not exist, create it
-    if not os.path.isdir("./functions/fast_experiment"):
-        os.mkdir("./functions/fast_experiment")
-    if not os.path.isdir("./functions/fast_experiment/experiments"):
-        os.mkdir("./functions/fast_experiment/experiments")
-    if not os.path.isdir("./functions/fast_experiment/experiments/" + experiment_name):
-        os.mkdir("./functions/fast_experiment/experiments/" + experiment_name)
-    
-    # Calculate the start time in ms which is the current time in ms + start_delay
+
+    # Fork like the original driver where possible, the notebook's functions are not picklable.
+    if "fork" in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context("fork")
+    else:
+        context = multiprocessing.get_context()
+
+    # Calculate the start time which is the current time + start_delay
     start_time = time.time() + start_delay
-    
+
+    child_processes = []
+    connections = []
     for i in range(processes):
-        child_pid = os.fork()
-        if child_pid == 0:
+        receiver, sender = context.Pipe(duplex=False)
+        myList = payloadList[i * runs_per_process:(i + 1) * runs_per_process]
+        child = context.Process(target=callProcess,
+                                args=(sender, i, http_endpoint, myList, concurrency, start_time, batch_size))
+        child.start()
+        sender.close()
+        child_processes.append(child)
+        connections.append(receiver)
+
+    # Merge result batches as they arrive, until every worker has finished.
+    columns = {}
+    count = 0
+    while len(connections) > 0:
+        for conn in multiprocessing.connection.wait(connections):
             try:
-                myList = payloadList[child_index:child_index+runs_per_process]
-                time.sleep(start_delay * 0.9)
-                while time.time() < start_time:
-                    continue
-                callProcess(http_endpoint, runs_per_process, myList)
-                time.sleep(end_delay)
-                
-                # Save all runs
-                for run in run_results: 
-                    run['roundTripTime'] = (run['callEndTime'] * 1000) - (run['callStartTime'] * 1000)
-                    run['latency'] = run['roundTripTime'] - run['runtime']
-                    json.dump(run, open("./functions/fast_experiment/experiments/" + experiment_name + "/" + str(uuid.uuid4()) + ".json", "w"), indent=4)
-                
-                time.sleep(end_delay)
-            finally:
-                os._exit(0)
-        else:
-            child_processes.append(child_pid)
-            child_index += runs_per_process
-            
-    for child_pid in child_processes:
-        os.waitpid(child_pid, 0)
-        
-    time.sleep(end_delay)
-    
-    return load("fast_experiment", experiment_name, tags)
+                batch = conn.recv()
+            except EOFError:
+                batch = None
+            if batch == None:
+                connections.remove(conn)
+                conn.close()
+            else:
+                count = appendColumns(columns, count, batch)
+
+    for child in child_processes:
+        child.join()
+
+    if count == 0:
+        print ("ERROR - ALL REQUESTS FAILED")
+        return None
+
+    # Apply tags
+    for key in tags:
+        columns[key] = [tags[key]] * count
+
+    saveColumns("./functions/fast_experiment/experiments/" + experiment_name + "/", columns)
+
+    return pd.DataFrame(columns)
+
+#
+# Save the results of an experiment (columns, a dictionary of equal length lists) into
+# the experiment folder `path` as one zstd compressed Feather file, read back by load()
+# through a memory map. Columns holding dictionaries or lists (such as payload), or
+# values of mixed types, are stored as JSON text and decoded again by load().
+# Without pyarrow the columns are saved as a JSON file instead.
+#
+def saveColumns(path, columns):
+    os.makedirs(path, exist_ok=True)
+    if pa == None:
+        with open(path + str(uuid.uuid4()) + ".columns.json", "w") as json_file:
+            json.dump(columns, json_file)
+        return
+
+    arrays = {}
+    jsonColumns = []
+    for key, values in columns.items():
+        nested = any(isinstance(value, (dict, list)) for value in values)
+        if not nested:
+            try:
+                arrays[key] = pa.array(values)
+                continue
+            except (pa.ArrowException, TypeError, ValueError, OverflowError):
+                pass
+        arrays[key] = pa.array([None if value == None else json.dumps(value) for value in values], type=pa.string())
+        jsonColumns.append(key)
+
+    table = pa.table(arrays).replace_schema_metadata({'json_columns': json.dumps(jsonColumns)})
+    feather.write_feather(table, path + str(uuid.uuid4()) + ".feather", compression="zstd")
+
+#
+# Read a Feather file saved by saveColumns into a DataFrame.
+#
+def loadColumns(filePath):
+    table = feather.read_table(filePath, memory_map=True)
+    metadata = table.schema.metadata or {}
+    frame = table.to_pandas()
+    for key in json.loads(metadata.get(b'json_columns', b'[]')):
+        frame[key] = [None if value == None else json.loads(value) for value in frame[key].tolist()]
+    return frame
 
 def load(function, experiment, tags={}):
     name = function
-    if (isinstance(function, collections.Callable)):
+    if (callable(function)):
         name = function.__name__
     
     path = "./functions/" + name + "/experiments/" + experiment + "/"
     jsonList = []
+    frames = []
     
-    # loop through each json file in path
+    # loop through each result file in path
     folder = os.scandir(path)
     for file in folder:
+        # Results saved by saveColumns, one file per experiment
+        if file.name.endswith(".feather"):
+            if pa == None:
+                print("pyarrow is required to load " + path + file.name)
+                continue
+            frame = loadColumns(path + file.name)
+            for key in tags:
+                frame[key] = tags[key]
+            frames.append(frame)
+            continue
+
         with open(path + file.name) as json_file:
             data = json.load(json_file)
+
+            # Results of fast_experiment, one list per attribute
+            if file.name.endswith(".columns.json"):
+                keys = list(data.keys())
+                for values in zip(*[data[key] for key in keys]):
+                    run = {key: value for key, value in zip(keys, values) if value != None}
+                    for key in tags:
+                        run[key] = tags[key]
+                    jsonList.append(run)
+                continue
             
             # Apply tags
             for key in tags:
                 data[key] = tags[key]
             
             jsonList.append(data)
-    return pd.DataFrame(jsonList)
\ No newline at end of file
+
+    if len(jsonList) > 0 or len(frames) == 0:
+        frames.append(pd.DataFrame(jsonList))
+    if len(frames) == 1:
+        return frames[0]
+    return pd.concat(frames, ignore_index=True)
@@ -0,0 +1,411 @@
+#!/usr/bin/env python3
+"""
+Reprocess every image under an S3 prefix on all cores of one machine, outside Lambda.
+
+The prefix is listed page by page. Each image is downloaded on an I/O thread, run
+through the same image_ops chain as python_lambda_pipeline in a process pool sized to
+the CPUs, and uploaded on an I/O thread, so downloads of the next images and uploads
+of finished ones overlap the image work. Up to --in-flight images are held at once.
+
+Progress is appended to a checkpoint file as images finish. When a run stops (crash,
+Ctrl-C, --limit), running it again with the same checkpoint resumes the listing after
+the last point where every earlier image was done, and skips images done after it.
+Images that failed are tried again on the next run.
+
+Usage:
+    python3 batch_process.py --bucket BUCKET [--prefix input/] [--output-prefix output/]
+                             [--operations rotate,resize,greyscale] [--rotation-degrees 180]
+                             [--scale-percent 150] [--width W] [--height H]
+                             [--maintain-aspect-ratio] [--resize-policy balanced]
+                             [--greyscale-mode L] [--workers N] [--io-threads N]
+                             [--in-flight N] [--checkpoint FILE] [--fresh] [--limit N]
+                             [--region REGION]
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# image_ops is identical in every function's src/ folder
+sys.path.insert(0, os.path.join(BASE_DIR, 'python_lambda_pipeline', 'src'))
+import image_ops
+
+DEFAULT_REGION = 'us-east-2'
+DEFAULT_CHECKPOINT = 'batch_checkpoint.jsonl'
+
+# Keys requested per list_objects_v2 page
+PAGE_SIZE = 1000
+
+# Seconds between progress lines and between resume points written to the checkpoint
+PROGRESS_INTERVAL = 10
+
+
+def transform_image(data, file_extension, options):
+    """
+    Run the chain of operations on one image (bytes). Runs in a worker process.
+
+    The first resize is planned before decoding, as in python_lambda_pipeline, so a
+    JPEG can be decoded at a reduced scale.
+
+    Returns (encoded bytes, image format).
+    """
+    operations = options['operations']
+    image_format = image_ops.get_image_format(file_extension)
+    image = image_ops.open_image(data)
+
+    planned_resize = None
+    if 'resize' in operations:
+        resize_input_size = image.size
+        for operation in operations[:operations.index('resize')]:
+            if operation == 'rotate' and resize_input_size is not None:
+                resize_input_size = image_ops.get_rotated_size(resize_input_size, options['rotation_degrees'])
+        if resize_input_size is not None:
+            planned_resize = image_ops.get_target_size(resize_input_size, options['scale_percent'], options['width'], options['height'])
+            draft_width, draft_height = planned_resize[0], planned_resize[1]
+            if resize_input_size != image.size:
+                draft_width, draft_height = draft_height, draft_width
+            image_ops.draft_image(image, draft_width, draft_height, options['resize_policy'])
+    image.load()
+
+    for operation in operations:
+        if operation == 'rotate':
+            image = image_ops.rotate_image(image, options['rotation_degrees'])
+        elif operation == 'resize':
+            if planned_resize is not None:
+                resize_width, resize_height, resize_mode = planned_resize
+                planned_resize = None
+            else:
+                resize_width, resize_height, resize_mode = image_ops.get_target_size(
+                    image.size, options['scale_percent'], options['width'], options['height'])
+            image = image_ops.resize_image(
+                image, resize_width, resize_height,
+                options['maintain_aspect_ratio'] and resize_mode == "absolute", options['resize_policy'])
+        elif operation == 'greyscale':
+            image = image_ops.greyscale_image(image, options['greyscale_mode'])
+
+    return image_ops.encode_image(image, image_format).getvalue(), image_format
+
+
+def list_keys(s3_client, bucket, prefix, start_after=None):
+    """
+    Yield (key, size) of every object under prefix in key order, one page at a time,
+    starting after start_after when given.
+    """
+    kwargs = {'Bucket': bucket, 'Prefix': prefix, 'MaxKeys': PAGE_SIZE}
+    if start_after is not None:
+        kwargs['StartAfter'] = start_after
+    while True:
+        response = s3_client.list_objects_v2(**kwargs)
+        for obj in response.get('Contents', []):
+            yield obj['Key'], obj['Size']
+        if not response.get('IsTruncated'):
+            return
+        kwargs.pop('StartAfter', None)
+        kwargs['ContinuationToken'] = response['NextContinuationToken']
+
+
+class Checkpoint:
+    """
+    Progress of a batch job, kept as JSON lines in a file:
+
+        {"job": {...}}        settings of the job, first line
+        {"done": key}         an image was written
+        {"failed": key, ...}  an image failed (tried again on resume)
+        {"after": key}        every listed key up to and including key is done
+
+    Keys are listed in order, so "after" is where the listing resumes. Keys done past
+    it are remembered and skipped. Opening an existing checkpoint rewrites it compactly.
+    """
+
+    def __init__(self, path, job, fresh=False):
+        self.path = path
+        self.start_after = None
+        self.done = set()
+        if path is not None and os.path.isfile(path) and not fresh:
+            self._load(job)
+        self._file = None
+        if path is not None:
+            with open(path + '.tmp', 'w') as f:
+                f.write(json.dumps({'job': job}) + '\n')
+                if self.start_after is not None:
+                    f.write(json.dumps({'after': self.start_after}) + '\n')
+                for key in sorted(self.done):
+                    f.write(json.dumps({'done': key}) + '\n')
+            os.replace(path + '.tmp', path)
+            self._file = open(path, 'a')
+        self._lock = threading.Lock()
+
+    def _load(self, job):
+        with open(self.path) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    # A line cut short by a crash
+                    continue
+                if 'job' in entry:
+                    if entry['job'] != job:
+                        raise ValueError(f"Checkpoint {self.path} belongs to a job with other settings: {entry['job']} "
+                                         "(use --fresh to start over, or another --checkpoint)")
+                elif 'done' in entry:
+                    self.done.add(entry['done'])
+                elif 'after' in entry:
+                    if self.start_after is None or entry['after'] > self.start_after:
+                        self.start_after = entry['after']
+        if self.start_after is not None:
+            self.done = {key for key in self.done if key > self.start_after}
+
+    def _write(self, entry):
+        if self._file is not None:
+            with self._lock:
+                self._file.write(json.dumps(entry) + '\n')
+                self._file.flush()
+
+    def mark_done(self, key):
+        self._write({'done': key})
+
+    def mark_failed(self, key, error):
+        self._write({'failed': key, 'error': error})
+
+    def mark_after(self, key):
+        self._write({'after': key})
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class BatchJob:
+    """
+    Lists a prefix and processes its images with a process pool, downloading ahead
+    and uploading behind on a thread pool.
+    """
+
+    def __init__(self, s3_client, bucket, prefix, output_prefix, options, checkpoint,
+                 workers=None, io_threads=16, in_flight=None):
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.prefix = prefix
+        self.output_prefix = output_prefix
+        self.options = options
+        self.checkpoint = checkpoint
+        self.workers = workers or os.cpu_count() or 1
+        self.io_threads = io_threads
+        self.in_flight = in_flight or self.workers * 4
+
+        self.processed = 0
+        self.failed = 0
+        self.skipped = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(self.in_flight)
+        self._outstanding = 0
+        self._condition = threading.Condition()
+
+        # Listing positions still running, to know how far every key is done
+        self._next_sequence = 0
+        self._finished = {}
+        self._resume_key = None
+        self._resume_blocked = False
+        self._last_report = time.monotonic()
+
+    def output_key(self, key):
+        return self.output_prefix + key[len(self.prefix):]
+
+    def run(self, limit=None):
+        """
+        Process every image under the prefix, or the first limit images still to do.
+        """
+        self._started = time.monotonic()
+        io_pool = ThreadPoolExecutor(max_workers=self.io_threads)
+        process_pool = ProcessPoolExecutor(max_workers=self.workers)
+        submitted = 0
+        try:
+            for sequence, (key, size) in enumerate(list_keys(self.s3_client, self.bucket, self.prefix, self.checkpoint.start_after)):
+                if limit is not None and submitted >= limit:
+                    break
+                if size == 0 or not key.lower().endswith(image_ops.SUPPORTED_EXTENSIONS) or key in self.checkpoint.done:
+                    with self._lock:
+                        self.skipped += 1
+                    self._finish(sequence, key, True)
+                    continue
+                self._slots.acquire()
+                with self._condition:
+                    self._outstanding += 1
+                submitted += 1
+                io_pool.submit(self._download, io_pool, process_pool, sequence, key)
+
+            with self._condition:
+                while self._outstanding > 0:
+                    self._condition.wait()
+        finally:
+            process_pool.shutdown(cancel_futures=True)
+            io_pool.shutdown(cancel_futures=True)
+            if self._resume_key is not None:
+                self.checkpoint.mark_after(self._resume_key)
+        return self.summary()
+
+    def _download(self, io_pool, process_pool, sequence, key):
+        try:
+            data = self.s3_client.get_object(Bucket=self.bucket, Key=key)['Body'].read()
+            with self._lock:
+                self.bytes_in += len(data)
+            future = process_pool.submit(transform_image, data, os.path.splitext(key)[1] or '.jpeg', self.options)
+            future.add_done_callback(lambda future: io_pool.submit(self._upload, sequence, key, future))
+        except Exception as e:
+            self._complete(sequence, key, e)
+
+    def _upload(self, sequence, key, future):
+        try:
+            data, image_format = future.result()
+            self.s3_client.put_object(Bucket=self.bucket, Key=self.output_key(key), Body=data,
+                                      ContentType=f'image/{image_format.lower()}')
+            with self._lock:
+                self.bytes_out += len(data)
+            self._complete(sequence, key, None)
+        except Exception as e:
+            self._complete(sequence, key, e)
+
+    def _complete(self, sequence, key, error):
+        if error is None:
+            self.checkpoint.mark_done(key)
+        else:
+            print(f"Failed {key}: {error}")
+            self.checkpoint.mark_failed(key, str(error))
+        with self._lock:
+            if error is None:
+                self.processed += 1
+            else:
+                self.failed += 1
+        self._finish(sequence, key, error is None)
+        self._slots.release()
+        with self._condition:
+            self._outstanding -= 1
+            self._condition.notify_all()
+
+    def _finish(self, sequence, key, ok):
+        """
+        Record a listed key as finished and move the resume point past every key that
+        is done, in listing order. A failed key holds the resume point where it is for
+        the rest of the run. Keys finished after that are not kept: the checkpoint's
+        done and failed lines already record them.
+        """
+        with self._lock:
+            if not self._resume_blocked:
+                self._finished[sequence] = (key, ok)
+                while self._next_sequence in self._finished:
+                    key, ok = self._finished.pop(self._next_sequence)
+                    if not ok:
+                        self._resume_blocked = True
+                        self._finished.clear()
+                        break
+                    self._resume_key = key
+                    self._next_sequence += 1
+            now = time.monotonic()
+            report = now - self._last_report >= PROGRESS_INTERVAL
+            if report:
+                self._last_report = now
+                resume_key = self._resume_key
+                line = self._progress(now)
+        if report:
+            print(line, flush=True)
+            if resume_key is not None:
+                self.checkpoint.mark_after(resume_key)
+
+    def _progress(self, now):
+        elapsed = now - self._started
+        rate = self.processed / elapsed if elapsed > 0 else 0
+        return (f"{self.processed} processed, {self.failed} failed, {self.skipped} skipped "
+                f"({rate:.1f} images/s, {self.bytes_in / 1e6:.1f} MB in, {self.bytes_out / 1e6:.1f} MB out)")
+
+    def summary(self):
+        elapsed = time.monotonic() - self._started
+        return {
+            'processed': self.processed,
+            'failed': self.failed,
+            'skipped': self.skipped,
+            'bytes_in': self.bytes_in,
+            'bytes_out': self.bytes_out,
+            'wall_time_s': elapsed,
+            'images_per_s': self.processed / elapsed if elapsed > 0 else 0,
+            'resume_after': self._resume_key
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Reprocess every image under an S3 prefix on all cores.")
+    parser.add_argument('--bucket', required=True, help="S3 bucket")
+    parser.add_argument('--prefix', default='input/', help="prefix of the images to process")
+    parser.add_argument('--output-prefix', default='output/', help="prefix the results are written under, keeping the rest of each key")
+    parser.add_argument('--operations', default=','.join(image_ops.DEFAULT_OPERATIONS), help="operations in order, e.g. greyscale")
+    parser.add_argument('--rotation-degrees', type=int, default=180)
+    parser.add_argument('--scale-percent', type=float, default=150)
+    parser.add_argument('--width', type=int, default=None)
+    parser.add_argument('--height', type=int, default=None)
+    parser.add_argument('--maintain-aspect-ratio', action='store_true')
+    parser.add_argument('--resize-policy', default=image_ops.DEFAULT_RESIZE_POLICY, choices=list(image_ops.RESIZE_POLICIES))
+    parser.add_argument('--greyscale-mode', default='L', choices=['L', '1'])
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="image processes (default: number of CPUs)")
+    parser.add_argument('--io-threads', type=int, default=16, help="threads downloading and uploading")
+    parser.add_argument('--in-flight', type=int, default=None, help="images held at once (default: 4 x workers)")
+    parser.add_argument('--checkpoint', default=DEFAULT_CHECKPOINT, help="progress file used to resume")
+    parser.add_argument('--fresh', action='store_true', help="ignore an existing checkpoint and start over")
+    parser.add_argument('--limit', type=int, default=None, help="process at most this many images in this run")
+    parser.add_argument('--region', default=DEFAULT_REGION)
+    args = parser.parse_args()
+
+    if args.output_prefix.startswith(args.prefix):
+        print(f"--output-prefix {args.output_prefix} is inside --prefix {args.prefix}, results would be processed again")
+        return 1
+
+    options = {
+        'operations': image_ops.parse_operations(args.operations),
+        'rotation_degrees': args.rotation_degrees,
+        'scale_percent': args.scale_percent,
+        'width': args.width,
+        'height': args.height,
+        'maintain_aspect_ratio': args.maintain_aspect_ratio,
+        'resize_policy': args.resize_policy,
+        'greyscale_mode': args.greyscale_mode
+    }
+    job = {'bucket': args.bucket, 'prefix': args.prefix, 'output_prefix': args.output_prefix, 'options': options}
+    try:
+        checkpoint = Checkpoint(args.checkpoint, job, args.fresh)
+    except ValueError as e:
+        print(e)
+        return 1
+
+    import boto3
+    from botocore.config import Config
+    s3_client = boto3.client('s3', region_name=args.region,
+                             config=Config(max_pool_connections=args.io_threads))
+
+    if checkpoint.start_after is not None:
+        print(f"Resuming after {checkpoint.start_after} ({len(checkpoint.done)} later images already done)")
+    print(f"Processing s3://{args.bucket}/{args.prefix} -> {args.output_prefix} with {' -> '.join(options['operations'])} "
+          f"on {args.workers} processes...")
+
+    batch = BatchJob(s3_client, args.bucket, args.prefix, args.output_prefix, options, checkpoint,
+                     args.workers, args.io_threads, args.in_flight)
+    try:
+        summary = batch.run(args.limit)
+    except KeyboardInterrupt:
+        print("Interrupted, run again to resume")
+        return 130
+    finally:
+        checkpoint.close()
+
+    print(f"Done: {summary['processed']} processed, {summary['failed']} failed, {summary['skipped']} skipped "
+          f"in {summary['wall_time_s']:.1f}s ({summary['images_per_s']:.1f} images/s)")
+    return 0 if summary['failed'] == 0 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark of the image pipeline transforms on the Kirmizi_Pistachio dataset.
+
+The rotate, resize and greyscale functions, and the fused chain, are run in-process with
+the same image_ops calls and default parameters as their handlers. Images are read
+into memory first, so only decode, transform and encode are timed. Each workload runs
+in its own process so its peak RSS is its own. After warmup, a workload is timed over
+the image set several times, and each result reports:
+
+- images/s: mean and 95% confidence interval over the repetitions
+- ns/image for each phase: decode, transform and encode
+- peak RSS of the workload process
+- Pillow image allocations per image (new images and arena blocks allocated)
+- Python heap peak per image (tracemalloc), from one untimed pass
+
+Encoder settings (see image_ops.get_encoder_settings) can be given with --encoder to
+compare encode time against output bytes, e.g. --encoder output_format=webp.
+
+A run can be saved as a baseline JSON file. Later runs compared against it fail (exit
+code 1) when a workload's images/s falls more than the threshold below the baseline.
+
+Usage:
+    python3 benchmark.py [--images PATH] [--count N] [--warmup N] [--repeat N]
+                         [--workloads rotate,resize,greyscale,fused]
+                         [--encoder KEY=VALUE ...] [--save-baseline FILE] [--baseline FILE]
+                         [--threshold PERCENT] [--json FILE]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import resource
+import statistics
+import sys
+import time
+import tracemalloc
+from datetime import datetime
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# image_ops is identical in every function's src/ folder
+sys.path.insert(0, os.path.join(BASE_DIR, 'python_lambda_rotate', 'src'))
+import image_ops
+from PIL import Image
+
+DEFAULT_IMAGES = os.path.join(BASE_DIR, '..', 'test', 'Kirmizi_Pistachio')
+WORKLOADS = ['rotate', 'resize', 'greyscale', 'fused']
+PHASES = ['decode', 'transform', 'encode']
+
+# Handler defaults
+ROTATION_DEGREES = 180
+SCALE_PERCENT = 150
+GREYSCALE_MODE = 'L'
+
+DEFAULT_COUNT = 100
+DEFAULT_WARMUP = 10
+DEFAULT_REPEAT = 5
+DEFAULT_THRESHOLD = 10.0
+
+# Two-sided 95% Student's t values by degrees of freedom (1.96 beyond the table)
+T_VALUES = {1: 12.706, 2: 4.303, 3: 3.182, 4: 2.776, 5: 2.571, 6: 2.447, 7: 2.365, 8: 2.306, 9: 2.262,
+            10: 2.228, 12: 2.179, 15: 2.131, 20: 2.086, 25: 2.060, 30: 2.042}
+
+
+def t_value(degrees_of_freedom):
+    for df in sorted(T_VALUES, reverse=True):
+        if degrees_of_freedom >= df:
+            return T_VALUES[df] if degrees_of_freedom <= 30 else 1.96
+    return T_VALUES[1]
+
+
+def confidence_interval(values):
+    """
+    Mean and half width of the 95% confidence interval of the mean.
+    """
+    mean = statistics.mean(values)
+    if len(values) < 2:
+        return mean, 0.0
+    return mean, t_value(len(values) - 1) * statistics.stdev(values) / len(values) ** 0.5
+
+
+def process_image(workload, data, image_format, phases, encoder_settings=None):
+    """
+    Run one workload on one image (bytes), adding the ns spent in each phase to phases.
+    """
+    start = time.perf_counter_ns()
+    image = image_ops.open_image(data)
+    if workload in ('resize', 'fused'):
+        # Plan the resize before decoding so JPEG can decode at a reduced scale, as the handlers do
+        size = image.size
+        if workload == 'fused':
+            size = image_ops.get_rotated_size(size, ROTATION_DEGREES)
+        target_width, target_height, resize_mode = image_ops.get_target_size(size, SCALE_PERCENT)
+        if size == image.size:
+            image_ops.draft_image(image, target_width, target_height)
+        else:
+            image_ops.draft_image(image, target_height, target_width)
+    image.load()
+    decoded = time.perf_counter_ns()
+
+    if workload == 'rotate':
+        image = image_ops.rotate_image(image, ROTATION_DEGREES)
+    elif workload == 'resize':
+        image = image_ops.resize_image(image, target_width, target_height)
+    elif workload == 'greyscale':
+        image = image_ops.greyscale_image(image, GREYSCALE_MODE)
+    else:
+        image = image_ops.rotate_image(image, ROTATION_DEGREES)
+        image = image_ops.resize_image(image, target_width, target_height)
+        image = image_ops.greyscale_image(image, GREYSCALE_MODE)
+    transformed = time.perf_counter_ns()
+
+    output = image_ops.encode_image(image, image_format, encoder_settings=encoder_settings)
+    encoded = time.perf_counter_ns()
+
+    phases['decode'] += decoded - start
+    phases['transform'] += transformed - decoded
+    phases['encode'] += encoded - transformed
+    return output.getbuffer().nbytes
+
+
+def run_workload(workload, paths, warmup, repeat, encoder_settings=None):
+    """
+    Benchmark one workload. Runs in its own process.
+    """
+    images = []
+    for path in paths:
+        with open(path, 'rb') as f:
+            images.append((f.read(), image_ops.get_output_format(os.path.splitext(path)[1], encoder_settings)))
+
+    for i in range(warmup):
+        data, image_format = images[i % len(images)]
+        process_image(workload, data, image_format, dict.fromkeys(PHASES, 0), encoder_settings)
+
+    throughputs = []
+    phases = dict.fromkeys(PHASES, 0)
+    output_bytes = 0
+    Image.core.reset_stats()
+    for r in range(repeat):
+        start = time.perf_counter()
+        for data, image_format in images:
+            output_bytes += process_image(workload, data, image_format, phases, encoder_settings)
+        throughputs.append(len(images) / (time.perf_counter() - start))
+    allocations = Image.core.get_stats()
+
+    # Python heap use is traced in a separate pass, tracing slows everything down
+    tracemalloc.start()
+    python_peak = 0
+    for data, image_format in images:
+        tracemalloc.reset_peak()
+        process_image(workload, data, image_format, dict.fromkeys(PHASES, 0), encoder_settings)
+        python_peak = max(python_peak, tracemalloc.get_traced_memory()[1])
+    tracemalloc.stop()
+
+    runs = len(images) * repeat
+    mean, half_width = confidence_interval(throughputs)
+    return {
+        'workload': workload,
+        'images': len(images),
+        'repeat': repeat,
+        'images_per_s': mean,
+        'images_per_s_ci95': half_width,
+        'images_per_s_runs': throughputs,
+        'ns_per_image': {phase: phases[phase] / runs for phase in PHASES},
+        'output_bytes_per_image': output_bytes / runs,
+        # ru_maxrss is in KB on Linux and bytes on macOS
+        'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == 'darwin' else 1024),
+        'pillow_images_per_image': allocations['new_count'] / runs,
+        'pillow_blocks_per_image': allocations['allocated_blocks'] / runs,
+        'python_peak_kb_per_image': python_peak / 1024
+    }
+
+
+def _run_in_child(connection, workload, paths, warmup, repeat, encoder_settings):
+    try:
+        connection.send(run_workload(workload, paths, warmup, repeat, encoder_settings))
+    except Exception as e:
+        connection.send({'workload': workload, 'error': str(e)})
+    connection.close()
+
+
+def run_benchmarks(workloads, paths, warmup, repeat, encoder_settings=None):
+    """
+    Run every workload in a fresh process, one after another.
+    """
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for workload in workloads:
+        print(f"Running {workload} ({len(paths)} images x {repeat} repetitions)...", flush=True)
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=_run_in_child, args=(sender, workload, paths, warmup, repeat, encoder_settings))
+        process.start()
+        sender.close()
+        results.append(receiver.recv())
+        process.join()
+    return results
+
+
+def environment():
+    return {
+        'python': platform.python_version(),
+        'pillow': Image.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor() or platform.machine(),
+        'cpu_count': os.cpu_count()
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Compare images/s with a baseline. Returns the list of regressions found.
+    """
+    previous = {result['workload']: result for result in baseline['results'] if 'error' not in result}
+    regressions = []
+    for result in results:
+        if 'error' in result or result['workload'] not in previous:
+            continue
+        before = previous[result['workload']]
+        change = (result['images_per_s'] - before['images_per_s']) / before['images_per_s'] * 100
+        result['baseline_images_per_s'] = before['images_per_s']
+        result['change_percent'] = change
+        if change < -threshold:
+            regressions.append(result['workload'])
+    return regressions
+
+
+def format_results(results, settings):
+    lines = []
+    lines.append("=" * 120)
+    lines.append("IMAGE PIPELINE BENCHMARK")
+    lines.append("=" * 120)
+    lines.append(f"Images: {settings['images']}   Warmup: {settings['warmup']}   Repetitions: {settings['repeat']}   "
+                 f"Python {settings['environment']['python']}   Pillow {settings['environment']['pillow']}")
+    if settings['encoder']:
+        lines.append("Encoder: " + ", ".join(f"{key}={value}" for key, value in settings['encoder'].items()))
+    lines.append("")
+    lines.append(f"{'Workload':<11} {'Images/s':<20} {'Decode ns':<12} {'Transform ns':<13} {'Encode ns':<12} "
+                 f"{'Out KB':<9} {'Peak RSS':<10} {'Pillow allocs':<14} {'Py peak':<10} {'vs baseline':<12}")
+    lines.append("-" * 120)
+    for result in results:
+        if 'error' in result:
+            lines.append(f"{result['workload']:<11} ERROR: {result['error']}")
+            continue
+        throughput = f"{result['images_per_s']:.2f} ± {result['images_per_s_ci95']:.2f}"
+        ns = result['ns_per_image']
+        change = f"{result['change_percent']:+.1f}%" if 'change_percent' in result else ""
+        lines.append(f"{result['workload']:<11} {throughput:<20} {ns['decode']:<12.0f} {ns['transform']:<13.0f} {ns['encode']:<12.0f} "
+                     f"{result['output_bytes_per_image'] / 1024:<9.1f} {result['peak_rss_mb']:<10.1f} {result['pillow_blocks_per_image']:<14.1f} "
+                     f"{result['python_peak_kb_per_image']:<10.1f} {change:<12}")
+    lines.append("")
+    lines.append("Images/s is the mean ± 95% confidence interval over repetitions. ns and Out KB (encoded size) are per image. Peak RSS is in MB.")
+    lines.append("Pillow allocs are arena blocks allocated per image. Py peak is the largest Python heap peak of one image, in KB.")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the image pipeline transforms on a local image set.")
+    parser.add_argument('--images', default=DEFAULT_IMAGES, help="image folder (default: ../test/Kirmizi_Pistachio)")
+    parser.add_argument('--count', type=int, default=DEFAULT_COUNT, help="images used, in name order (0 for all)")
+    parser.add_argument('--warmup', type=int, default=DEFAULT_WARMUP, help="untimed images processed first")
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help="timed passes over the images")
+    parser.add_argument('--workloads', default=','.join(WORKLOADS), help="comma separated workloads to run")
+    parser.add_argument('--encoder', action='append', default=[], help="KEY=VALUE encoder setting, e.g. quality=85")
+    parser.add_argument('--save-baseline', default=None, help="save the results as a baseline JSON file")
+    parser.add_argument('--baseline', default=None, help="compare with a baseline JSON file")
+    parser.add_argument('--threshold', type=float, default=DEFAULT_THRESHOLD,
+                        help="percent drop in images/s that counts as a regression (default: 10)")
+    parser.add_argument('--json', default=None, help="save the results to a JSON file")
+    args = parser.parse_args()
+
+    workloads = [workload.strip() for workload in args.workloads.split(',') if workload.strip()]
+    for workload in workloads:
+        if workload not in WORKLOADS:
+            parser.error(f"Unknown workload '{workload}'. Supported workloads: {', '.join(WORKLOADS)}")
+
+    try:
+        encoder_settings = image_ops.get_encoder_settings(dict(setting.split('=', 1) for setting in args.encoder))
+    except ValueError as e:
+        parser.error(str(e))
+
+    paths = [os.path.join(args.images, name) for name in sorted(os.listdir(args.images))
+             if name.lower().endswith(image_ops.SUPPORTED_EXTENSIONS)]
+    if args.count > 0:
+        paths = paths[:args.count]
+    if len(paths) == 0:
+        print(f"No images found in {args.images}")
+        return 1
+
+    settings = {
+        'date': datetime.now().isoformat(),
+        'images': len(paths),
+        'warmup': args.warmup,
+        'repeat': args.repeat,
+        'encoder': encoder_settings,
+        'environment': environment()
+    }
+    results = run_benchmarks(workloads, paths, args.warmup, args.repeat, encoder_settings)
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline['settings']['images'] != settings['images'] or baseline['settings']['environment'] != settings['environment']:
+            print("Warning: the baseline was recorded with different images or on a different environment")
+        if baseline['settings'].get('encoder', {}) != encoder_settings:
+            print("Warning: the baseline was recorded with different encoder settings")
+        regressions = compare(results, baseline, args.threshold)
+
+    print("")
+    print(format_results(results, settings))
+
+    output = {'settings': settings, 'results': results}
+    for path in [args.save_baseline, args.json]:
+        if path:
+            with open(path, 'w') as f:
+                json.dump(output, f, indent=2)
+            print(f"Results saved to: {path}")
+
+    if any('error' in result for result in results):
+        return 1
+    if len(regressions) > 0:
+        print(f"\nREGRESSION: images/s fell more than {args.threshold:g}% below the baseline for: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
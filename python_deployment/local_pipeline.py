@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""
+Run the image pipeline locally, without AWS.
+
+Each function's handler.lambda_handler is loaded from its src/ folder and its s3_client
+is replaced with LocalS3, an in-process object store kept in memory or in a folder.
+LocalS3 sends the S3 notifications the bucket triggers would send (input/ -> rotate,
+stage1/ -> resize, stage2/ -> greyscale), and every invocation runs in a shared worker
+pool. Per-stage invocation times and throughput are reported at the end, with no
+network or Lambda scheduling in the numbers.
+
+Usage:
+    python3 local_pipeline.py [--images PATH] [--count N] [--workers N] [--store DIR]
+                              [--fused] [--env KEY=VALUE ...] [--json FILE] [--verbose]
+
+    --images   Image file or folder to upload to input/ (default: ../test/Kirmizi_Pistachio)
+    --count    Number of images to upload, repeating images if needed (default: every image)
+    --workers  Invocations run at once (default: number of CPUs)
+    --store    Keep objects in this folder instead of in memory
+    --fused    Run python_lambda_pipeline on input/ instead of the three single-stage functions
+    --env      Environment variable for the handlers, e.g. --env ROTATION_DEGREES=90
+    --json     Also save the per-stage results to this JSON file
+    --verbose  Show the SAAF output the handlers print
+"""
+import argparse
+import contextlib
+import hashlib
+import importlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import quote_plus
+
+from botocore.exceptions import ClientError
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+DEFAULT_BUCKET = 'local-image-pipeline'
+DEFAULT_IMAGES = os.path.join(BASE_DIR, '..', 'test', 'Kirmizi_Pistachio')
+
+# S3 trigger configuration: key prefix -> function that is invoked for new objects
+STAGES = [
+    ('input/', 'python_lambda_rotate'),
+    ('stage1/', 'python_lambda_resize'),
+    ('stage2/', 'python_lambda_greyscale')
+]
+FUSED_STAGES = [
+    ('input/', 'python_lambda_pipeline')
+]
+
+# Modules every function's src/ folder carries its own copy of
+FUNCTION_MODULES = ['handler', 'image_ops', 's3_io', 'result_cache', 'tiled_ops', 'Inspector', 'ProcReader']
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def _error(code, message, operation):
+    return ClientError({'Error': {'Code': code, 'Message': message}}, operation)
+
+
+class LocalObjectBody:
+    """
+    Streaming body of a get_object response, like botocore's StreamingBody.
+    """
+
+    def __init__(self, data):
+        self._stream = io.BytesIO(data)
+
+    def read(self, amt=None):
+        return self._stream.read(-1 if amt is None else amt)
+
+    def close(self):
+        self._stream.close()
+
+
+class LocalS3:
+    """
+    Stand-in for the boto3 S3 client calls the pipeline functions make.
+
+    Objects are kept in memory, or as files under root when a folder is given. When an
+    object is written (put, completed multipart upload or copy), on_object_created is
+    called with the bucket and key, as an S3 event notification would be.
+    Thread-safe.
+    """
+
+    def __init__(self, root=None, on_object_created=None):
+        self.root = root
+        self.on_object_created = on_object_created
+        self._objects = {}
+        self._uploads = {}
+        self._lock = threading.Lock()
+
+    def _path(self, bucket, key):
+        return os.path.join(self.root, bucket, *key.split('/'))
+
+    def _store(self, bucket, key, data, content_type):
+        data = bytes(data)
+        metadata = {'ETag': '"' + hashlib.md5(data).hexdigest() + '"', 'ContentType': content_type,
+                    'ContentLength': len(data)}
+        if self.root is not None:
+            path = self._path(bucket, key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + '.tmp', 'wb') as f:
+                f.write(data)
+            os.replace(path + '.tmp', path)
+            data = None
+        with self._lock:
+            self._objects[(bucket, key)] = (data, metadata)
+        if self.on_object_created is not None:
+            self.on_object_created(bucket, key)
+        return metadata
+
+    def _load(self, bucket, key, operation):
+        with self._lock:
+            entry = self._objects.get((bucket, key))
+        if entry is None:
+            raise _error('NoSuchKey' if operation != 'HeadObject' else '404', f'{key} does not exist', operation)
+        data, metadata = entry
+        if data is None:
+            with open(self._path(bucket, key), 'rb') as f:
+                data = f.read()
+        return data, metadata
+
+    def upload_file(self, filename, bucket, key, content_type='application/octet-stream'):
+        """
+        Add a local file to the store, like an upload to the bucket.
+        """
+        with open(filename, 'rb') as f:
+            return self._store(bucket, key, f.read(), content_type)
+
+    def get_object(self, Bucket, Key, **kwargs):
+        data, metadata = self._load(Bucket, Key, 'GetObject')
+        return dict(metadata, Body=LocalObjectBody(data))
+
+    def head_object(self, Bucket, Key, **kwargs):
+        data, metadata = self._load(Bucket, Key, 'HeadObject')
+        return dict(metadata)
+
+    def put_object(self, Bucket, Key, Body=b'', ContentType='binary/octet-stream', **kwargs):
+        if hasattr(Body, 'read'):
+            Body = Body.read()
+        metadata = self._store(Bucket, Key, Body, ContentType)
+        return {'ETag': metadata['ETag']}
+
+    def copy_object(self, Bucket, Key, CopySource, **kwargs):
+        data, metadata = self._load(CopySource['Bucket'], CopySource['Key'], 'CopyObject')
+        metadata = self._store(Bucket, Key, data, metadata['ContentType'])
+        return {'CopyObjectResult': {'ETag': metadata['ETag']}}
+
+    def create_multipart_upload(self, Bucket, Key, ContentType='binary/octet-stream', **kwargs):
+        upload_id = uuid.uuid4().hex
+        with self._lock:
+            self._uploads[upload_id] = {'bucket': Bucket, 'key': Key, 'content_type': ContentType, 'parts': {}}
+        return {'Bucket': Bucket, 'Key': Key, 'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs):
+        # The caller reuses its part buffer, so the bytes are copied.
+        data = bytes(Body)
+        with self._lock:
+            if UploadId not in self._uploads:
+                raise _error('NoSuchUpload', f'{UploadId} does not exist', 'UploadPart')
+            self._uploads[UploadId]['parts'][PartNumber] = data
+        return {'ETag': '"' + hashlib.md5(data).hexdigest() + '"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        with self._lock:
+            upload = self._uploads.pop(UploadId, None)
+        if upload is None:
+            raise _error('NoSuchUpload', f'{UploadId} does not exist', 'CompleteMultipartUpload')
+        data = b''.join(upload['parts'][part['PartNumber']] for part in MultipartUpload['Parts'])
+        metadata = self._store(Bucket, Key, data, upload['content_type'])
+        return {'Bucket': Bucket, 'Key': Key, 'ETag': metadata['ETag']}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        with self._lock:
+            self._uploads.pop(UploadId, None)
+        return {}
+
+    def list_objects_v2(self, Bucket, Prefix='', MaxKeys=1000, ContinuationToken=None, StartAfter=None, **kwargs):
+        with self._lock:
+            keys = sorted(key for bucket, key in self._objects if bucket == Bucket and key.startswith(Prefix))
+            sizes = {key: self._objects[(Bucket, key)][1]['ContentLength'] for key in keys}
+        if ContinuationToken is not None:
+            keys = [key for key in keys if key > ContinuationToken]
+        elif StartAfter is not None:
+            keys = [key for key in keys if key > StartAfter]
+        page = keys[:MaxKeys]
+        response = {'Name': Bucket, 'Prefix': Prefix, 'KeyCount': len(page), 'MaxKeys': MaxKeys,
+                    'IsTruncated': len(keys) > MaxKeys}
+        if len(page) > 0:
+            response['Contents'] = [{'Key': key, 'Size': sizes[key]} for key in page]
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = page[-1]
+        return response
+
+    def keys(self, bucket, prefix=''):
+        with self._lock:
+            return sorted(key for b, key in self._objects if b == bucket and key.startswith(prefix))
+
+
+def load_handler(function_name):
+    """
+    Import handler.py of a function from its src/ folder.
+
+    Every function carries its own copies of the shared modules under the same names,
+    so they are imported fresh for each function and removed from sys.modules again.
+    The handler's module-level S3 client is created lazily and never used.
+    """
+    src = os.path.join(BASE_DIR, function_name, 'src')
+    saved = {name: sys.modules.pop(name) for name in FUNCTION_MODULES if name in sys.modules}
+    lazy_init = os.environ.get('LAZY_INIT')
+    os.environ['LAZY_INIT'] = 'true'
+    sys.path.insert(0, src)
+    try:
+        return importlib.import_module('handler')
+    finally:
+        sys.path.remove(src)
+        for name in FUNCTION_MODULES:
+            sys.modules.pop(name, None)
+        sys.modules.update(saved)
+        if lazy_init is None:
+            del os.environ['LAZY_INIT']
+        else:
+            os.environ['LAZY_INIT'] = lazy_init
+
+
+def s3_event(bucket, key):
+    """
+    The event S3 sends a function for a new object.
+    """
+    return {
+        'Records': [{
+            'eventVersion': '2.1',
+            'eventSource': 'aws:s3',
+            'eventName': 'ObjectCreated:Put',
+            's3': {
+                'bucket': {'name': bucket},
+                'object': {'key': quote_plus(key)}
+            }
+        }]
+    }
+
+
+class StageStats:
+    """
+    Timing of the invocations of one stage.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.durations = []
+        self.errors = 0
+        self.first_start = None
+        self.last_end = None
+
+    def add(self, start, end, error):
+        self.durations.append((end - start) * 1000)
+        if error:
+            self.errors += 1
+        self.first_start = start if self.first_start is None else min(self.first_start, start)
+        self.last_end = end if self.last_end is None else max(self.last_end, end)
+
+    def summary(self):
+        durations = sorted(self.durations)
+        count = len(durations)
+        if count == 0:
+            return {'stage': self.name, 'invocations': 0}
+        span = self.last_end - self.first_start
+        return {
+            'stage': self.name,
+            'invocations': count,
+            'errors': self.errors,
+            'avg_ms': sum(durations) / count,
+            'p50_ms': durations[int(0.50 * (count - 1))],
+            'p95_ms': durations[int(0.95 * (count - 1))],
+            'max_ms': durations[-1],
+            'active_s': span,
+            'throughput_per_s': count / span if span > 0 else 0
+        }
+
+
+class LocalPipeline:
+    """
+    Runs the pipeline functions on the notifications of a LocalS3 store.
+    """
+
+    def __init__(self, stages=STAGES, workers=None, root=None, bucket=DEFAULT_BUCKET):
+        self.bucket = bucket
+        self.stages = [(prefix, function_name, load_handler(function_name)) for prefix, function_name in stages]
+        self.stats = {function_name: StageStats(function_name) for prefix, function_name in stages}
+        self.store = LocalS3(root, self._on_object_created)
+        for prefix, function_name, handler in self.stages:
+            handler.s3_client = self.store
+        self.executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1)
+        self._outstanding = 0
+        self._condition = threading.Condition()
+
+    def _on_object_created(self, bucket, key):
+        for prefix, function_name, handler in self.stages:
+            if key.startswith(prefix):
+                with self._condition:
+                    self._outstanding += 1
+                self.executor.submit(self._invoke, function_name, handler, s3_event(bucket, key))
+
+    def _invoke(self, function_name, handler, event):
+        try:
+            start = time.perf_counter()
+            error = False
+            try:
+                result = handler.lambda_handler(event, None)
+                error = 'error' in result
+            except Exception as e:
+                print(f"{function_name} failed: {e}")
+                error = True
+            self.stats[function_name].add(start, time.perf_counter(), error)
+        finally:
+            with self._condition:
+                self._outstanding -= 1
+                self._condition.notify_all()
+
+    def upload(self, filename, key):
+        """
+        Upload an image to the bucket, which triggers the first stage.
+        """
+        extension = os.path.splitext(filename)[1].lower()
+        content_type = 'image/png' if extension == '.png' else 'image/jpeg'
+        self.store.upload_file(filename, self.bucket, key, content_type)
+
+    def wait(self):
+        """
+        Wait until no invocations are queued or running.
+        """
+        with self._condition:
+            while self._outstanding > 0:
+                self._condition.wait()
+
+    def close(self):
+        self.executor.shutdown()
+
+
+def list_images(path):
+    if os.path.isfile(path):
+        return [path]
+    return [os.path.join(path, name) for name in sorted(os.listdir(path)) if name.lower().endswith(IMAGE_EXTENSIONS)]
+
+
+def format_summary(summaries, images, wall_time, workers):
+    lines = []
+    lines.append("=" * 90)
+    lines.append("LOCAL PIPELINE RUN")
+    lines.append("=" * 90)
+    lines.append(f"Images: {images}   Workers: {workers}   Wall time: {wall_time:.2f}s   "
+                 f"Pipeline throughput: {images / wall_time if wall_time > 0 else 0:.2f} images/s")
+    lines.append("")
+    lines.append(f"{'Stage':<26} {'Invocs':<8} {'Errors':<8} {'Avg (ms)':<10} {'p50 (ms)':<10} {'p95 (ms)':<10} {'Max (ms)':<10} {'Inv/s':<8}")
+    lines.append("-" * 90)
+    for summary in summaries:
+        if summary['invocations'] == 0:
+            lines.append(f"{summary['stage']:<26} 0")
+            continue
+        lines.append(f"{summary['stage']:<26} {summary['invocations']:<8} {summary['errors']:<8} {summary['avg_ms']:<10.1f} "
+                     f"{summary['p50_ms']:<10.1f} {summary['p95_ms']:<10.1f} {summary['max_ms']:<10.1f} {summary['throughput_per_s']:<8.2f}")
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the image pipeline locally with an in-process S3 stand-in.")
+    parser.add_argument('--images', default=DEFAULT_IMAGES, help="image file or folder uploaded to input/")
+    parser.add_argument('--count', type=int, default=None, help="number of images to upload (default: every image)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help="invocations run at once")
+    parser.add_argument('--store', default=None, help="keep objects in this folder instead of in memory")
+    parser.add_argument('--fused', action='store_true', help="run python_lambda_pipeline instead of the single-stage functions")
+    parser.add_argument('--env', action='append', default=[], help="KEY=VALUE environment variable for the handlers")
+    parser.add_argument('--json', default=None, help="also save the per-stage results to this JSON file")
+    parser.add_argument('--verbose', action='store_true', help="show the output the handlers print")
+    args = parser.parse_args()
+
+    for setting in args.env:
+        key, value = setting.split('=', 1)
+        os.environ[key] = value
+
+    images = list_images(args.images)
+    if len(images) == 0:
+        print(f"No images found in {args.images}")
+        return 1
+    count = args.count if args.count is not None else len(images)
+
+    pipeline = LocalPipeline(FUSED_STAGES if args.fused else STAGES, args.workers, args.store)
+    print(f"Running {count} images through {', '.join(name for prefix, name in (FUSED_STAGES if args.fused else STAGES))} "
+          f"with {args.workers} workers...")
+
+    output = contextlib.nullcontext() if args.verbose else contextlib.redirect_stdout(io.StringIO())
+    start = time.perf_counter()
+    with output:
+        for i in range(count):
+            filename = images[i % len(images)]
+            name = os.path.basename(filename)
+            key = f"input/{name}" if count <= len(images) else f"input/{i // len(images)}-{name}"
+            pipeline.upload(filename, key)
+        pipeline.wait()
+    wall_time = time.perf_counter() - start
+    pipeline.close()
+
+    summaries = [pipeline.stats[function_name].summary() for prefix, function_name, handler in pipeline.stages]
+    print(format_summary(summaries, count, wall_time, args.workers))
+    outputs = len(pipeline.store.keys(pipeline.bucket, 'output/'))
+    print(f"\nOutput objects: {outputs} of {count}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'images': count, 'workers': args.workers, 'wall_time_s': wall_time,
+                       'outputs': outputs, 'stages': summaries}, f, indent=2)
+        print(f"Results saved to: {args.json}")
+    return 0 if outputs == count else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
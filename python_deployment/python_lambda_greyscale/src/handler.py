@@ -1,11 +1,12 @@
 import json
-import boto3
 import os
-from io import BytesIO
-from PIL import Image
-from Inspector import Inspector
+import image_ops
+import s3_io
+import result_cache
+import tiled_ops
+from Inspector import Inspector, Span
 
-s3_client = boto3.client('s3')
+s3_client = s3_io.create_s3_client()
 
 def lambda_handler(event, context):
     """
@@ -16,25 +17,43 @@ def lambda_handler(event, context):
     - bucket_name: S3 bucket name (required)
     - input_key: Input file to convert (default: auto-detects stage2/*)
     - greyscale_mode: Greyscale conversion mode - 'L' for standard or '1' for binary (default: 'L')
-
-    Event parameters (S3 trigger):
-    - Records[0].s3.bucket.name: S3 bucket name (automatically provided)
-    - Records[0].s3.object.key: S3 object key (automatically provided)
+    - sample_interval_ms: Sample CPU, memory and I/O every N ms while the function runs (default: 0, off)
+    - result_cache: If True, identical content with identical parameters is served from the cache/ prefix with a
+      server-side copy instead of being reprocessed (default: False)
+    - output_format: 'jpeg', 'png' or 'webp' - output format, the output extension is changed to match (default: input format)
+    - quality, optimize, progressive, subsampling, compress_level, webp_method, lossless: Encoder settings
+      (default: Pillow's defaults, see image_ops.get_encoder_settings)
+    - tiled: 'auto', True or False - convert and encode the image in horizontal strips to cap memory (default: 'auto',
+      strips for images over TILE_THRESHOLD_PIXELS pixels). Only 'L' conversion is tiled.
+    - tile_height: Rows per strip in tiled mode (default: 256)
+
+    Event parameters (S3 trigger, or SQS batch of S3 notifications):
+    - Records[].s3.bucket.name: S3 bucket name (automatically provided)
+    - Records[].s3.object.key: S3 object key (automatically provided)
+    - Every record is processed through a thread pool of BATCH_WORKERS threads (default: 4). Failed SQS
+      messages are returned in batchItemFailures, every message when the invocation fails as a whole.
+    - Environment variable RESULT_CACHE: 'true' to enable the result cache (default: 'false')
+    - Environment variable SAMPLE_INTERVAL_MS: Background CPU/memory/I/O sampling interval (default: 0, off)
+    - Environment variables: OUTPUT_FORMAT, ENCODE_QUALITY, ENCODE_OPTIMIZE, JPEG_PROGRESSIVE, JPEG_SUBSAMPLING,
+      PNG_COMPRESS_LEVEL, WEBP_METHOD, WEBP_LOSSLESS (encoder settings when the event does not give them)
     - Environment variable GREYSCALE_MODE: 'L' for standard or '1' for binary (default: 'L')
+    - Environment variables: TILED (default: 'auto'), TILE_HEIGHT (default: 256), TILE_THRESHOLD_PIXELS (default: 16000000)
     """
     # Initialize Inspector for performance monitoring
     inspector = Inspector()
     inspector.inspectAll()
 
     try:
-        # Check if this is an S3 trigger event or manual invocation
-        if 'Records' in event and len(event['Records']) > 0:
-            # S3 trigger event format
-            s3_record = event['Records'][0]['s3']
-            bucket_name = s3_record['bucket']['name']
-            input_key = s3_record['object']['key']
+        inspector.startSampler(int(event.get('sample_interval_ms', os.environ.get('SAMPLE_INTERVAL_MS', 0))))
+        # Check if this is an S3/SQS trigger event or manual invocation
+        records = s3_io.get_event_records(event)
+        if len(records) > 0 or s3_io.is_sqs_event(event):
+            # S3 trigger event format (every record of the batch is processed, SQS test events have none)
             greyscale_mode = os.environ.get('GREYSCALE_MODE', 'L')
-            inspector.addAttribute("trigger_type", "s3_event")
+            if s3_io.is_sqs_event(event):
+                inspector.addAttribute("trigger_type", "sqs_event")
+            else:
+                inspector.addAttribute("trigger_type", "s3_event")
         else:
             # Manual invocation format
             bucket_name = event.get('bucket_name')
@@ -48,7 +67,8 @@ def lambda_handler(event, context):
             input_key = event.get('input_key')
             if not input_key:
                 # List files in stage2/ folder
-                response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix='stage2/')
+                with inspector.span("list"):
+                    response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix='stage2/')
                 if 'Contents' in response and len(response['Contents']) > 0:
                     # Get the first non-empty image file in stage2/
                     for obj in response['Contents']:
@@ -60,7 +80,7 @@ def lambda_handler(event, context):
                             continue
 
                         # Check if it's an image file
-                        if key.lower().endswith(('.jpg', '.jpeg', '.png')):
+                        if key.lower().endswith(image_ops.SUPPORTED_EXTENSIONS):
                             input_key = key
                             break
 
@@ -69,78 +89,25 @@ def lambda_handler(event, context):
                 else:
                     raise ValueError("Could not find input file in stage2/ folder")
 
-        # Extract filename from input_key
-        filename = os.path.basename(input_key)
-        file_extension = os.path.splitext(filename)[1]
-
-        inspector.addAttribute("input_key", input_key)
-        inspector.addAttribute("filename", filename)
-        inspector.addAttribute("greyscale_mode", greyscale_mode)
-
-        # Pipeline tracking for CloudWatch metrics
-        inspector.addAttribute("image_id", filename)
-        inspector.addAttribute("pipeline_stage", "greyscale")
-
-        # Download image from S3
-        inspector.addAttribute("step", "downloading_image")
-        response = s3_client.get_object(Bucket=bucket_name, Key=input_key)
-        image_data = response['Body'].read()
+            records = [{"bucket_name": bucket_name, "input_key": input_key, "message_id": None}]
 
-        original_size = len(image_data)
-        inspector.addAttribute("input_size_bytes", original_size)
+        use_result_cache = result_cache.is_enabled(event)
+        encoder_settings = image_ops.get_encoder_settings(event)
+        tile_mode = tiled_ops.get_tile_mode(event)
+        tile_height = tiled_ops.get_tile_height(event)
 
-        # Open and convert to greyscale
-        inspector.addAttribute("step", "converting_to_greyscale")
-        image = Image.open(BytesIO(image_data))
-
-        original_dimensions = image.size
-        original_mode = image.mode
-        inspector.addAttribute("original_width", original_dimensions[0])
-        inspector.addAttribute("original_height", original_dimensions[1])
-        inspector.addAttribute("original_mode", original_mode)
-
-        # Convert to greyscale
-        greyscale_image = image.convert(greyscale_mode)
-
-        greyscale_dimensions = greyscale_image.size
-        inspector.addAttribute("greyscale_width", greyscale_dimensions[0])
-        inspector.addAttribute("greyscale_height", greyscale_dimensions[1])
-        inspector.addAttribute("greyscale_mode_result", greyscale_image.mode)
-
-        # Save greyscale image to BytesIO
-        output_buffer = BytesIO()
-
-        # Determine format based on extension
-        image_format = 'JPEG'
-        if file_extension.lower() in ['.png']:
-            image_format = 'PNG'
-        elif file_extension.lower() in ['.jpg', '.jpeg']:
-            image_format = 'JPEG'
-
-        greyscale_image.save(output_buffer, format=image_format)
-        output_buffer.seek(0)
-
-        output_size = len(output_buffer.getvalue())
-        inspector.addAttribute("output_size_bytes", output_size)
-
-        # Upload to S3 in output folder with original filename
-        output_key = f"output/{filename}"
-        inspector.addAttribute("step", "uploading_image")
-        s3_client.put_object(
-            Bucket=bucket_name,
-            Key=output_key,
-            Body=output_buffer.getvalue(),
-            ContentType=f'image/{image_format.lower()}'
-        )
-
-        inspector.addAttribute("output_key", output_key)
-        inspector.addAttribute("bucket_name", bucket_name)
-        inspector.addAttribute("image_format", image_format)
-        inspector.addAttribute("message", f"Successfully converted {input_key} to greyscale as {output_key}")
+        # Process every image, overlapping S3 I/O and image work across records
+        results = s3_io.process_records(
+            records,
+            lambda record: process_image(record['bucket_name'], record['input_key'], greyscale_mode, use_result_cache, tile_mode, tile_height, encoder_settings),
+            s3_io.get_batch_workers(event))
+        s3_io.add_batch_results(inspector, records, results)
 
     except Exception as e:
         inspector.addAttribute("error", str(e))
         inspector.addAttribute("message", f"Error converting image to greyscale: {str(e)}")
+        # The batch did not finish, so every SQS message is retried
+        s3_io.add_batch_failure(inspector, event)
 
     # Collect final metrics
     inspector.inspectAllDeltas()
@@ -150,3 +117,117 @@ def lambda_handler(event, context):
     print(json.dumps(result, indent=2))
 
     return result
+
+
+def process_image(bucket_name, input_key, greyscale_mode, use_result_cache, tile_mode='false', tile_height=tiled_ops.DEFAULT_TILE_HEIGHT, encoder_settings=None):
+    """
+    Convert a single image from S3 to greyscale and write it to output/{filename}.
+
+    Returns a dictionary of attributes describing the result.
+    """
+    result = {}
+    try:
+        # Extract filename from input_key
+        filename = os.path.basename(input_key)
+        file_extension = os.path.splitext(filename)[1]
+
+        result["input_key"] = input_key
+        result["filename"] = filename
+        result["greyscale_mode"] = greyscale_mode
+
+        # Output format (the extension follows it) and encoder settings
+        image_format = image_ops.get_output_format(file_extension, encoder_settings)
+        output_filename = image_ops.get_encoded_filename(filename, image_format)
+        result["encoder_settings"] = encoder_settings or {}
+
+        # Pipeline tracking for CloudWatch metrics
+        result["image_id"] = filename
+        result["pipeline_stage"] = "greyscale"
+
+        # Stream image from S3 (the decoder pulls the body as it needs it)
+        input_stream = s3_io.open_s3_stream(s3_client, bucket_name, input_key, result)
+        result["input_size_bytes"] = input_stream.content_length
+
+        # Serve identical content processed with identical parameters from the result cache
+        output_key = f"output/{output_filename}"
+        cache_key = None
+        if use_result_cache and input_stream.etag:
+            with Span(result, "cache"):
+                cache_key = result_cache.get_cache_key("greyscale", input_stream.etag, {"greyscale_mode": greyscale_mode, "encoder": encoder_settings or {}, "tiling": tiled_ops.get_cache_parameters(tile_mode, tile_height)}, os.path.splitext(output_filename)[1])
+                result["cache_key"] = cache_key
+                cached_size = result_cache.lookup(s3_client, bucket_name, cache_key)
+                if cached_size is not None:
+                    input_stream.close()
+                    result_cache.copy(s3_client, bucket_name, cache_key, output_key)
+            if cached_size is not None:
+                result["result_cache"] = "hit"
+                result["output_size_bytes"] = cached_size
+                result["output_key"] = output_key
+                result["bucket_name"] = bucket_name
+                result["message"] = f"Copied cached greyscale result for {input_key} to {output_key}"
+                return result
+            result["result_cache"] = "miss"
+
+        # Parse the image header
+        with Span(result, "decode"):
+            image = image_ops.open_image(input_stream)
+        input_stream.release()
+
+        original_dimensions = image.size
+        original_mode = image.mode
+        result["original_width"] = original_dimensions[0]
+        result["original_height"] = original_dimensions[1]
+        result["original_mode"] = original_mode
+
+        # Very large images are converted and encoded strip by strip, without a full output frame
+        tiled = tiled_ops.use_tiles(tile_mode, original_dimensions) and tiled_ops.can_tile_greyscale(greyscale_mode)
+        result["tiled"] = tiled
+        if tiled:
+            # A JPEG is decoded straight to its luminance channel
+            result["luminance_decode"] = tiled_ops.draft_greyscale(image)
+            with Span(result, "decode"):
+                image.load()
+
+            strip_height = tiled_ops.get_strip_height(image.size, greyscale_mode, image_format, tile_height, encoder_settings)
+            result["strip_height"] = strip_height
+            with s3_io.S3UploadStream(s3_client, bucket_name, output_key, f'image/{image_format.lower()}', spans=result) as output_stream, Span(result, "encode"):
+                result["streamed_encode"] = tiled_ops.encode_strips(
+                    tiled_ops.greyscale_strips(image, greyscale_mode, strip_height),
+                    image.size, greyscale_mode, image_format, output_stream, spans=result, encoder_settings=encoder_settings)
+            greyscale_dimensions = image.size
+            result["greyscale_mode_result"] = greyscale_mode
+        else:
+            # Decode pixels
+            with Span(result, "decode"):
+                image.load()
+
+            # Convert to greyscale
+            with Span(result, "transform"):
+                greyscale_image = image_ops.greyscale_image(image, greyscale_mode)
+            greyscale_dimensions = greyscale_image.size
+            result["greyscale_mode_result"] = greyscale_image.mode
+
+            # Upload to S3 in output folder, encoding straight into the upload
+            with s3_io.S3UploadStream(s3_client, bucket_name, output_key, f'image/{image_format.lower()}', spans=result) as output_stream, Span(result, "encode"):
+                image_ops.encode_image(greyscale_image, image_format, output_stream, encoder_settings)
+
+        result["greyscale_width"] = greyscale_dimensions[0]
+        result["greyscale_height"] = greyscale_dimensions[1]
+        result["output_size_bytes"] = output_stream.bytes_written
+        input_stream.close()
+
+        # Keep a copy of the result for the next identical image
+        if cache_key is not None:
+            with Span(result, "cache"):
+                result["cache_stored"] = result_cache.store(s3_client, bucket_name, output_key, cache_key)
+
+        result["output_key"] = output_key
+        result["bucket_name"] = bucket_name
+        result["image_format"] = image_format
+        result["message"] = f"Successfully converted {input_key} to greyscale as {output_key}"
+
+    except Exception as e:
+        result["error"] = str(e)
+        result["message"] = f"Error converting image to greyscale: {str(e)}"
+
+    return result
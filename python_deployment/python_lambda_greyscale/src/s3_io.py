@@ -0,0 +1,385 @@
+import contextlib
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import unquote_plus
+from Inspector import Span
+
+#
+# S3 event and object I/O helpers shared by the image pipeline functions.
+#
+
+# Number of records processed concurrently for batched S3/SQS events
+DEFAULT_BATCH_WORKERS = 4
+
+# Part size for streamed uploads. S3 requires at least 5 MB for every part but the last.
+UPLOAD_PART_SIZE = 8 * 1024 * 1024
+
+# Reusable multipart part buffers, one per worker thread
+_part_buffers = threading.local()
+
+
+def create_s3_client():
+    """
+    Create the S3 client shared by every invocation in the container.
+
+    With LAZY_INIT=true, importing boto3 and building the client are deferred to the
+    first S3 call, which keeps them out of the cold start Init Duration. Otherwise the
+    client is built immediately. Either way the client is kept for the life of the
+    container, with TCP keep-alive and enough pooled connections for a GET and a PUT
+    per batch worker.
+    """
+    if os.environ.get('LAZY_INIT', 'false').lower() == 'true':
+        return LazyS3Client()
+    return _build_s3_client()
+
+
+def _build_s3_client():
+    import boto3
+    from botocore.config import Config
+
+    workers = int(os.environ.get('BATCH_WORKERS', DEFAULT_BATCH_WORKERS))
+    config = Config(max_pool_connections=max(10, workers * 2), tcp_keepalive=True)
+    return boto3.client('s3', config=config)
+
+
+class LazyS3Client:
+    """
+    Stand-in for a boto3 S3 client that builds the real client on first use.
+    """
+
+    def __init__(self):
+        self._client = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = _build_s3_client()
+        return getattr(self._client, name)
+
+
+def get_event_records(event):
+    """
+    Collect every S3 object referenced by an S3 notification or an SQS batch
+    of S3 notifications.
+
+    Returns a list of records: {"bucket_name", "input_key", "message_id"}.
+    message_id is the SQS messageId (None for direct S3 triggers). An SQS message
+    that cannot be parsed becomes a single record with an "error" attribute, so
+    only that message fails and the rest of the batch is still processed.
+    """
+    records = []
+    for record in event.get('Records', []):
+        if record.get('eventSource') == 'aws:sqs':
+            # SQS message wrapping an S3 notification (test events have no Records)
+            try:
+                body = json.loads(record['body'])
+                message_records = [_parse_s3_record(s3_record, record['messageId']) for s3_record in body.get('Records', [])]
+            except Exception as e:
+                message_records = [{"bucket_name": None, "input_key": None, "message_id": record['messageId'],
+                                    "error": f"Invalid SQS message: {str(e)}"}]
+            records.extend(message_records)
+        elif 's3' in record:
+            records.append(_parse_s3_record(record, None))
+    return records
+
+
+def is_sqs_event(event):
+    """
+    True when the event is an SQS batch, including one whose messages hold no S3 records.
+    """
+    return any(record.get('eventSource') == 'aws:sqs' for record in event.get('Records', []))
+
+
+def _parse_s3_record(record, message_id):
+    # Object keys arrive URL encoded in S3 notifications (e.g. spaces as '+')
+    return {
+        "bucket_name": record['s3']['bucket']['name'],
+        "input_key": unquote_plus(record['s3']['object']['key']),
+        "message_id": message_id
+    }
+
+
+def get_batch_workers(event):
+    """
+    Thread pool size for batched records (event batch_workers or BATCH_WORKERS).
+    """
+    return int(event.get('batch_workers', os.environ.get('BATCH_WORKERS', DEFAULT_BATCH_WORKERS)))
+
+
+def process_records(records, process_record, max_workers=DEFAULT_BATCH_WORKERS):
+    """
+    Run process_record(record) for every record through a bounded thread pool so
+    S3 transfers of one record overlap with Pillow work on another. Pillow and
+    boto3 release the GIL during decode/encode and network I/O.
+
+    Returns the attribute dictionaries of each record, in record order. A record that
+    raises, or that arrived with an "error" from get_event_records, is reported with
+    an "error" attribute instead of failing the batch.
+    """
+    def run(record):
+        start_time = time.time()
+        try:
+            if 'error' in record:
+                raise ValueError(record['error'])
+            result = process_record(record)
+        except Exception as e:
+            result = {"input_key": record['input_key'], "error": str(e)}
+        result['record_runtime'] = int(round((time.time() - start_time) * 1000))
+        return result
+
+    if len(records) == 1:
+        return [run(records[0])]
+
+    workers = max(1, min(max_workers, len(records)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(run, records))
+
+
+def add_batch_results(inspector, records, results):
+    """
+    Report per-record results on the Inspector.
+
+    A single record keeps the flat attribute layout of a one-image invocation. Larger
+    batches are reported as a "records" list with success/failure counts. For SQS
+    batches, failed messages are listed in "batchItemFailures" so only those are
+    retried (requires ReportBatchItemFailures on the event source mapping).
+    """
+    if len(results) == 1:
+        for key, value in results[0].items():
+            inspector.addAttribute(key, value)
+    else:
+        failed = len([result for result in results if 'error' in result])
+        inspector.addAttribute("records", results)
+        inspector.addAttribute("batch_size", len(results))
+        inspector.addAttribute("records_succeeded", len(results) - failed)
+        inspector.addAttribute("records_failed", failed)
+        inspector.addAttribute("message", f"Processed {len(results)} records ({failed} failed)")
+        if any('result_cache' in result for result in results):
+            inspector.addAttribute("cache_hits", len([result for result in results if result.get('result_cache') == "hit"]))
+            inspector.addAttribute("cache_misses", len([result for result in results if result.get('result_cache') == "miss"]))
+
+    if any(record['message_id'] is not None for record in records):
+        failures = []
+        for record, result in zip(records, results):
+            if 'error' in result and record['message_id'] not in failures:
+                failures.append(record['message_id'])
+        inspector.addAttribute("batchItemFailures", [{"itemIdentifier": message_id} for message_id in failures])
+
+
+def add_batch_failure(inspector, event):
+    """
+    Report every message of an SQS batch in "batchItemFailures". Used when an error
+    stops the whole invocation before its records are processed, so the batch is
+    retried instead of deleted. Does nothing for other events.
+    """
+    message_ids = [record['messageId'] for record in event.get('Records', []) if record.get('eventSource') == 'aws:sqs']
+    if message_ids:
+        inspector.addAttribute("batchItemFailures", [{"itemIdentifier": message_id} for message_id in message_ids])
+
+
+def open_s3_stream(s3_client, bucket_name, key, spans=None):
+    """
+    Start a GET for an S3 object and wrap its body in an S3ReadStream.
+    When spans is given, time spent waiting on S3 is recorded there as the download phase.
+    """
+    with _span(spans, "download"):
+        response = s3_client.get_object(Bucket=bucket_name, Key=key)
+    return S3ReadStream(response['Body'], response['ContentLength'], response.get('ETag'), spans)
+
+
+def _span(spans, name):
+    # Span over the dictionary, or a no-op when no dictionary is given
+    if spans is None:
+        return contextlib.nullcontext()
+    return Span(spans, name)
+
+
+class S3ReadStream(io.RawIOBase):
+    """
+    Read-only stream over an S3 object body that the Pillow decoder pulls from
+    incrementally, so the encoded object is never held in memory in full.
+
+    Image.open seeks back to the start while it parses the header, so bytes are
+    recorded until release() is called. Once released the header is replayed one
+    last time for the decoder and then dropped, after which reading is forward only.
+    """
+
+    def __init__(self, body, content_length, etag=None, spans=None):
+        self._body = body
+        self.content_length = content_length
+        self.etag = etag
+        self._spans = spans
+        self._head = bytearray()
+        self._recording = True
+        self._position = 0
+        self._consumed = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def release(self):
+        """
+        Stop recording. Call once the header has been parsed, before pixels are decoded.
+        The recorded header is kept until the next read, since decoders may rewind to it.
+        """
+        self._recording = False
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_CUR:
+            offset += self._position
+        elif whence == io.SEEK_END:
+            offset += self.content_length
+
+        if offset < self._consumed:
+            if self._head is None or offset > len(self._head):
+                raise io.UnsupportedOperation("S3ReadStream cannot seek back past released data")
+        elif offset > self._consumed:
+            # Skip forward by reading and discarding
+            self._position = self._consumed
+            while self._position < offset and self._pull(min(offset - self._position, UPLOAD_PART_SIZE)):
+                pass
+            offset = self._position
+
+        self._position = offset
+        return self._position
+
+    def read(self, size=-1):
+        if size is None:
+            size = -1
+        chunks = []
+
+        # Replay recorded header bytes first
+        if self._head is not None and self._position < len(self._head):
+            end = len(self._head) if size < 0 else min(len(self._head), self._position + size)
+            chunks.append(bytes(self._head[self._position:end]))
+            if size >= 0:
+                size -= end - self._position
+            self._position = end
+
+        if size != 0 and self._position == self._consumed:
+            data = self._pull(size)
+            if data:
+                chunks.append(data)
+
+        self._drop_head()
+        return b''.join(chunks)
+
+    def _pull(self, size):
+        with _span(self._spans, "download"):
+            data = self._body.read(size if size >= 0 else None)
+        if self._recording:
+            self._head += data
+        self._consumed += len(data)
+        self._position = self._consumed
+        return data
+
+    def _drop_head(self):
+        if not self._recording and self._head is not None and self._position >= len(self._head):
+            self._head = None
+
+    def close(self):
+        self._head = None
+        self._body.close()
+        super().close()
+
+
+class S3UploadStream(io.RawIOBase):
+    """
+    Write-only stream that uploads to S3 while an encoder writes to it.
+
+    Output smaller than one part is sent with a single put_object. Larger output is
+    sent as a multipart upload from a reusable per-thread part buffer, so the encoded
+    image is never held in full. Use as a context manager: the upload is completed on
+    a clean exit and aborted if an exception is raised.
+    When spans is given, time spent in S3 calls is recorded there as the upload phase.
+    """
+
+    def __init__(self, s3_client, bucket_name, key, content_type, part_size=UPLOAD_PART_SIZE, spans=None):
+        self._s3_client = s3_client
+        self._spans = spans
+        self._bucket_name = bucket_name
+        self._key = key
+        self._content_type = content_type
+        self._part_size = part_size
+        self._upload_id = None
+        self._parts = []
+        self._part = getattr(_part_buffers, 'buffer', None)
+        if self._part is None:
+            self._part = _part_buffers.buffer = bytearray()
+        del self._part[:]
+        self.bytes_written = 0
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.bytes_written
+
+    def write(self, data):
+        self._part += data
+        self.bytes_written += len(data)
+        if len(self._part) >= self._part_size:
+            self._upload_part()
+        return len(data)
+
+    def _upload_part(self):
+        with _span(self._spans, "upload"):
+            self._send_part()
+
+    def _send_part(self):
+        if self._upload_id is None:
+            response = self._s3_client.create_multipart_upload(
+                Bucket=self._bucket_name, Key=self._key, ContentType=self._content_type)
+            self._upload_id = response['UploadId']
+
+        part_number = len(self._parts) + 1
+        response = self._s3_client.upload_part(
+            Bucket=self._bucket_name, Key=self._key, UploadId=self._upload_id,
+            PartNumber=part_number, Body=self._part)
+        self._parts.append({'ETag': response['ETag'], 'PartNumber': part_number})
+        del self._part[:]
+
+    def finish(self):
+        """
+        Send any buffered bytes and complete the upload.
+        """
+        with _span(self._spans, "upload"):
+            if self._upload_id is None:
+                self._s3_client.put_object(
+                    Bucket=self._bucket_name, Key=self._key, Body=self._part, ContentType=self._content_type)
+            else:
+                if len(self._part) > 0:
+                    self._send_part()
+                self._s3_client.complete_multipart_upload(
+                    Bucket=self._bucket_name, Key=self._key, UploadId=self._upload_id,
+                    MultipartUpload={'Parts': self._parts})
+        del self._part[:]
+
+    def abort(self):
+        """
+        Abandon the upload and free any uploaded parts.
+        """
+        if self._upload_id is not None:
+            self._s3_client.abort_multipart_upload(
+                Bucket=self._bucket_name, Key=self._key, UploadId=self._upload_id)
+        del self._part[:]
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.finish()
+        else:
+            self.abort()
+        self.close()
+        return False
@@ -0,0 +1,99 @@
+from array import array
+
+#
+# Parse-once readers for /proc files used by the SAAF Inspector.
+#
+# A /proc file such as /proc/vmstat or /proc/self/status is a list of lines that start
+# with a key followed by whitespace separated values. The line holding each requested
+# key is found once, on the first read, and later reads go straight to those lines.
+# Keys are matched exactly (pgfault never matches pgmajfault) and re-resolved if the
+# layout of the file ever changes.
+#
+class ProcReader:
+
+    #
+    # @param path   The /proc file to read.
+    # @param fields List of (key, column) pairs. key is the first token of the line
+    #               (including any trailing ':'), column 1 is the first value after it.
+    #
+    def __init__(self, path, fields):
+        self.path = path
+        self.fields = [(key.encode('ascii'), column) for key, column in fields]
+        self.values = array('q', bytes(8 * len(fields)))
+        self.available = True
+        self.__lines = None
+
+    #
+    # Read the requested fields into self.values (preallocated, reused by every read).
+    # Fields whose key is missing read as 0. If the file does not exist, available is
+    # set to False and every value is 0.
+    #
+    # @return The values array, in the order of fields.
+    #
+    def read(self):
+        try:
+            with open(self.path, 'rb') as file:
+                lines = file.read().split(b'\n')
+        except OSError:
+            self.available = False
+            for index in range(len(self.values)):
+                self.values[index] = 0
+            return self.values
+
+        if self.__lines == None or not self.__matches(lines):
+            self.__resolve(lines)
+
+        values = self.values
+        for index, lineIndex in enumerate(self.__lines):
+            if lineIndex < 0:
+                values[index] = 0
+            else:
+                values[index] = int(lines[lineIndex].split()[self.fields[index][1]])
+        return values
+
+    #
+    # Create a reader for the same fields with its own values array, for use on another
+    # thread. Resolved line offsets are shared.
+    #
+    # @return A new ProcReader.
+    #
+    def clone(self):
+        reader = ProcReader(self.path, [])
+        reader.fields = self.fields
+        reader.values = array('q', bytes(8 * len(self.fields)))
+        reader.__lines = self.__lines
+        return reader
+
+    def __matches(self, lines):
+        for index, lineIndex in enumerate(self.__lines):
+            if lineIndex >= 0:
+                if lineIndex >= len(lines):
+                    return False
+                tokens = lines[lineIndex].split(None, 1)
+                if len(tokens) == 0 or tokens[0] != self.fields[index][0]:
+                    return False
+        return True
+
+    def __resolve(self, lines):
+        positions = {}
+        for lineIndex, line in enumerate(lines):
+            tokens = line.split(None, 1)
+            if len(tokens) > 0 and tokens[0] not in positions:
+                positions[tokens[0]] = lineIndex
+        self.__lines = [positions.get(key, -1) for key, column in self.fields]
+
+#
+# Readers shared by every Inspector in the container, so offsets are resolved only once.
+#
+# stat:    Total CPU ticks (user, nice, system, idle, iowait, irq, softirq, steal, guest,
+#          guest_nice), boot time and context switches.
+# meminfo: Total and free memory in kB.
+# vmstat:  Minor + major page faults and major page faults.
+# status:  Resident set size of this process in kB.
+# io:      Bytes read and written by this process (including sockets).
+#
+stat = ProcReader('/proc/stat', [('cpu', column) for column in range(1, 11)] + [('btime', 1), ('ctxt', 1)])
+meminfo = ProcReader('/proc/meminfo', [('MemTotal:', 1), ('MemFree:', 1)])
+vmstat = ProcReader('/proc/vmstat', [('pgfault', 1), ('pgmajfault', 1)])
+status = ProcReader('/proc/self/status', [('VmRSS:', 1)])
+io = ProcReader('/proc/self/io', [('rchar:', 1), ('wchar:', 1)])
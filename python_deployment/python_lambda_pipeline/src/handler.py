@@ -0,0 +1,297 @@
+import json
+import os
+import image_ops
+import s3_io
+import result_cache
+from Inspector import Inspector, Span
+
+s3_client = s3_io.create_s3_client()
+
+def lambda_handler(event, context):
+    """
+    Lambda function to run the full image pipeline in a single invocation.
+    Reads from S3 input/{filename} once, applies the configured chain of operations
+    to the decoded image in memory, and writes only the final result to S3 as output/{filename}
+
+    Event parameters (Manual invocation):
+    - bucket_name: S3 bucket name (required)
+    - input_key: Input file name (default: auto-detects input/*)
+    - operations: Ordered list (or comma separated string) of operations to apply (default: ["rotate", "resize", "greyscale"])
+    - rotation_degrees: Degrees to rotate (default: 180). Positive = counter-clockwise, Negative = clockwise
+    - scale_percent: Scale image by percentage (default: 150). If width/height not specified, uses this.
+    - width: Target width in pixels (optional, overrides scale_percent)
+    - height: Target height in pixels (optional, overrides scale_percent)
+    - maintain_aspect_ratio: If True, maintains aspect ratio when using width/height (default: False)
+    - resize_policy: Quality/speed policy - 'quality', 'balanced' or 'speed' (default: 'balanced')
+    - greyscale_mode: Greyscale conversion mode - 'L' for standard or '1' for binary (default: 'L')
+    - write_intermediate: If True, also writes the result of each intermediate operation to stage{n}/{filename} (default: False)
+    - sample_interval_ms: Sample CPU, memory and I/O every N ms while the function runs (default: 0, off)
+    - result_cache: If True, identical content with identical parameters is served from the cache/ prefix with a
+      server-side copy instead of being reprocessed (default: False)
+    - output_format: 'jpeg', 'png' or 'webp' - output format, the output extension is changed to match (default: input format)
+    - quality, optimize, progressive, subsampling, compress_level, webp_method, lossless: Encoder settings
+      (default: Pillow's defaults, see image_ops.get_encoder_settings)
+
+    Event parameters (S3 trigger, or SQS batch of S3 notifications):
+    - Records[].s3.bucket.name: S3 bucket name (automatically provided)
+    - Records[].s3.object.key: S3 object key (automatically provided)
+    - Every record is processed through a thread pool of BATCH_WORKERS threads (default: 4). Failed SQS
+      messages are returned in batchItemFailures, every message when the invocation fails as a whole.
+    - Environment variable RESULT_CACHE: 'true' to enable the result cache (default: 'false')
+    - Environment variable SAMPLE_INTERVAL_MS: Background CPU/memory/I/O sampling interval (default: 0, off)
+    - Environment variables: OUTPUT_FORMAT, ENCODE_QUALITY, ENCODE_OPTIMIZE, JPEG_PROGRESSIVE, JPEG_SUBSAMPLING,
+      PNG_COMPRESS_LEVEL, WEBP_METHOD, WEBP_LOSSLESS (encoder settings when the event does not give them)
+    - Environment variables: PIPELINE_OPERATIONS (default: rotate,resize,greyscale), ROTATION_DEGREES (default: 180),
+      SCALE_PERCENT (default: 150), WIDTH, HEIGHT, MAINTAIN_ASPECT_RATIO, RESIZE_POLICY (default: 'balanced'),
+      GREYSCALE_MODE (default: 'L'), WRITE_INTERMEDIATE (default: false)
+
+    Note: intermediate objects written to stage1/ and stage2/ will fire any S3 triggers
+    configured on those prefixes for the single-stage functions.
+    """
+    # Initialize Inspector for performance monitoring
+    inspector = Inspector()
+    inspector.inspectAll()
+
+    try:
+        inspector.startSampler(int(event.get('sample_interval_ms', os.environ.get('SAMPLE_INTERVAL_MS', 0))))
+        # Check if this is an S3/SQS trigger event or manual invocation
+        records = s3_io.get_event_records(event)
+        if len(records) > 0 or s3_io.is_sqs_event(event):
+            # S3 trigger event format (every record of the batch is processed, SQS test events have none)
+            operations = image_ops.parse_operations(os.environ.get('PIPELINE_OPERATIONS'))
+            rotation_degrees = int(os.environ.get('ROTATION_DEGREES', 180))
+            scale_percent = int(os.environ.get('SCALE_PERCENT', 150))
+            target_width = int(os.environ.get('WIDTH')) if os.environ.get('WIDTH') else None
+            target_height = int(os.environ.get('HEIGHT')) if os.environ.get('HEIGHT') else None
+            maintain_aspect_ratio = os.environ.get('MAINTAIN_ASPECT_RATIO', 'false').lower() == 'true'
+            resize_policy = os.environ.get('RESIZE_POLICY', image_ops.DEFAULT_RESIZE_POLICY)
+            greyscale_mode = os.environ.get('GREYSCALE_MODE', 'L')
+            write_intermediate = os.environ.get('WRITE_INTERMEDIATE', 'false').lower() == 'true'
+            if s3_io.is_sqs_event(event):
+                inspector.addAttribute("trigger_type", "sqs_event")
+            else:
+                inspector.addAttribute("trigger_type", "s3_event")
+        else:
+            # Manual invocation format
+            bucket_name = event.get('bucket_name')
+            operations = image_ops.parse_operations(event.get('operations'))
+            rotation_degrees = event.get('rotation_degrees', 180)
+            scale_percent = event.get('scale_percent', 150)
+            target_width = event.get('width')
+            target_height = event.get('height')
+            maintain_aspect_ratio = event.get('maintain_aspect_ratio', False)
+            resize_policy = event.get('resize_policy', image_ops.DEFAULT_RESIZE_POLICY)
+            greyscale_mode = event.get('greyscale_mode', 'L')
+            write_intermediate = event.get('write_intermediate', False)
+            inspector.addAttribute("trigger_type", "manual_invoke")
+
+            if not bucket_name:
+                raise ValueError("bucket_name is required in the event")
+
+            # Auto-detect input file in input/ folder
+            input_key = event.get('input_key')
+            if not input_key:
+                # List files in input/ folder
+                with inspector.span("list"):
+                    response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix='input/')
+                if 'Contents' in response and len(response['Contents']) > 0:
+                    # Get the first image file in input/
+                    for obj in response['Contents']:
+                        key = obj['Key']
+                        size = obj['Size']
+
+                        # Skip if it's just the folder itself or empty
+                        if key == 'input/' or size == 0:
+                            continue
+
+                        # Check if it's an image file
+                        if key.lower().endswith(image_ops.SUPPORTED_EXTENSIONS):
+                            input_key = key
+                            break
+
+                    if not input_key:
+                        raise ValueError("Could not find image file (.jpg, .jpeg, .png) in input/ folder")
+                else:
+                    raise ValueError("Could not find input file in input/ folder")
+
+            records = [{"bucket_name": bucket_name, "input_key": input_key, "message_id": None}]
+
+        use_result_cache = result_cache.is_enabled(event)
+        encoder_settings = image_ops.get_encoder_settings(event)
+
+        # Process every image, overlapping S3 I/O and image work across records
+        results = s3_io.process_records(
+            records,
+            lambda record: process_image(record['bucket_name'], record['input_key'], operations, rotation_degrees, scale_percent, target_width, target_height, maintain_aspect_ratio, resize_policy, greyscale_mode, write_intermediate, use_result_cache, encoder_settings),
+            s3_io.get_batch_workers(event))
+        s3_io.add_batch_results(inspector, records, results)
+
+    except Exception as e:
+        inspector.addAttribute("error", str(e))
+        inspector.addAttribute("message", f"Error processing image pipeline: {str(e)}")
+        # The batch did not finish, so every SQS message is retried
+        s3_io.add_batch_failure(inspector, event)
+
+    # Collect final metrics
+    inspector.inspectAllDeltas()
+    result = inspector.finish()
+
+    # Print metrics to CloudWatch logs
+    print(json.dumps(result, indent=2))
+
+    return result
+
+
+def process_image(bucket_name, input_key, operations, rotation_degrees, scale_percent, target_width, target_height, maintain_aspect_ratio, resize_policy, greyscale_mode, write_intermediate, use_result_cache, encoder_settings=None):
+    """
+    Run the configured chain of operations on a single image from S3 and write it to output/{filename}.
+
+    Returns a dictionary of attributes describing the result.
+    """
+    result = {}
+    try:
+        # Extract filename from input_key (remove any path prefix)
+        filename, file_extension = image_ops.get_output_filename(input_key)
+
+        # Output format (the extension follows it) and encoder settings
+        image_format = image_ops.get_output_format(file_extension, encoder_settings)
+        output_filename = image_ops.get_encoded_filename(filename, image_format)
+        result["encoder_settings"] = encoder_settings or {}
+
+        result["input_key"] = input_key
+        result["filename"] = filename
+        result["operations"] = ",".join(operations)
+        result["write_intermediate"] = write_intermediate
+
+        # Pipeline tracking for CloudWatch metrics
+        result["image_id"] = filename
+        result["pipeline_stage"] = "pipeline"
+
+        # Stream image from S3 (the decoder pulls the body as it needs it)
+        input_stream = s3_io.open_s3_stream(s3_client, bucket_name, input_key, result)
+        result["input_size_bytes"] = input_stream.content_length
+
+        # Serve identical content processed with identical parameters from the result cache
+        # (not when intermediate objects are requested, since a hit would skip writing them)
+        output_key = f"output/{output_filename}"
+        cache_key = None
+        if use_result_cache and not write_intermediate and input_stream.etag:
+            with Span(result, "cache"):
+                cache_key = result_cache.get_cache_key("pipeline", input_stream.etag, {"operations": operations, "rotation_degrees": rotation_degrees, "scale_percent": scale_percent, "width": target_width, "height": target_height, "maintain_aspect_ratio": maintain_aspect_ratio, "resize_policy": resize_policy, "greyscale_mode": greyscale_mode, "encoder": encoder_settings or {}}, os.path.splitext(output_filename)[1])
+                result["cache_key"] = cache_key
+                cached_size = result_cache.lookup(s3_client, bucket_name, cache_key)
+                if cached_size is not None:
+                    input_stream.close()
+                    result_cache.copy(s3_client, bucket_name, cache_key, output_key)
+            if cached_size is not None:
+                result["result_cache"] = "hit"
+                result["output_size_bytes"] = cached_size
+                result["output_key"] = output_key
+                result["bucket_name"] = bucket_name
+                result["message"] = f"Copied cached processed result for {input_key} to {output_key}"
+                return result
+            result["result_cache"] = "miss"
+
+        # Parse the image header
+        with Span(result, "decode"):
+            image = image_ops.open_image(input_stream)
+        input_stream.release()
+
+        original_dimensions = image.size
+        result["original_width"] = original_dimensions[0]
+        result["original_height"] = original_dimensions[1]
+        result["original_mode"] = image.mode
+
+        # Plan the first resize against the source geometry so the JPEG decoder can be
+        # asked for a reduced-scale decode before any pixels are loaded. Only right-angle
+        # rotations may come before it, since their output size is known up front.
+        planned_resize = None
+        decode_scale = 1
+        if 'resize' in operations:
+            resize_input_size = original_dimensions
+            for operation in operations[:operations.index('resize')]:
+                if operation == 'rotate' and resize_input_size is not None:
+                    resize_input_size = image_ops.get_rotated_size(resize_input_size, rotation_degrees)
+            if resize_input_size is not None:
+                planned_resize = image_ops.get_target_size(resize_input_size, scale_percent, target_width, target_height)
+                draft_width, draft_height = planned_resize[0], planned_resize[1]
+                if resize_input_size != original_dimensions:
+                    draft_width, draft_height = draft_height, draft_width
+                decode_scale = image_ops.draft_image(image, draft_width, draft_height, resize_policy)
+        result["decode_scale"] = decode_scale
+        result["decoded_width"] = image.size[0]
+        result["decoded_height"] = image.size[1]
+
+        # Decode pixels
+        with Span(result, "decode"):
+            image.load()
+
+        intermediate_keys = []
+        for index, operation in enumerate(operations):
+            with Span(result, "transform"):
+                if operation == 'rotate':
+                    result["rotation_degrees"] = rotation_degrees
+                    result["rotation_method"] = image_ops.get_rotation_method(rotation_degrees)
+                    image = image_ops.rotate_image(image, rotation_degrees)
+                    result["rotated_width"] = image.size[0]
+                    result["rotated_height"] = image.size[1]
+
+                elif operation == 'resize':
+                    if planned_resize is not None:
+                        resize_width, resize_height, resize_mode = planned_resize
+                        planned_resize = None
+                    else:
+                        resize_width, resize_height, resize_mode = image_ops.get_target_size(
+                            image.size, scale_percent, target_width, target_height)
+                    if resize_mode == "percentage":
+                        result["scale_percent"] = scale_percent
+                    result["resize_mode"] = resize_mode
+                    result["target_width"] = resize_width
+                    result["target_height"] = resize_height
+                    result["maintain_aspect_ratio"] = maintain_aspect_ratio
+                    result["resize_policy"] = resize_policy
+
+                    # Aspect ratio is only preserved when explicit width/height are given
+                    image = image_ops.resize_image(
+                        image, resize_width, resize_height,
+                        maintain_aspect_ratio and resize_mode == "absolute", resize_policy)
+                    result["resized_width"] = image.size[0]
+                    result["resized_height"] = image.size[1]
+
+                elif operation == 'greyscale':
+                    result["greyscale_mode"] = greyscale_mode
+                    image = image_ops.greyscale_image(image, greyscale_mode)
+                    result["greyscale_width"] = image.size[0]
+                    result["greyscale_height"] = image.size[1]
+                    result["greyscale_mode_result"] = image.mode
+
+            # Optionally write the intermediate result like the single-stage pipeline does
+            if write_intermediate and index < len(operations) - 1:
+                intermediate_key = f"stage{index + 1}/{output_filename}"
+                with s3_io.S3UploadStream(s3_client, bucket_name, intermediate_key, f'image/{image_format.lower()}', spans=result) as intermediate_stream, Span(result, "encode"):
+                    image_ops.encode_image(image, image_format, intermediate_stream, encoder_settings)
+                intermediate_keys.append(intermediate_key)
+
+        result["intermediate_keys"] = intermediate_keys
+
+        # Upload to S3 in output folder, encoding straight into the upload
+        with s3_io.S3UploadStream(s3_client, bucket_name, output_key, f'image/{image_format.lower()}', spans=result) as output_stream, Span(result, "encode"):
+            image_ops.encode_image(image, image_format, output_stream, encoder_settings)
+        result["output_size_bytes"] = output_stream.bytes_written
+        input_stream.close()
+
+        # Keep a copy of the result for the next identical image
+        if cache_key is not None:
+            with Span(result, "cache"):
+                result["cache_stored"] = result_cache.store(s3_client, bucket_name, output_key, cache_key)
+
+        result["output_key"] = output_key
+        result["bucket_name"] = bucket_name
+        result["image_format"] = image_format
+        result["message"] = f"Successfully processed {input_key} with {' -> '.join(operations)} as {output_key}"
+
+    except Exception as e:
+        result["error"] = str(e)
+        result["message"] = f"Error processing image pipeline: {str(e)}"
+
+    return result
@@ -0,0 +1,358 @@
+import os
+import shutil
+import subprocess
+from io import BytesIO
+from PIL import Image
+
+#
+# Image operations shared by the image pipeline functions.
+#
+
+# File extensions accepted by the pipeline
+SUPPORTED_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp')
+
+# Output formats that can be requested, with the Pillow format and the extension written
+OUTPUT_FORMATS = {
+    'jpeg': ('JPEG', '.jpg'),
+    'png': ('PNG', '.png'),
+    'webp': ('WEBP', '.webp')
+}
+
+# Encoder settings: event parameter -> (environment variable, type). Settings that are
+# not given keep Pillow's defaults.
+ENCODER_SETTINGS = {
+    'output_format': ('OUTPUT_FORMAT', str),
+    'quality': ('ENCODE_QUALITY', int),
+    'optimize': ('ENCODE_OPTIMIZE', bool),
+    'progressive': ('JPEG_PROGRESSIVE', bool),
+    'subsampling': ('JPEG_SUBSAMPLING', str),
+    'compress_level': ('PNG_COMPRESS_LEVEL', int),
+    'webp_method': ('WEBP_METHOD', int),
+    'lossless': ('WEBP_LOSSLESS', bool)
+}
+JPEG_SUBSAMPLING = ('4:4:4', '4:2:2', '4:2:0')
+
+# Modes JPEG can store; others are converted before encoding
+JPEG_MODES = ('1', 'L', 'RGB', 'CMYK')
+
+# Default order of operations for the fused pipeline
+DEFAULT_OPERATIONS = ['rotate', 'resize', 'greyscale']
+
+# Resize quality/speed policies mapped to a Pillow reducing_gap. None decodes the
+# full frame and resamples it in a single LANCZOS pass. Smaller gaps let the JPEG
+# decoder (draft) and reduce() shrink more of the image before the final resample.
+RESIZE_POLICIES = {
+    'quality': None,
+    'balanced': 2.0,
+    'speed': 1.0
+}
+DEFAULT_RESIZE_POLICY = 'balanced'
+
+# Counter-clockwise right-angle rotations mapped to Pillow transpose operations
+TRANSPOSE_METHODS = {
+    90: Image.Transpose.ROTATE_90,
+    180: Image.Transpose.ROTATE_180,
+    270: Image.Transpose.ROTATE_270
+}
+
+# Locations searched for a jpegtran binary used by lossless JPEG rotation.
+# Bundle one in src/dependencies/ or point JPEGTRAN_PATH at it.
+JPEGTRAN_DEPENDENCY = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'dependencies', 'jpegtran')
+
+
+def get_image_format(file_extension):
+    """
+    Determine the Pillow output format from a file extension.
+    Defaults to JPEG for anything that is not a PNG or WebP.
+    """
+    if file_extension.lower() in ['.png']:
+        return 'PNG'
+    if file_extension.lower() in ['.webp']:
+        return 'WEBP'
+    return 'JPEG'
+
+
+def get_encoder_settings(event):
+    """
+    Output encoder settings from the event, or else from the environment variables
+    in ENCODER_SETTINGS:
+    - output_format: 'jpeg', 'png' or 'webp' (default: the format of the input extension)
+    - quality: JPEG (1-95, Pillow default 75) or WebP (0-100, default 80) quality
+    - optimize: JPEG optimized Huffman tables / PNG smallest output (default: False)
+    - progressive: Progressive JPEG (default: False)
+    - subsampling: JPEG chroma subsampling '4:4:4', '4:2:2' or '4:2:0' (default: '4:2:0')
+    - compress_level: PNG zlib level 0-9 (default: 6)
+    - webp_method: WebP effort 0 (fast) to 6 (small) (default: 4)
+    - lossless: Lossless WebP (default: False)
+
+    Returns a dictionary with the settings that are given.
+    """
+    settings = {}
+    for key, (variable, value_type) in ENCODER_SETTINGS.items():
+        value = event.get(key, os.environ.get(variable))
+        if value is None or value == '':
+            continue
+        if value_type is bool:
+            value = value if isinstance(value, bool) else str(value).lower() == 'true'
+        elif value_type is int:
+            value = int(value)
+        else:
+            value = str(value).lower()
+        settings[key] = value
+
+    if settings.get('output_format') == 'auto':
+        del settings['output_format']
+    if 'output_format' in settings and settings['output_format'] not in OUTPUT_FORMATS:
+        raise ValueError(f"Unknown output_format '{settings['output_format']}'. Supported formats: {', '.join(OUTPUT_FORMATS)}")
+    if 'subsampling' in settings and settings['subsampling'] not in JPEG_SUBSAMPLING:
+        raise ValueError(f"Unknown subsampling '{settings['subsampling']}'. Supported values: {', '.join(JPEG_SUBSAMPLING)}")
+    if not 0 <= settings.get('quality', 0) <= 100:
+        raise ValueError("quality must be between 0 and 100")
+    if not 0 <= settings.get('compress_level', 0) <= 9:
+        raise ValueError("compress_level must be between 0 and 9")
+    if not 0 <= settings.get('webp_method', 0) <= 6:
+        raise ValueError("webp_method must be between 0 and 6")
+    return settings
+
+
+def get_output_format(file_extension, encoder_settings=None):
+    """
+    Pillow format to write: the requested output_format, or else the format of the input extension.
+    """
+    if encoder_settings and 'output_format' in encoder_settings:
+        return OUTPUT_FORMATS[encoder_settings['output_format']][0]
+    return get_image_format(file_extension)
+
+
+def get_encoded_filename(filename, image_format):
+    """
+    Output filename for an image written in image_format. The extension is only
+    replaced when it does not match the format.
+    """
+    name, file_extension = os.path.splitext(filename)
+    if get_image_format(file_extension) == image_format:
+        return filename
+    for output_format, extension in OUTPUT_FORMATS.values():
+        if output_format == image_format:
+            return name + extension
+    return filename
+
+
+def get_save_options(image_format, encoder_settings=None):
+    """
+    Pillow save() options of the encoder settings that apply to image_format.
+    """
+    settings = encoder_settings or {}
+    if image_format == 'JPEG':
+        keys = {'quality': 'quality', 'optimize': 'optimize', 'progressive': 'progressive', 'subsampling': 'subsampling'}
+    elif image_format == 'PNG':
+        keys = {'compress_level': 'compress_level', 'optimize': 'optimize'}
+    elif image_format == 'WEBP':
+        keys = {'quality': 'quality', 'webp_method': 'method', 'lossless': 'lossless'}
+    else:
+        keys = {}
+    return {option: settings[key] for key, option in keys.items() if key in settings}
+
+
+def parse_operations(operations):
+    """
+    Normalize an operation chain given as a list or a comma separated string
+    (e.g. "rotate,resize,greyscale") into a list of operation names.
+    """
+    if operations is None or operations == '':
+        return list(DEFAULT_OPERATIONS)
+    if isinstance(operations, str):
+        operations = operations.split(',')
+
+    parsed = [str(operation).strip().lower() for operation in operations if str(operation).strip()]
+    for operation in parsed:
+        if operation not in DEFAULT_OPERATIONS:
+            raise ValueError(f"Unknown operation '{operation}'. Supported operations: {', '.join(DEFAULT_OPERATIONS)}")
+    return parsed
+
+
+def open_image(data):
+    """
+    Open an image from raw bytes or a readable stream.
+    Only the header is parsed; pixels are decoded when first needed.
+    """
+    if isinstance(data, (bytes, bytearray)):
+        data = BytesIO(data)
+    return Image.open(data)
+
+
+def get_rotation_method(rotation_degrees):
+    """
+    Name of the method rotate_image uses for an angle:
+    'none', 'transpose' for right-angle multiples, or 'resample'.
+    """
+    angle = rotation_degrees % 360
+    if angle == 0:
+        return "none"
+    if angle in TRANSPOSE_METHODS:
+        return "transpose"
+    return "resample"
+
+
+def rotate_image(image, rotation_degrees):
+    """
+    Rotate an image by the specified degrees (positive = counter-clockwise).
+    Right-angle multiples use transpose(), a pure memory permutation. Other angles
+    go through the affine resampler with expand=True so nothing is cropped.
+    """
+    angle = rotation_degrees % 360
+    if angle == 0:
+        return image
+    if angle in TRANSPOSE_METHODS:
+        return image.transpose(TRANSPOSE_METHODS[angle])
+    return image.rotate(rotation_degrees, expand=True)
+
+
+def find_jpegtran():
+    """
+    Locate a jpegtran binary (JPEGTRAN_PATH, src/dependencies/jpegtran, then PATH).
+    Returns None if none is available.
+    """
+    for path in [os.environ.get('JPEGTRAN_PATH'), JPEGTRAN_DEPENDENCY]:
+        if path and os.path.isfile(path) and os.access(path, os.X_OK):
+            return path
+    return shutil.which('jpegtran')
+
+
+def rotate_jpeg_lossless(data, rotation_degrees):
+    """
+    Rotate JPEG bytes in the DCT domain with jpegtran. There is no decode or
+    re-encode, so no generational quality loss, and EXIF/metadata markers are kept.
+
+    Returns a BytesIO buffer positioned at the start, or None when the angle is not
+    a right-angle multiple, jpegtran is unavailable, or the image cannot be
+    transformed perfectly (partial edge blocks). Callers fall back to rotate_image.
+    """
+    angle = rotation_degrees % 360
+    if angle not in TRANSPOSE_METHODS:
+        return None
+
+    jpegtran = find_jpegtran()
+    if jpegtran is None:
+        return None
+
+    # jpegtran rotates clockwise, Pillow angles are counter-clockwise
+    clockwise = str(360 - angle)
+    try:
+        result = subprocess.run([jpegtran, '-rotate', clockwise, '-perfect', '-copy', 'all'],
+                                input=data, capture_output=True, timeout=60)
+    except (OSError, subprocess.SubprocessError):
+        return None
+    if result.returncode != 0 or not result.stdout:
+        return None
+    return BytesIO(result.stdout)
+
+
+def get_rotated_size(size, rotation_degrees):
+    """
+    Size of an image after a right-angle rotation, or None if the angle is not
+    a multiple of 90 degrees.
+    """
+    if rotation_degrees % 90 != 0:
+        return None
+    if (rotation_degrees // 90) % 2 == 1:
+        return (size[1], size[0])
+    return (size[0], size[1])
+
+
+def get_reducing_gap(resize_policy):
+    """
+    Look up the Pillow reducing_gap for a resize policy.
+    """
+    if resize_policy not in RESIZE_POLICIES:
+        raise ValueError(f"Unknown resize_policy '{resize_policy}'. Supported policies: {', '.join(RESIZE_POLICIES)}")
+    return RESIZE_POLICIES[resize_policy]
+
+
+def draft_image(image, target_width, target_height, resize_policy=DEFAULT_RESIZE_POLICY):
+    """
+    Ask the JPEG decoder for a reduced-scale (DCT scaled) decode when downscaling.
+    Must be called before the pixel data is loaded. Other formats are left untouched.
+
+    Returns the decode scale denominator (1, 2, 4 or 8).
+    """
+    reducing_gap = get_reducing_gap(resize_policy)
+    if reducing_gap is None or image.format != 'JPEG':
+        return 1
+
+    original_width = image.size[0]
+    requested_size = (max(int(target_width * reducing_gap), 1), max(int(target_height * reducing_gap), 1))
+    result = image.draft(image.mode, requested_size)
+    if result is None:
+        return 1
+    return round(original_width / result[1][2])
+
+
+def get_target_size(original_size, scale_percent=150, target_width=None, target_height=None):
+    """
+    Calculate target dimensions for a resize.
+    If width and height are not specified, scale_percent is used.
+
+    Returns (target_width, target_height, resize_mode)
+    """
+    if target_width is None and target_height is None:
+        target_width = int(original_size[0] * scale_percent / 100)
+        target_height = int(original_size[1] * scale_percent / 100)
+        return target_width, target_height, "percentage"
+    return target_width, target_height, "absolute"
+
+
+def resize_image(image, target_width, target_height, maintain_aspect_ratio=False, resize_policy=DEFAULT_RESIZE_POLICY):
+    """
+    Resize an image to the target dimensions with LANCZOS resampling.
+    When maintain_aspect_ratio is True the image is fit within the target box instead.
+    The resize_policy decides how much of the reduction may happen before the final resample.
+    """
+    reducing_gap = get_reducing_gap(resize_policy)
+    if maintain_aspect_ratio:
+        # Calculate aspect ratio preserving dimensions
+        image.thumbnail((target_width, target_height), Image.Resampling.LANCZOS, reducing_gap=reducing_gap)
+        return image
+
+    # Resize to exact dimensions
+    return image.resize((target_width, target_height), Image.Resampling.LANCZOS, reducing_gap=reducing_gap)
+
+
+def greyscale_image(image, greyscale_mode='L'):
+    """
+    Convert an image to greyscale - 'L' for standard or '1' for binary.
+    """
+    return image.convert(greyscale_mode)
+
+
+def encode_image(image, image_format, output_buffer=None, encoder_settings=None):
+    """
+    Encode an image into output_buffer (any writable stream, e.g. an S3 upload stream)
+    with the encoder settings from get_encoder_settings (Pillow defaults when None).
+    A new BytesIO is used when none is given. The buffer is returned, positioned at the
+    start when it is seekable.
+    """
+    if output_buffer is None:
+        output_buffer = BytesIO()
+    if image_format == 'JPEG' and image.mode not in JPEG_MODES:
+        # JPEG has no alpha or palette
+        image = image.convert('L' if image.mode in ('LA', 'La', 'I', 'I;16', 'F') else 'RGB')
+    image.save(output_buffer, format=image_format, **get_save_options(image_format, encoder_settings))
+    if output_buffer.seekable():
+        output_buffer.seek(0)
+    return output_buffer
+
+
+def get_output_filename(input_key):
+    """
+    Extract the filename from an S3 key (remove any path prefix).
+    Adds a .jpeg extension when the key has none.
+
+    Returns (filename, file_extension)
+    """
+    filename = os.path.basename(input_key)
+    file_extension = os.path.splitext(filename)[1]
+    if not file_extension:
+        file_extension = '.jpeg'
+        filename = filename + file_extension
+    return filename, file_extension
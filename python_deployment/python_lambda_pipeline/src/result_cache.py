@@ -0,0 +1,74 @@
+import hashlib
+import json
+import os
+
+#
+# Content-addressed cache of stage results, shared by the image pipeline functions.
+#
+# A result is keyed by the source object's ETag (the MD5 of its bytes for single part
+# uploads) plus a fingerprint of the stage and its parameters, and stored under
+# cache/ in the same bucket. Identical content is then served with a server-side
+# copy instead of a download, decode, transform, encode and upload.
+#
+
+# Bump when a code change alters the output for the same parameters
+CACHE_VERSION = 1
+
+DEFAULT_CACHE_PREFIX = 'cache/'
+
+
+def is_enabled(event):
+    """
+    Whether the result cache is used (event result_cache or RESULT_CACHE, default off).
+    """
+    value = event.get('result_cache', os.environ.get('RESULT_CACHE', 'false'))
+    return value if isinstance(value, bool) else str(value).lower() == 'true'
+
+
+def get_cache_key(stage, etag, parameters, file_extension):
+    """
+    Build the cache key for a stage result: {prefix}{stage}/{etag}-{fingerprint}{ext}.
+    parameters holds every option that changes the stage output.
+    """
+    fingerprint = json.dumps({"version": CACHE_VERSION, "stage": stage, "parameters": parameters}, sort_keys=True)
+    digest = hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()[:16]
+    prefix = os.environ.get('RESULT_CACHE_PREFIX', DEFAULT_CACHE_PREFIX)
+    source_id = etag.strip('"')
+    return f"{prefix}{stage}/{source_id}-{digest}{file_extension.lower()}"
+
+
+def lookup(s3_client, bucket_name, cache_key):
+    """
+    Return the size in bytes of a cached result, or None on a miss.
+    Lookup errors (e.g. missing s3:GetObject on cache/) are treated as a miss.
+    """
+    from botocore.exceptions import ClientError
+    try:
+        response = s3_client.head_object(Bucket=bucket_name, Key=cache_key)
+    except ClientError:
+        return None
+    return response['ContentLength']
+
+
+def copy(s3_client, bucket_name, source_key, destination_key):
+    """
+    Server-side copy of an object within the bucket (no bytes pass through the function).
+    """
+    s3_client.copy_object(
+        Bucket=bucket_name,
+        Key=destination_key,
+        CopySource={'Bucket': bucket_name, 'Key': source_key}
+    )
+
+
+def store(s3_client, bucket_name, output_key, cache_key):
+    """
+    Keep a server-side copy of a freshly written result under its cache key.
+    Returns False instead of failing the record when the copy cannot be made.
+    """
+    from botocore.exceptions import ClientError
+    try:
+        copy(s3_client, bucket_name, output_key, cache_key)
+    except ClientError:
+        return False
+    return True
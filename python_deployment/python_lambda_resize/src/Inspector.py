@@ -5,7 +5,9 @@ import subprocess
 import re
 import uuid
 import shlex
+import threading
 import time
+import ProcReader
 
 #
 # Execute a bash command and get the output.
@@ -16,12 +18,76 @@ import time
 def runCommand(command):
     return os.popen(command).read()
 
+#
+# Read a whole file, returning an empty string if it does not exist.
+#
+# @param path The file to read.
+# @return The contents of the file.
+#
+def readFile(path):
+    try:
+        with open(path, 'r') as file:
+            return file.read()
+    except OSError:
+        return ''
+
 #
 # Global variables that will persist through multiple invocations.
 #
+# static_facts: Values that cannot change during the life of a container (CPU info,
+#               kernel version, vmID). Collected on first use and reused afterwards.
+#
 invocations = 0
 initialization_time = int(round(time.time() * 1000))
-ticks_per_second = int(runCommand("getconf CLK_TCK"))
+ticks_per_second = os.sysconf('SC_CLK_TCK')
+static_facts = {}
+span_stack = threading.local()
+
+#
+# Time a phase of the function with monotonic nanosecond clocks.
+#
+#   with Span(attributes, "download"):
+#       ...
+#
+# Adds <name>TimeNs (wall time) and <name>CpuTimeNs (CPU time of the calling thread) to
+# attributes, accumulating if the phase runs more than once. Spans may be nested: a span only
+# records its own time, and the time of spans opened inside it is reported under their names.
+# If the phase raises, its name is recorded as errorPhase.
+#
+class Span:
+
+    def __init__(self, attributes, name):
+        self.__attributes = attributes
+        self.__name = name
+        self.__childTime = 0
+        self.__childCpuTime = 0
+
+    def __enter__(self):
+        stack = getattr(span_stack, 'spans', None)
+        if stack is None:
+            stack = span_stack.spans = []
+        stack.append(self)
+        self.__startTime = time.perf_counter_ns()
+        self.__startCpuTime = time.thread_time_ns()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        elapsedTime = time.perf_counter_ns() - self.__startTime
+        elapsedCpuTime = time.thread_time_ns() - self.__startCpuTime
+
+        stack = span_stack.spans
+        stack.pop()
+        if len(stack) > 0:
+            stack[-1].__childTime += elapsedTime
+            stack[-1].__childCpuTime += elapsedCpuTime
+
+        timeKey = self.__name + 'TimeNs'
+        cpuTimeKey = self.__name + 'CpuTimeNs'
+        self.__attributes[timeKey] = self.__attributes.get(timeKey, 0) + elapsedTime - self.__childTime
+        self.__attributes[cpuTimeKey] = self.__attributes.get(cpuTimeKey, 0) + elapsedCpuTime - self.__childCpuTime
+        if exc_type is not None and 'errorPhase' not in self.__attributes:
+            self.__attributes['errorPhase'] = self.__name
+        return False
 
 #
 # SAAF
@@ -66,6 +132,11 @@ class Inspector:
         self.__inspectedPlatformDelta = False
         self.__inspectedLinux = False
         self.__inspectedLinuxDelta = False
+
+        self.__sampler = None
+        self.__samplerStop = None
+        self.__samplerInterval = 0
+        self.__samples = []
         
     #
     # Collect information about the runtime container.
@@ -78,7 +149,10 @@ class Inspector:
 
         myUuid = ''
         newContainer = 1
-        if os.path.isfile('/tmp/container-id'):
+        if 'uuid' in static_facts:
+            myUuid = static_facts['uuid']
+            newContainer = 0
+        elif os.path.isfile('/tmp/container-id'):
             stampFile = open('/tmp/container-id', 'r')
             stampID = stampFile.readline()
             myUuid = stampID
@@ -89,6 +163,7 @@ class Inspector:
             myUuid = str(uuid.uuid4())
             stampFile.write(myUuid)
             stampFile.close()
+        static_facts['uuid'] = myUuid
             
         self.__attributes['uuid'] = myUuid
         self.__attributes['newcontainer'] = newContainer
@@ -103,8 +178,16 @@ class Inspector:
     # cpuInfo:    Detailed information about all aspects of the CPU.
     #
     def inspectCPUInfo(self):
-        with open('/proc/cpuinfo', 'r') as file:
-            cpuInfo = file.read()
+        if 'cpuInfo' not in static_facts:
+            static_facts['cpuInfo'] = self.__parseCPUInfo()
+        self.__attributes.update(static_facts['cpuInfo'])
+
+    #
+    # Parse /proc/cpuinfo into the attributes described by inspectCPUInfo.
+    #
+    def __parseCPUInfo(self):
+        attributes = {}
+        cpuInfo = readFile('/proc/cpuinfo')
         lines = cpuInfo.split('\n')
         
         cpu_info = {}
@@ -132,19 +215,21 @@ class Inspector:
                 pass
             
         if 'model_name' in core_list[0]:
-            self.__attributes['cpuType'] = core_list[0]['model_name']
-            self.__attributes['cpuModel'] = core_list[0]['model']
-            self.__attributes['architecture'] = "x86"
+            attributes['cpuType'] = core_list[0]['model_name']
+            attributes['cpuModel'] = core_list[0]['model']
+            attributes['architecture'] = "x86"
         else:
             list_len = len(core_list) - 1
             if 'Model' in core_list[list_len]:
-                self.__attributes['cpuModel'] = core_list[list_len]['Model']
-            self.__attributes['architecture'] = "arm64"
-        self.__attributes['cpuCores'] = int(cpu_count)
-        self.__attributes['cpuInfo'] = core_list
+                attributes['cpuModel'] = core_list[list_len]['Model']
+            attributes['architecture'] = "arm64"
+        attributes['cpuCores'] = int(cpu_count)
+        attributes['cpuInfo'] = core_list
+        return attributes
         
     #
-    # Collect timing CPU metrics
+    # Collect timing CPU metrics. Only the total CPU line, boot time and context
+    # switches are read, through the shared ProcReader for /proc/stat.
     #
     def pollCPUStats(self):
         global ticks_per_second
@@ -152,31 +237,14 @@ class Inspector:
         timeStamp = int(round(time.time() * 1000))
 
         cpuValues = ["cpuUser", "cpuNice", "cpuKernel", "cpuIdle", "cpuIOWait", "cpuIrq", "cpuSoftIrq", "cpuSteal", "cpuGuest", "cpuGuestNice"]
-        data = {"time": timeStamp}
-        
         tick_rate = 1000 / ticks_per_second
 
-        with open('/proc/stat', 'r') as file:
-            stats = file.read()
-        lines = stats.split('\n')
-        lines[0] = lines[0].replace("cpu  ", "cpuTotal ")
-        
-        for line in lines:
-            values = line.split(" ")
-            title = values[0].strip()
-            
-            if ("cpu" in title):
-                index = 1
-                stats = {}
-                for value in cpuValues:
-                    stats[value] = int(values[index]) * (tick_rate)
-                    index += 1
-                data[title] = stats
-            else:
-                if len(values) >= 2:
-                    data[title] = int(values[1])
-                    
-        self.__cpuPolls.append(data)
+        values = ProcReader.stat.read()
+        stats = {}
+        for index, value in enumerate(cpuValues):
+            stats[value] = values[index] * tick_rate
+
+        self.__cpuPolls.append({"time": timeStamp, "cpuTotal": stats, "btime": values[10], "ctxt": values[11]})
         
         
     #
@@ -250,23 +318,14 @@ class Inspector:
     #
     def inspectMemory(self):
         self.__inspectedMemory = True
-        memInfo = ""
-        with open('/proc/meminfo', 'r') as file:
-            memInfo = file.read()
-        lines = memInfo.split('\n')
-        self.__attributes['totalMemory'] = int(lines[0].replace("MemTotal:", "").replace(" kB", "").strip())
-        self.__attributes['freeMemory'] = int(lines[1].replace("MemFree:", "").replace(" kB", "").strip())
-
-        if os.path.isfile('/proc/vmstat'):
-            vmStat = ""
-            with open('/proc/vmstat', 'r') as file:
-                vmStat = file.read()
-            lines = vmStat.split("\n")
-            for line in lines:
-                if 'pgfault' in line:
-                    self.__attributes['pageFaults'] = int(line.split(' ')[1])
-                elif 'mgmajfault' in line:
-                    self.__attributes['majorPageFaults'] = int(line.split(' ')[1])
+        memInfo = ProcReader.meminfo.read()
+        self.__attributes['totalMemory'] = memInfo[0]
+        self.__attributes['freeMemory'] = memInfo[1]
+
+        vmStat = ProcReader.vmstat.read()
+        if ProcReader.vmstat.available:
+            self.__attributes['pageFaults'] = vmStat[0]
+            self.__attributes['majorPageFaults'] = vmStat[1]
         else:
             self.__attributes['SAAFMemoryError'] = "/proc/vmstat does not exist!"
 
@@ -279,16 +338,10 @@ class Inspector:
     def inspectMemoryDelta(self):
         if (self.__inspectedMemory):
             self.__inspectedMemoryDelta = True
-            if os.path.isfile('/proc/vmstat'):
-                vmStat = ""
-                with open('/proc/vmstat', 'r') as file:
-                    vmStat = file.read()
-                lines = vmStat.split("\n")
-                for line in lines:
-                    if 'pgfault' in line:
-                        self.__attributes['pageFaultsDelta'] = int(line.split(' ')[1]) - self.__attributes['pageFaults']
-                    elif 'mgmajfault' in line:
-                        self.__attributes['majorPageFaultsDelta'] = int(line.split(' ')[1]) - self.__attributes['majorPageFaults']
+            vmStat = ProcReader.vmstat.read()
+            if ProcReader.vmstat.available:
+                self.__attributes['pageFaultsDelta'] = vmStat[0] - self.__attributes['pageFaults']
+                self.__attributes['majorPageFaultsDelta'] = vmStat[1] - self.__attributes['majorPageFaults']
             else:
                 self.__attributes['SAAFMemoryDeltaError'] = "/proc/vmstat does not exist!"
         else:
@@ -315,8 +368,14 @@ class Inspector:
             self.__attributes['functionMemory'] = os.environ.get('AWS_LAMBDA_FUNCTION_MEMORY_SIZE', None)
             self.__attributes['functionRegion'] = os.environ.get('AWS_REGION', None)
 
-            vmID = runCommand('cat /proc/self/cgroup | grep 2:cpu').replace('\n', '')
-            self.__attributes['vmID'] = vmID[20: 26]
+            if 'vmID' not in static_facts:
+                vmID = ''
+                for line in readFile('/proc/self/cgroup').split('\n'):
+                    if '2:cpu' in line:
+                        vmID = line
+                        break
+                static_facts['vmID'] = vmID[20: 26]
+            self.__attributes['vmID'] = static_facts['vmID']
         else:
             key = os.environ.get('X_GOOGLE_FUNCTION_NAME', None)
             if (key != None):
@@ -330,7 +389,9 @@ class Inspector:
                     self.__attributes['platform'] = "IBM Cloud Functions"
                     self.__attributes['functionName'] = key
                     self.__attributes['functionRegion'] = os.environ.get('__OW_API_HOST', None)
-                    self.__attributes["vmID"] = runCommand("cat /sys/hypervisor/uuid").strip()
+                    if 'vmID' not in static_facts:
+                        static_facts['vmID'] = readFile('/sys/hypervisor/uuid').strip()
+                    self.__attributes["vmID"] = static_facts['vmID']
 
                 else:
                     key = os.environ.get('CONTAINER_NAME', None)
@@ -371,11 +432,13 @@ class Inspector:
     #
     # Collect information about the linux kernel.
     #
-    # linuxVersion:    The version of the linux kernel.
+    # linuxVersion:    The version of the linux kernel (the uname fields, read once per container).
     #
     def inspectLinux(self):
         self.__inspectedLinux = True
-        self.__attributes['linuxVersion'] = runCommand('uname -a').replace('\n', '')
+        if 'linuxVersion' not in static_facts:
+            static_facts['linuxVersion'] = ' '.join(os.uname())
+        self.__attributes['linuxVersion'] = static_facts['linuxVersion']
         
     #
     # Run all data collection methods and record framework runtime.
@@ -405,6 +468,20 @@ class Inspector:
         self.__recommendConfiguration()
         self.addTimeStamp("frameworkRuntimeDeltas", deltaTime)
         
+    #
+    # Time a phase of the function, e.g. with inspector.span("download"): ...
+    # See Span for the attributes recorded.
+    #
+    # @param name The name of the phase.
+    # @param attributes Dictionary to record into (default: the Inspector's attributes). Pass
+    #                   a per-record dictionary when records are processed on worker threads.
+    # @return A Span context manager.
+    #
+    def span(self, name, attributes = None):
+        if attributes == None:
+            attributes = self.__attributes
+        return Span(attributes, name)
+
     #
     # Add a custom attribute to the output.
     #
@@ -436,6 +513,68 @@ class Inspector:
         currentTime = int(round(time.time() * 1000))
         self.__attributes[key] = currentTime - timeSince
         
+    #
+    # Start a background thread that samples the process while the function runs.
+    # Each sample reads /proc/stat (total CPU), /proc/self/status (resident memory) and
+    # /proc/self/io (bytes read/written, including sockets). The samples are added to
+    # the output by finish(). Does nothing if intervalMs is not positive.
+    #
+    # @param intervalMs Milliseconds between samples.
+    #
+    def startSampler(self, intervalMs):
+        if intervalMs <= 0 or self.__sampler != None:
+            return
+        self.__samplerInterval = intervalMs
+        self.__samplerStop = threading.Event()
+        self.__samplerReaders = [ProcReader.stat.clone(), ProcReader.status.clone(), ProcReader.io.clone()]
+        self.__samples.append(self.__readSample())
+        self.__sampler = threading.Thread(target=self.__runSampler, name="saaf-sampler", daemon=True)
+        self.__sampler.start()
+
+    def __runSampler(self):
+        while not self.__samplerStop.wait(self.__samplerInterval / 1000):
+            self.__samples.append(self.__readSample())
+
+    #
+    # Read one sample: [time, cpuUser, cpuKernel, cpuIdle, cpuIOWait, rss, readChars, writeChars].
+    # Time is in ms since the Inspector started, CPU in ms, rss in kB, I/O in bytes.
+    #
+    def __readSample(self):
+        sampleTime = int(round(time.time() * 1000)) - self.__startTime
+        tick_rate = 1000 / ticks_per_second
+
+        statReader, statusReader, ioReader = self.__samplerReaders
+        cpu = statReader.read()
+        rss = statusReader.read()[0]
+        processIO = ioReader.read()
+
+        return [sampleTime, int(cpu[0] * tick_rate), int(cpu[2] * tick_rate), int(cpu[3] * tick_rate),
+                int(cpu[4] * tick_rate), rss, processIO[0], processIO[1]]
+
+    #
+    # Stop the sampler and add the samples to the output as delta-encoded arrays:
+    #
+    # samples:  {"intervalMs", "count", "time", "cpuUser", "cpuKernel", "cpuIdle",
+    #            "cpuIOWait", "rss", "readChars", "writeChars"}. Each array holds the
+    #           first value followed by the change from the previous sample.
+    # peakRss:  The largest resident set size sampled, in kB.
+    #
+    def stopSampler(self):
+        if self.__sampler == None:
+            return
+        self.__samplerStop.set()
+        self.__sampler.join()
+        self.__sampler = None
+        self.__samples.append(self.__readSample())
+
+        names = ["time", "cpuUser", "cpuKernel", "cpuIdle", "cpuIOWait", "rss", "readChars", "writeChars"]
+        samples = {"intervalMs": self.__samplerInterval, "count": len(self.__samples)}
+        for index, name in enumerate(names):
+            values = [sample[index] for sample in self.__samples]
+            samples[name] = [values[0]] + [values[i] - values[i - 1] for i in range(1, len(values))]
+        self.__attributes['samples'] = samples
+        self.__attributes['peakRss'] = max(sample[5] for sample in self.__samples)
+
     #
     # Finalize the Inspector. Calculator the total runtime and return the dictionary
     # object containing all attributes collected.
@@ -443,6 +582,7 @@ class Inspector:
     # @return Attributes collected by the Inspector.
     #
     def finish(self):
+        self.stopSampler()
         self.addTimeStamp('runtime')
         self.__attributes['endTime'] = int(round(time.time() * 1000))
         return self.__attributes
@@ -1,11 +1,12 @@
 import json
-import boto3
 import os
-from io import BytesIO
-from PIL import Image
-from Inspector import Inspector
+import image_ops
+import s3_io
+import result_cache
+import tiled_ops
+from Inspector import Inspector, Span
 
-s3_client = boto3.client('s3')
+s3_client = s3_io.create_s3_client()
 
 def lambda_handler(event, context):
     """
@@ -18,29 +19,50 @@ def lambda_handler(event, context):
     - width: Target width in pixels (optional, overrides scale_percent)
     - height: Target height in pixels (optional, overrides scale_percent)
     - maintain_aspect_ratio: If True, maintains aspect ratio when using width/height (default: False)
+    - resize_policy: Quality/speed policy - 'quality', 'balanced' or 'speed' (default: 'balanced').
+      When downscaling, 'balanced' and 'speed' let the JPEG decoder produce a reduced-scale image before the final LANCZOS pass.
     - input_key: Input file to resize (default: auto-detects stage1/*)
+    - sample_interval_ms: Sample CPU, memory and I/O every N ms while the function runs (default: 0, off)
+    - result_cache: If True, identical content with identical parameters is served from the cache/ prefix with a
+      server-side copy instead of being reprocessed (default: False)
+    - output_format: 'jpeg', 'png' or 'webp' - output format, the output extension is changed to match (default: input format)
+    - quality, optimize, progressive, subsampling, compress_level, webp_method, lossless: Encoder settings
+      (default: Pillow's defaults, see image_ops.get_encoder_settings)
+    - tiled: 'auto', True or False - resize and encode the image in horizontal strips to cap memory (default: 'auto',
+      strips when the decoded or resized image has over TILE_THRESHOLD_PIXELS pixels)
+    - tile_height: Output rows per strip in tiled mode (default: 256)
 
-    Event parameters (S3 trigger):
-    - Records[0].s3.bucket.name: S3 bucket name (automatically provided)
-    - Records[0].s3.object.key: S3 object key (automatically provided)
-    - Environment variables: SCALE_PERCENT (default: 150), WIDTH, HEIGHT
+    Event parameters (S3 trigger, or SQS batch of S3 notifications):
+    - Records[].s3.bucket.name: S3 bucket name (automatically provided)
+    - Records[].s3.object.key: S3 object key (automatically provided)
+    - Every record is processed through a thread pool of BATCH_WORKERS threads (default: 4). Failed SQS
+      messages are returned in batchItemFailures, every message when the invocation fails as a whole.
+    - Environment variable RESULT_CACHE: 'true' to enable the result cache (default: 'false')
+    - Environment variable SAMPLE_INTERVAL_MS: Background CPU/memory/I/O sampling interval (default: 0, off)
+    - Environment variables: OUTPUT_FORMAT, ENCODE_QUALITY, ENCODE_OPTIMIZE, JPEG_PROGRESSIVE, JPEG_SUBSAMPLING,
+      PNG_COMPRESS_LEVEL, WEBP_METHOD, WEBP_LOSSLESS (encoder settings when the event does not give them)
+    - Environment variables: SCALE_PERCENT (default: 150), WIDTH, HEIGHT, RESIZE_POLICY (default: 'balanced')
+    - Environment variables: TILED (default: 'auto'), TILE_HEIGHT (default: 256), TILE_THRESHOLD_PIXELS (default: 16000000)
     """
     # Initialize Inspector for performance monitoring
     inspector = Inspector()
     inspector.inspectAll()
 
     try:
-        # Check if this is an S3 trigger event or manual invocation
-        if 'Records' in event and len(event['Records']) > 0:
-            # S3 trigger event format
-            s3_record = event['Records'][0]['s3']
-            bucket_name = s3_record['bucket']['name']
-            input_key = s3_record['object']['key']
+        inspector.startSampler(int(event.get('sample_interval_ms', os.environ.get('SAMPLE_INTERVAL_MS', 0))))
+        # Check if this is an S3/SQS trigger event or manual invocation
+        records = s3_io.get_event_records(event)
+        if len(records) > 0 or s3_io.is_sqs_event(event):
+            # S3 trigger event format (every record of the batch is processed, SQS test events have none)
             scale_percent = int(os.environ.get('SCALE_PERCENT', 150))
             target_width = int(os.environ.get('WIDTH')) if os.environ.get('WIDTH') else None
             target_height = int(os.environ.get('HEIGHT')) if os.environ.get('HEIGHT') else None
             maintain_aspect_ratio = os.environ.get('MAINTAIN_ASPECT_RATIO', 'false').lower() == 'true'
-            inspector.addAttribute("trigger_type", "s3_event")
+            resize_policy = os.environ.get('RESIZE_POLICY', image_ops.DEFAULT_RESIZE_POLICY)
+            if s3_io.is_sqs_event(event):
+                inspector.addAttribute("trigger_type", "sqs_event")
+            else:
+                inspector.addAttribute("trigger_type", "s3_event")
         else:
             # Manual invocation format
             bucket_name = event.get('bucket_name')
@@ -48,6 +70,7 @@ def lambda_handler(event, context):
             target_width = event.get('width')
             target_height = event.get('height')
             maintain_aspect_ratio = event.get('maintain_aspect_ratio', False)
+            resize_policy = event.get('resize_policy', image_ops.DEFAULT_RESIZE_POLICY)
             inspector.addAttribute("trigger_type", "manual_invoke")
 
             if not bucket_name:
@@ -57,7 +80,8 @@ def lambda_handler(event, context):
             input_key = event.get('input_key')
             if not input_key:
                 # List files in stage1/ folder
-                response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix='stage1/')
+                with inspector.span("list"):
+                    response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix='stage1/')
                 if 'Contents' in response and len(response['Contents']) > 0:
                     # Get the first non-empty image file in stage1/
                     for obj in response['Contents']:
@@ -69,7 +93,7 @@ def lambda_handler(event, context):
                             continue
 
                         # Check if it's an image file
-                        if key.lower().endswith(('.jpg', '.jpeg', '.png')):
+                        if key.lower().endswith(image_ops.SUPPORTED_EXTENSIONS):
                             input_key = key
                             break
 
@@ -78,100 +102,160 @@ def lambda_handler(event, context):
                 else:
                     raise ValueError("Could not find input file in stage1/ folder")
 
+            records = [{"bucket_name": bucket_name, "input_key": input_key, "message_id": None}]
+
+        use_result_cache = result_cache.is_enabled(event)
+        encoder_settings = image_ops.get_encoder_settings(event)
+        tile_mode = tiled_ops.get_tile_mode(event)
+        tile_height = tiled_ops.get_tile_height(event)
+
+        # Process every image, overlapping S3 I/O and image work across records
+        results = s3_io.process_records(
+            records,
+            lambda record: process_image(record['bucket_name'], record['input_key'], scale_percent, target_width, target_height, maintain_aspect_ratio, resize_policy, use_result_cache, tile_mode, tile_height, encoder_settings),
+            s3_io.get_batch_workers(event))
+        s3_io.add_batch_results(inspector, records, results)
+
+    except Exception as e:
+        inspector.addAttribute("error", str(e))
+        inspector.addAttribute("message", f"Error resizing image: {str(e)}")
+        # The batch did not finish, so every SQS message is retried
+        s3_io.add_batch_failure(inspector, event)
+
+    # Collect final metrics
+    inspector.inspectAllDeltas()
+    result = inspector.finish()
+
+    # Print metrics to CloudWatch logs
+    print(json.dumps(result, indent=2))
+
+    return result
+
+
+def process_image(bucket_name, input_key, scale_percent, target_width, target_height, maintain_aspect_ratio, resize_policy, use_result_cache, tile_mode='false', tile_height=tiled_ops.DEFAULT_TILE_HEIGHT, encoder_settings=None):
+    """
+    Resize a single image from S3 and write it to stage2/{filename}.
+
+    Returns a dictionary of attributes describing the result.
+    """
+    result = {}
+    try:
         # Extract filename from input_key
         filename = os.path.basename(input_key)
         file_extension = os.path.splitext(filename)[1]
 
-        inspector.addAttribute("input_key", input_key)
-        inspector.addAttribute("filename", filename)
+        result["input_key"] = input_key
+        result["filename"] = filename
+
+        # Output format (the extension follows it) and encoder settings
+        image_format = image_ops.get_output_format(file_extension, encoder_settings)
+        output_filename = image_ops.get_encoded_filename(filename, image_format)
+        result["encoder_settings"] = encoder_settings or {}
 
         # Pipeline tracking for CloudWatch metrics
-        inspector.addAttribute("image_id", filename)
-        inspector.addAttribute("pipeline_stage", "resize")
+        result["image_id"] = filename
+        result["pipeline_stage"] = "resize"
 
-        # Download image from S3
-        inspector.addAttribute("step", "downloading_image")
-        response = s3_client.get_object(Bucket=bucket_name, Key=input_key)
-        image_data = response['Body'].read()
+        # Stream image from S3 (the decoder pulls the body as it needs it)
+        input_stream = s3_io.open_s3_stream(s3_client, bucket_name, input_key, result)
+        result["input_size_bytes"] = input_stream.content_length
 
-        original_size = len(image_data)
-        inspector.addAttribute("input_size_bytes", original_size)
+        # Serve identical content processed with identical parameters from the result cache
+        output_key = f"stage2/{output_filename}"
+        cache_key = None
+        if use_result_cache and input_stream.etag:
+            with Span(result, "cache"):
+                cache_key = result_cache.get_cache_key("resize", input_stream.etag, {"scale_percent": scale_percent, "width": target_width, "height": target_height, "maintain_aspect_ratio": maintain_aspect_ratio, "resize_policy": resize_policy, "encoder": encoder_settings or {}, "tiling": tiled_ops.get_cache_parameters(tile_mode, tile_height)}, os.path.splitext(output_filename)[1])
+                result["cache_key"] = cache_key
+                cached_size = result_cache.lookup(s3_client, bucket_name, cache_key)
+                if cached_size is not None:
+                    input_stream.close()
+                    result_cache.copy(s3_client, bucket_name, cache_key, output_key)
+            if cached_size is not None:
+                result["result_cache"] = "hit"
+                result["output_size_bytes"] = cached_size
+                result["output_key"] = output_key
+                result["bucket_name"] = bucket_name
+                result["message"] = f"Copied cached resized result for {input_key} to {output_key}"
+                return result
+            result["result_cache"] = "miss"
 
-        # Open and resize image
-        inspector.addAttribute("step", "resizing_image")
-        image = Image.open(BytesIO(image_data))
+        # Parse the image header
+        with Span(result, "decode"):
+            image = image_ops.open_image(input_stream)
+        input_stream.release()
 
         original_dimensions = image.size
-        inspector.addAttribute("original_width", original_dimensions[0])
-        inspector.addAttribute("original_height", original_dimensions[1])
+        result["original_width"] = original_dimensions[0]
+        result["original_height"] = original_dimensions[1]
 
         # Calculate target dimensions
         # If width and height are not specified, use scale_percent
-        if target_width is None and target_height is None:
-            target_width = int(original_dimensions[0] * scale_percent / 100)
-            target_height = int(original_dimensions[1] * scale_percent / 100)
-            inspector.addAttribute("scale_percent", scale_percent)
-            inspector.addAttribute("resize_mode", "percentage")
-        else:
-            inspector.addAttribute("resize_mode", "absolute")
+        target_width, target_height, resize_mode = image_ops.get_target_size(
+            original_dimensions, scale_percent, target_width, target_height)
+        if resize_mode == "percentage":
+            result["scale_percent"] = scale_percent
+        result["resize_mode"] = resize_mode
+
+        result["target_width"] = target_width
+        result["target_height"] = target_height
+        result["maintain_aspect_ratio"] = maintain_aspect_ratio
+        result["resize_policy"] = resize_policy
 
-        inspector.addAttribute("target_width", target_width)
-        inspector.addAttribute("target_height", target_height)
-        inspector.addAttribute("maintain_aspect_ratio", maintain_aspect_ratio)
+        # Ask the JPEG decoder for a reduced-scale decode before any pixels are loaded
+        decode_scale = image_ops.draft_image(image, target_width, target_height, resize_policy)
+        result["decode_scale"] = decode_scale
+        result["decoded_width"] = image.size[0]
+        result["decoded_height"] = image.size[1]
 
-        # Resize based on parameters
-        if maintain_aspect_ratio and (event.get('width') or event.get('height')):
-            # Calculate aspect ratio preserving dimensions (only when explicit width/height given)
-            image.thumbnail((target_width, target_height), Image.Resampling.LANCZOS)
-            resized_image = image
+        # Decode pixels
+        with Span(result, "decode"):
+            image.load()
+
+        # Aspect ratio is only preserved when explicit width/height are given
+        fit_within = maintain_aspect_ratio and resize_mode == "absolute"
+        resized_dimensions = (target_width, target_height)
+        if fit_within:
+            resized_dimensions = tiled_ops.get_thumbnail_size(image.size, resized_dimensions)
+
+        # Very large images are resized and encoded strip by strip, without a full output frame
+        tiled = tiled_ops.use_tiles(tile_mode, image.size, resized_dimensions) and tiled_ops.can_tile_resize(image.mode)
+        result["tiled"] = tiled
+        if tiled:
+            strip_height = tiled_ops.get_strip_height(resized_dimensions, image.mode, image_format, tile_height, encoder_settings)
+            result["strip_height"] = strip_height
+            with s3_io.S3UploadStream(s3_client, bucket_name, output_key, f'image/{image_format.lower()}', spans=result) as output_stream, Span(result, "encode"):
+                result["streamed_encode"] = tiled_ops.encode_strips(
+                    tiled_ops.resize_strips(image, resized_dimensions[0], resized_dimensions[1], resize_policy, strip_height),
+                    resized_dimensions, image.mode, image_format, output_stream, spans=result, encoder_settings=encoder_settings)
         else:
-            # Resize to exact dimensions
-            resized_image = image.resize((target_width, target_height), Image.Resampling.LANCZOS)
-
-        resized_dimensions = resized_image.size
-        inspector.addAttribute("resized_width", resized_dimensions[0])
-        inspector.addAttribute("resized_height", resized_dimensions[1])
-
-        # Save resized image to BytesIO
-        output_buffer = BytesIO()
-
-        # Determine format based on extension
-        image_format = 'JPEG'
-        if file_extension.lower() in ['.png']:
-            image_format = 'PNG'
-        elif file_extension.lower() in ['.jpg', '.jpeg']:
-            image_format = 'JPEG'
-
-        resized_image.save(output_buffer, format=image_format)
-        output_buffer.seek(0)
-
-        output_size = len(output_buffer.getvalue())
-        inspector.addAttribute("output_size_bytes", output_size)
-
-        # Upload to S3 in stage2 folder with original filename
-        output_key = f"stage2/{filename}"
-        inspector.addAttribute("step", "uploading_image")
-        s3_client.put_object(
-            Bucket=bucket_name,
-            Key=output_key,
-            Body=output_buffer.getvalue(),
-            ContentType=f'image/{image_format.lower()}'
-        )
-
-        inspector.addAttribute("output_key", output_key)
-        inspector.addAttribute("bucket_name", bucket_name)
-        inspector.addAttribute("image_format", image_format)
-        inspector.addAttribute("message", f"Successfully resized {input_key} to {resized_dimensions[0]}x{resized_dimensions[1]} as {output_key}")
+            # Resize based on parameters
+            with Span(result, "transform"):
+                resized_image = image_ops.resize_image(
+                    image, target_width, target_height, fit_within, resize_policy)
+            resized_dimensions = resized_image.size
 
-    except Exception as e:
-        inspector.addAttribute("error", str(e))
-        inspector.addAttribute("message", f"Error resizing image: {str(e)}")
+            # Upload to S3 in stage2 folder, encoding straight into the upload
+            with s3_io.S3UploadStream(s3_client, bucket_name, output_key, f'image/{image_format.lower()}', spans=result) as output_stream, Span(result, "encode"):
+                image_ops.encode_image(resized_image, image_format, output_stream, encoder_settings)
 
-    # Collect final metrics
-    inspector.inspectAllDeltas()
-    result = inspector.finish()
+        result["resized_width"] = resized_dimensions[0]
+        result["resized_height"] = resized_dimensions[1]
+        result["output_size_bytes"] = output_stream.bytes_written
+        input_stream.close()
 
-    # Print metrics to CloudWatch logs
-    print(json.dumps(result, indent=2))
+        # Keep a copy of the result for the next identical image
+        if cache_key is not None:
+            with Span(result, "cache"):
+                result["cache_stored"] = result_cache.store(s3_client, bucket_name, output_key, cache_key)
+
+        result["output_key"] = output_key
+        result["bucket_name"] = bucket_name
+        result["image_format"] = image_format
+        result["message"] = f"Successfully resized {input_key} to {resized_dimensions[0]}x{resized_dimensions[1]} as {output_key}"
+
+    except Exception as e:
+        result["error"] = str(e)
+        result["message"] = f"Error resizing image: {str(e)}"
 
     return result
@@ -1,11 +1,11 @@
 import json
-import boto3
 import os
-from io import BytesIO
-from PIL import Image
-from Inspector import Inspector
+import image_ops
+import s3_io
+import result_cache
+from Inspector import Inspector, Span
 
-s3_client = boto3.client('s3')
+s3_client = s3_io.create_s3_client()
 
 def lambda_handler(event, context):
     """
@@ -16,29 +16,48 @@ def lambda_handler(event, context):
     - bucket_name: S3 bucket name (required)
     - input_key: Input file name (default: auto-detects input/*)
     - rotation_degrees: Degrees to rotate (default: 180). Positive = counter-clockwise, Negative = clockwise
-
-    Event parameters (S3 trigger):
-    - Records[0].s3.bucket.name: S3 bucket name (automatically provided)
-    - Records[0].s3.object.key: S3 object key (automatically provided)
+    - lossless_jpeg: If True, right-angle rotations of JPEG inputs are done in the DCT domain with jpegtran,
+      skipping decode/re-encode and keeping EXIF (default: False). Falls back to transpose if not possible.
+    - sample_interval_ms: Sample CPU, memory and I/O every N ms while the function runs (default: 0, off)
+    - result_cache: If True, identical content with identical parameters is served from the cache/ prefix with a
+      server-side copy instead of being reprocessed (default: False)
+    - output_format: 'jpeg', 'png' or 'webp' - output format, the output extension is changed to match (default: input format)
+    - quality, optimize, progressive, subsampling, compress_level, webp_method, lossless: Encoder settings
+      (default: Pillow's defaults, see image_ops.get_encoder_settings)
+
+    Event parameters (S3 trigger, or SQS batch of S3 notifications):
+    - Records[].s3.bucket.name: S3 bucket name (automatically provided)
+    - Records[].s3.object.key: S3 object key (automatically provided)
+    - Every record is processed through a thread pool of BATCH_WORKERS threads (default: 4). Failed SQS
+      messages are returned in batchItemFailures, every message when the invocation fails as a whole.
+    - Environment variable RESULT_CACHE: 'true' to enable the result cache (default: 'false')
+    - Environment variable SAMPLE_INTERVAL_MS: Background CPU/memory/I/O sampling interval (default: 0, off)
+    - Environment variables: OUTPUT_FORMAT, ENCODE_QUALITY, ENCODE_OPTIMIZE, JPEG_PROGRESSIVE, JPEG_SUBSAMPLING,
+      PNG_COMPRESS_LEVEL, WEBP_METHOD, WEBP_LOSSLESS (encoder settings when the event does not give them)
     - Environment variable ROTATION_DEGREES: Degrees to rotate (default: 180)
+    - Environment variable LOSSLESS_JPEG: 'true' to enable lossless JPEG rotation (default: 'false')
     """
     # Initialize Inspector for performance monitoring
     inspector = Inspector()
     inspector.inspectAll()
 
     try:
-        # Check if this is an S3 trigger event or manual invocation
-        if 'Records' in event and len(event['Records']) > 0:
-            # S3 trigger event format
-            s3_record = event['Records'][0]['s3']
-            bucket_name = s3_record['bucket']['name']
-            input_key = s3_record['object']['key']
+        inspector.startSampler(int(event.get('sample_interval_ms', os.environ.get('SAMPLE_INTERVAL_MS', 0))))
+        # Check if this is an S3/SQS trigger event or manual invocation
+        records = s3_io.get_event_records(event)
+        if len(records) > 0 or s3_io.is_sqs_event(event):
+            # S3 trigger event format (every record of the batch is processed, SQS test events have none)
             rotation_degrees = int(os.environ.get('ROTATION_DEGREES', 180))
-            inspector.addAttribute("trigger_type", "s3_event")
+            lossless_jpeg = os.environ.get('LOSSLESS_JPEG', 'false').lower() == 'true'
+            if s3_io.is_sqs_event(event):
+                inspector.addAttribute("trigger_type", "sqs_event")
+            else:
+                inspector.addAttribute("trigger_type", "s3_event")
         else:
             # Manual invocation format
             bucket_name = event.get('bucket_name')
             rotation_degrees = event.get('rotation_degrees', 180)
+            lossless_jpeg = event.get('lossless_jpeg', False)
             inspector.addAttribute("trigger_type", "manual_invoke")
 
             if not bucket_name:
@@ -48,7 +67,8 @@ def lambda_handler(event, context):
             input_key = event.get('input_key')
             if not input_key:
                 # List files in input/ folder
-                response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix='input/')
+                with inspector.span("list"):
+                    response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix='input/')
                 if 'Contents' in response and len(response['Contents']) > 0:
                     # Get the first image file in input/
                     for obj in response['Contents']:
@@ -60,7 +80,7 @@ def lambda_handler(event, context):
                             continue
 
                         # Check if it's an image file
-                        if key.lower().endswith(('.jpg', '.jpeg', '.png')):
+                        if key.lower().endswith(image_ops.SUPPORTED_EXTENSIONS):
                             input_key = key
                             break
 
@@ -69,78 +89,23 @@ def lambda_handler(event, context):
                 else:
                     raise ValueError("Could not find input file in input/ folder")
 
-        # Extract filename from input_key (remove any path prefix)
-        filename = os.path.basename(input_key)
-        file_extension = os.path.splitext(filename)[1]  # e.g., '.jpeg', '.jpg', '.png'
-        if not file_extension:
-            file_extension = '.jpeg'  # default
-            filename = filename + file_extension
-
-        inspector.addAttribute("input_key", input_key)
-        inspector.addAttribute("filename", filename)
-        inspector.addAttribute("rotation_degrees", rotation_degrees)
+            records = [{"bucket_name": bucket_name, "input_key": input_key, "message_id": None}]
 
-        # Pipeline tracking for CloudWatch metrics
-        inspector.addAttribute("image_id", filename)
-        inspector.addAttribute("pipeline_stage", "rotate")
+        use_result_cache = result_cache.is_enabled(event)
+        encoder_settings = image_ops.get_encoder_settings(event)
 
-        # Download image from S3
-        inspector.addAttribute("step", "downloading_image")
-        response = s3_client.get_object(Bucket=bucket_name, Key=input_key)
-        image_data = response['Body'].read()
-
-        original_size = len(image_data)
-        inspector.addAttribute("input_size_bytes", original_size)
-
-        # Open and rotate image
-        inspector.addAttribute("step", "rotating_image")
-        image = Image.open(BytesIO(image_data))
-
-        original_dimensions = image.size
-        inspector.addAttribute("original_width", original_dimensions[0])
-        inspector.addAttribute("original_height", original_dimensions[1])
-
-        # Rotate by specified degrees (expand=True ensures no cropping)
-        rotated_image = image.rotate(rotation_degrees, expand=True)
-
-        rotated_dimensions = rotated_image.size
-        inspector.addAttribute("rotated_width", rotated_dimensions[0])
-        inspector.addAttribute("rotated_height", rotated_dimensions[1])
-
-        # Save rotated image to BytesIO
-        output_buffer = BytesIO()
-
-        # Determine format based on extension
-        image_format = 'JPEG'
-        if file_extension.lower() in ['.png']:
-            image_format = 'PNG'
-        elif file_extension.lower() in ['.jpg', '.jpeg']:
-            image_format = 'JPEG'
-
-        rotated_image.save(output_buffer, format=image_format)
-        output_buffer.seek(0)
-
-        output_size = len(output_buffer.getvalue())
-        inspector.addAttribute("output_size_bytes", output_size)
-
-        # Upload to S3 in stage1 folder with original filename
-        output_key = f"stage1/{filename}"
-        inspector.addAttribute("step", "uploading_image")
-        s3_client.put_object(
-            Bucket=bucket_name,
-            Key=output_key,
-            Body=output_buffer.getvalue(),
-            ContentType=f'image/{image_format.lower()}'
-        )
-
-        inspector.addAttribute("output_key", output_key)
-        inspector.addAttribute("bucket_name", bucket_name)
-        inspector.addAttribute("image_format", image_format)
-        inspector.addAttribute("message", f"Successfully rotated {input_key} by {rotation_degrees} degrees to {output_key}")
+        # Process every image, overlapping S3 I/O and image work across records
+        results = s3_io.process_records(
+            records,
+            lambda record: process_image(record['bucket_name'], record['input_key'], rotation_degrees, lossless_jpeg, use_result_cache, encoder_settings),
+            s3_io.get_batch_workers(event))
+        s3_io.add_batch_results(inspector, records, results)
 
     except Exception as e:
         inspector.addAttribute("error", str(e))
         inspector.addAttribute("message", f"Error rotating image: {str(e)}")
+        # The batch did not finish, so every SQS message is retried
+        s3_io.add_batch_failure(inspector, event)
 
     # Collect final metrics
     inspector.inspectAllDeltas()
@@ -150,3 +115,114 @@ def lambda_handler(event, context):
     print(json.dumps(result, indent=2))
 
     return result
+
+
+def process_image(bucket_name, input_key, rotation_degrees, lossless_jpeg, use_result_cache, encoder_settings=None):
+    """
+    Rotate a single image from S3 and write it to stage1/{filename}.
+
+    Returns a dictionary of attributes describing the result.
+    """
+    result = {}
+    try:
+        # Extract filename from input_key (remove any path prefix)
+        filename, file_extension = image_ops.get_output_filename(input_key)
+
+        result["input_key"] = input_key
+        result["filename"] = filename
+        result["rotation_degrees"] = rotation_degrees
+
+        # Output format (the extension follows it) and encoder settings
+        image_format = image_ops.get_output_format(file_extension, encoder_settings)
+        output_filename = image_ops.get_encoded_filename(filename, image_format)
+        result["encoder_settings"] = encoder_settings or {}
+
+        # Pipeline tracking for CloudWatch metrics
+        result["image_id"] = filename
+        result["pipeline_stage"] = "rotate"
+
+        # Stream image from S3 (the decoder pulls the body as it needs it)
+        input_stream = s3_io.open_s3_stream(s3_client, bucket_name, input_key, result)
+        result["input_size_bytes"] = input_stream.content_length
+
+        # Serve identical content processed with identical parameters from the result cache
+        output_key = f"stage1/{output_filename}"
+        cache_key = None
+        if use_result_cache and input_stream.etag:
+            with Span(result, "cache"):
+                cache_key = result_cache.get_cache_key("rotate", input_stream.etag, {"rotation_degrees": rotation_degrees, "lossless_jpeg": lossless_jpeg, "encoder": encoder_settings or {}}, os.path.splitext(output_filename)[1])
+                result["cache_key"] = cache_key
+                cached_size = result_cache.lookup(s3_client, bucket_name, cache_key)
+                if cached_size is not None:
+                    input_stream.close()
+                    result_cache.copy(s3_client, bucket_name, cache_key, output_key)
+            if cached_size is not None:
+                result["result_cache"] = "hit"
+                result["output_size_bytes"] = cached_size
+                result["output_key"] = output_key
+                result["bucket_name"] = bucket_name
+                result["message"] = f"Copied cached rotated result for {input_key} to {output_key}"
+                return result
+            result["result_cache"] = "miss"
+
+        # Parse the image header
+        with Span(result, "decode"):
+            image = image_ops.open_image(input_stream)
+        input_stream.release()
+
+        original_dimensions = image.size
+        result["original_width"] = original_dimensions[0]
+        result["original_height"] = original_dimensions[1]
+
+        # Lossless DCT-domain rotation skips the decode/re-encode entirely for JPEG to JPEG.
+        # jpegtran needs the whole file, so this path reads the object into memory.
+        rotated_buffer = None
+        if lossless_jpeg and image.format == 'JPEG' and image_format == 'JPEG':
+            input_stream.seek(0)
+            image_data = input_stream.read()
+            with Span(result, "transform"):
+                rotated_buffer = image_ops.rotate_jpeg_lossless(image_data, rotation_degrees)
+            if rotated_buffer is None:
+                image = image_ops.open_image(image_data)
+
+        # Upload to S3 in stage1 folder, encoding straight into the upload
+        with s3_io.S3UploadStream(s3_client, bucket_name, output_key, f'image/{image_format.lower()}', spans=result) as output_stream:
+            if rotated_buffer is not None:
+                rotation_method = "jpegtran"
+                rotated_dimensions = image_ops.get_rotated_size(original_dimensions, rotation_degrees)
+                output_stream.write(rotated_buffer.getbuffer())
+            else:
+                # Decode pixels
+                with Span(result, "decode"):
+                    image.load()
+
+                # Rotate by specified degrees (transpose for right angles, expand=True otherwise)
+                with Span(result, "transform"):
+                    rotation_method = image_ops.get_rotation_method(rotation_degrees)
+                    rotated_image = image_ops.rotate_image(image, rotation_degrees)
+                    rotated_dimensions = rotated_image.size
+
+                with Span(result, "encode"):
+                    image_ops.encode_image(rotated_image, image_format, output_stream, encoder_settings)
+
+        input_stream.close()
+        result["rotation_method"] = rotation_method
+        result["rotated_width"] = rotated_dimensions[0]
+        result["rotated_height"] = rotated_dimensions[1]
+        result["output_size_bytes"] = output_stream.bytes_written
+
+        # Keep a copy of the result for the next identical image
+        if cache_key is not None:
+            with Span(result, "cache"):
+                result["cache_stored"] = result_cache.store(s3_client, bucket_name, output_key, cache_key)
+
+        result["output_key"] = output_key
+        result["bucket_name"] = bucket_name
+        result["image_format"] = image_format
+        result["message"] = f"Successfully rotated {input_key} by {rotation_degrees} degrees to {output_key}"
+
+    except Exception as e:
+        result["error"] = str(e)
+        result["message"] = f"Error rotating image: {str(e)}"
+
+    return result
@@ -0,0 +1,354 @@
+import contextlib
+import math
+import os
+import struct
+import zlib
+from PIL import Image, ImageChops
+
+import image_ops
+from Inspector import Span
+
+#
+# Tiled (strip by strip) execution of the greyscale and resize stages for very large images.
+#
+# The whole-frame path holds the decoded image, the transform's intermediate frames and
+# the full output frame at once. In tiled mode the output is produced in horizontal
+# strips: each strip is transformed from the rows of the decoded image it needs (with
+# the LANCZOS filter support as overlap for resize) and encoded into the output stream
+# before the next one is made. No output frame is ever assembled:
+#
+# - JPEG (baseline, unoptimized): each strip is encoded as a baseline JPEG whose height is a multiple of the MCU
+#   height, and the strips' entropy-coded data is joined with restart markers under the
+#   first strip's headers. The result is byte for byte what libjpeg writes for the whole
+#   image with a restart marker every strip.
+# - PNG (L, RGB, RGBA): rows are written with the Up filter through one zlib stream.
+#
+# Peak memory is then the decoded source plus a few strips. For greyscale, JPEG sources
+# are decoded straight to their luminance channel, a quarter of an RGB frame.
+#
+
+TILE_MODES = ('auto', 'true', 'false')
+
+# In 'auto' mode, images with more pixels than this are processed in strips
+DEFAULT_TILE_THRESHOLD_PIXELS = 16000000
+
+# Output rows per strip (rounded to a multiple of 16 for JPEG)
+DEFAULT_TILE_HEIGHT = 256
+
+# LANCZOS filter support in source pixels at scale 1 (Pillow uses a = 3)
+LANCZOS_SUPPORT = 3.0
+
+# Modes Image.resize resamples with premultiplied alpha
+PREMULTIPLIED_MODES = {
+    'LA': 'La',
+    'RGBA': 'RGBa'
+}
+
+# JPEG MCU size of RGB images by chroma subsampling (Pillow's default is 4:2:0).
+# Greyscale MCUs are always 8 x 8.
+JPEG_MCU_SIZES = {
+    '4:4:4': (8, 8),
+    '4:2:2': (16, 8),
+    '4:2:0': (16, 16)
+}
+JPEG_STREAMED_MODES = ('L', 'RGB')
+JPEG_STRIP_ALIGN = 16
+MAX_RESTART_INTERVAL = 65535
+
+# PNG colour type and bytes per pixel of the modes written as streamed PNG
+PNG_MODES = {
+    'L': (0, 1),
+    'RGB': (2, 3),
+    'RGBA': (6, 4)
+}
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_FILTER_UP = b'\x02'
+DEFAULT_PNG_COMPRESS_LEVEL = 6
+
+
+def get_tile_mode(event):
+    """
+    Tiled processing mode (event tiled or TILED): 'auto' tiles images with more than
+    TILE_THRESHOLD_PIXELS pixels, 'true' always tiles and 'false' never does.
+    """
+    mode = event.get('tiled', os.environ.get('TILED', 'auto'))
+    if isinstance(mode, bool):
+        return 'true' if mode else 'false'
+    mode = str(mode).lower()
+    if mode not in TILE_MODES:
+        raise ValueError(f"Unknown tiled mode '{mode}'. Supported modes: {', '.join(TILE_MODES)}")
+    return mode
+
+
+def get_tile_height(event):
+    """
+    Output rows per strip (event tile_height or TILE_HEIGHT).
+    """
+    return max(int(event.get('tile_height', os.environ.get('TILE_HEIGHT', DEFAULT_TILE_HEIGHT))), 1)
+
+
+def use_tiles(tile_mode, *sizes):
+    """
+    Whether an image is processed in strips, given the sizes of its decoded and output frames.
+    """
+    if tile_mode == 'auto':
+        threshold = int(os.environ.get('TILE_THRESHOLD_PIXELS', DEFAULT_TILE_THRESHOLD_PIXELS))
+        return any(size[0] * size[1] > threshold for size in sizes)
+    return tile_mode == 'true'
+
+
+def get_cache_parameters(tile_mode, tile_height):
+    """
+    The tiling settings that can change a stage's output, for its result cache key.
+    Tiled JPEGs carry restart markers, so tiled and whole-frame results differ.
+    """
+    if tile_mode == 'false':
+        return {"tiled": tile_mode}
+    parameters = {"tiled": tile_mode, "tile_height": tile_height}
+    if tile_mode == 'auto':
+        parameters["threshold"] = int(os.environ.get('TILE_THRESHOLD_PIXELS', DEFAULT_TILE_THRESHOLD_PIXELS))
+    return parameters
+
+
+def can_tile_greyscale(greyscale_mode):
+    """
+    Binary ('1') conversion dithers with error diffusion across rows, so only 'L' is tiled.
+    """
+    return greyscale_mode == 'L'
+
+
+def can_tile_resize(image_mode):
+    """
+    Palette and bilevel images are resized with NEAREST sampling, which is not tiled.
+    """
+    return image_mode not in ('1', 'P')
+
+
+def get_jpeg_mcu_size(mode, encoder_settings=None):
+    """
+    MCU (width, height) of a JPEG of the given mode written with the encoder settings.
+    """
+    if mode == 'L':
+        return (8, 8)
+    return JPEG_MCU_SIZES[(encoder_settings or {}).get('subsampling', '4:2:0')]
+
+
+def can_stream(mode, image_format, encoder_settings=None):
+    """
+    Whether strips of this mode can be encoded into the output one at a time.
+    Optimized and progressive JPEGs need the whole image, as does WebP.
+    """
+    settings = encoder_settings or {}
+    if image_format == 'JPEG':
+        return mode in JPEG_STREAMED_MODES and not settings.get('optimize') and not settings.get('progressive')
+    return image_format == 'PNG' and mode in PNG_MODES
+
+
+def get_strip_height(size, mode, image_format, tile_height=DEFAULT_TILE_HEIGHT, encoder_settings=None):
+    """
+    Rows per strip for an output of the given size. Streamed JPEG strips are a whole
+    number of MCU rows, with at most MAX_RESTART_INTERVAL MCUs each.
+    """
+    if image_format != 'JPEG' or not can_stream(mode, image_format, encoder_settings):
+        return tile_height
+    mcu_width, mcu_height = get_jpeg_mcu_size(mode, encoder_settings)
+    rows = max(JPEG_STRIP_ALIGN, -(-tile_height // JPEG_STRIP_ALIGN) * JPEG_STRIP_ALIGN)
+    max_rows = MAX_RESTART_INTERVAL // -(-size[0] // mcu_width) * mcu_height
+    return max(JPEG_STRIP_ALIGN, min(rows, max_rows // JPEG_STRIP_ALIGN * JPEG_STRIP_ALIGN))
+
+
+def draft_greyscale(image):
+    """
+    Ask the JPEG decoder for the luminance channel only, before pixels are loaded.
+    Other formats are left untouched. Returns True when the decode mode was changed.
+    """
+    if image.format != 'JPEG' or image.mode == 'L':
+        return False
+    return image.draft('L', image.size) is not None
+
+
+def greyscale_strips(image, greyscale_mode='L', strip_height=DEFAULT_TILE_HEIGHT):
+    """
+    Yield the greyscale image strip by strip.
+    """
+    width, height = image.size
+    for top in range(0, height, strip_height):
+        yield image.crop((0, top, width, min(top + strip_height, height))).convert(greyscale_mode)
+
+
+def get_thumbnail_size(size, box):
+    """
+    Size Image.thumbnail gives an image of the given size for a bounding box.
+    """
+    x, y = math.floor(box[0]), math.floor(box[1])
+    if x >= size[0] and y >= size[1]:
+        return size
+    aspect = size[0] / size[1]
+
+    def round_aspect(number, key):
+        return max(min(math.floor(number), math.ceil(number), key=key), 1)
+
+    if x / y >= aspect:
+        x = round_aspect(y * aspect, key=lambda n: abs(aspect - n / y))
+    else:
+        y = round_aspect(x / aspect, key=lambda n: 0 if n == 0 else abs(aspect - x / n))
+    return x, y
+
+
+def resize_strips(image, target_width, target_height, resize_policy=image_ops.DEFAULT_RESIZE_POLICY, strip_height=DEFAULT_TILE_HEIGHT):
+    """
+    Yield the LANCZOS resize of an image strip by strip.
+
+    Each output strip is resampled from the source rows it maps to plus the filter
+    support on both sides, so strips join without seams. A resize_policy with a
+    reducing_gap first reduces the rows by whole blocks, as Image.resize does for the
+    whole frame, with the blocks aligned to the same grid.
+    """
+    reducing_gap = image_ops.get_reducing_gap(resize_policy)
+    width, height = image.size
+
+    # Image.resize does not reduce images with alpha (resized premultiplied)
+    premultiplied = PREMULTIPLIED_MODES.get(image.mode)
+    factor_x, factor_y = 1, 1
+    if reducing_gap is not None and premultiplied is None:
+        factor_x = max(int(width / target_width / reducing_gap), 1)
+        factor_y = max(int(height / target_height / reducing_gap), 1)
+    reduce = factor_x > 1 or factor_y > 1
+
+    scale = height / target_height
+    support = LANCZOS_SUPPORT * max(scale, 1.0)
+    for top in range(0, target_height, strip_height):
+        bottom = min(top + strip_height, target_height)
+        source_top = max(math.floor(top * scale - support) - factor_y, 0)
+        source_top -= source_top % factor_y
+        source_bottom = min(math.ceil(bottom * scale + support) + factor_y, height)
+        source_bottom = min(-(-source_bottom // factor_y) * factor_y, height)
+        strip = image.crop((0, source_top, width, source_bottom))
+        if premultiplied is not None:
+            strip = strip.convert(premultiplied)
+        if reduce:
+            strip = strip.reduce((factor_x, factor_y))
+        strip = strip.resize((target_width, bottom - top), Image.Resampling.LANCZOS,
+                             box=(0, (top * scale - source_top) / factor_y, width / factor_x, (bottom * scale - source_top) / factor_y))
+        yield strip.convert(image.mode) if premultiplied is not None else strip
+
+
+def _span(spans, name):
+    # Span over the dictionary, or a no-op when no dictionary is given
+    if spans is None:
+        return contextlib.nullcontext()
+    return Span(spans, name)
+
+
+def _next_strip(strips, spans):
+    # Strips are made lazily, so making one is timed as the transform phase
+    with _span(spans, "transform"):
+        return next(strips, None)
+
+
+def encode_strips(strips, size, mode, image_format, output_stream, spans=None, encoder_settings=None):
+    """
+    Encode an image given as an iterator of strips (top to bottom, all of the width of
+    size) into output_stream, one strip at a time, with the encoder settings from
+    image_ops.get_encoder_settings. JPEG strips must have the height get_strip_height
+    returns, except the last one.
+
+    Outputs that cannot be streamed (see can_stream) are assembled and encoded whole.
+    When spans is given, making the strips is recorded as the transform phase.
+    Returns True when the output was streamed.
+    """
+    strips = iter(strips)
+    if can_stream(mode, image_format, encoder_settings):
+        if image_format == 'JPEG':
+            _encode_jpeg_strips(strips, size, mode, output_stream, spans, encoder_settings)
+        else:
+            _encode_png_strips(strips, size, mode, output_stream, spans, encoder_settings)
+        return True
+
+    image = Image.new(mode, size)
+    top = 0
+    strip = _next_strip(strips, spans)
+    while strip is not None:
+        image.paste(strip, (0, top))
+        top += strip.size[1]
+        strip = _next_strip(strips, spans)
+    image_ops.encode_image(image, image_format, output_stream, encoder_settings)
+    return False
+
+
+def _jpeg_segments(data):
+    # Split an encoded JPEG into its marker segments up to and including SOS, and the
+    # entropy-coded data that follows (without the EOI marker).
+    segments = []
+    position = 2
+    while True:
+        marker = data[position + 1]
+        length = struct.unpack('>H', data[position + 2:position + 4])[0]
+        segments.append(data[position:position + 2 + length])
+        position += 2 + length
+        if marker == 0xDA:
+            return segments, data[position:-2]
+
+
+def _encode_jpeg_strips(strips, size, mode, output_stream, spans, encoder_settings):
+    mcu_width, mcu_height = get_jpeg_mcu_size(mode, encoder_settings)
+    index = 0
+    strip = _next_strip(strips, spans)
+    while strip is not None:
+        encoded = image_ops.encode_image(strip, 'JPEG', encoder_settings=encoder_settings).getvalue()
+        segments, entropy_data = _jpeg_segments(encoded)
+        if index == 0:
+            # Headers of the first strip, with the full height and a restart interval of one strip
+            output_stream.write(b'\xff\xd8')
+            for segment in segments:
+                if segment[1] == 0xC0:
+                    segment = segment[:5] + struct.pack('>H', size[1]) + segment[7:]
+                elif segment[1] == 0xDA:
+                    interval = -(-size[0] // mcu_width) * (strip.size[1] // mcu_height)
+                    output_stream.write(b'\xff\xdd' + struct.pack('>HH', 4, interval))
+                output_stream.write(segment)
+        else:
+            output_stream.write(bytes([0xFF, 0xD0 + (index - 1) % 8]))
+        output_stream.write(entropy_data)
+        index += 1
+        strip = _next_strip(strips, spans)
+    output_stream.write(b'\xff\xd9')
+
+
+def _write_png_chunk(output_stream, chunk_type, data):
+    output_stream.write(struct.pack('>I', len(data)))
+    output_stream.write(chunk_type)
+    output_stream.write(data)
+    output_stream.write(struct.pack('>I', zlib.crc32(data, zlib.crc32(chunk_type))))
+
+
+def _encode_png_strips(strips, size, mode, output_stream, spans, encoder_settings):
+    settings = encoder_settings or {}
+    compress_level = settings.get('compress_level', 9 if settings.get('optimize') else DEFAULT_PNG_COMPRESS_LEVEL)
+    color_type, bytes_per_pixel = PNG_MODES[mode]
+    stride = size[0] * bytes_per_pixel
+    output_stream.write(PNG_SIGNATURE)
+    _write_png_chunk(output_stream, b'IHDR', struct.pack('>IIBBBBB', size[0], size[1], 8, color_type, 0, 0, 0))
+
+    compressor = zlib.compressobj(compress_level)
+    previous_row = Image.new(mode, (size[0], 1))
+    strip = _next_strip(strips, spans)
+    while strip is not None:
+        # Up filter: each row minus the row above it, byte by byte
+        above = Image.new(mode, strip.size)
+        above.paste(previous_row, (0, 0))
+        above.paste(strip.crop((0, 0, size[0], strip.size[1] - 1)), (0, 1))
+        filtered = memoryview(ImageChops.subtract_modulo(strip, above).tobytes())
+        previous_row = strip.crop((0, strip.size[1] - 1, size[0], strip.size[1]))
+
+        rows = []
+        for offset in range(0, len(filtered), stride):
+            rows.append(PNG_FILTER_UP)
+            rows.append(filtered[offset:offset + stride])
+        data = compressor.compress(b''.join(rows))
+        if data:
+            _write_png_chunk(output_stream, b'IDAT', data)
+        strip = _next_strip(strips, spans)
+
+    _write_png_chunk(output_stream, b'IDAT', compressor.flush())
+    _write_png_chunk(output_stream, b'IEND', b'')
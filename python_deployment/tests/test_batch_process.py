@@ -0,0 +1,103 @@
+import io
+import json
+import os
+import sys
+
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from batch_process import BatchJob, Checkpoint, image_ops
+from local_pipeline import LocalS3
+
+#
+# Checkpoint resume, skip and retry of batch_process.py against the in-memory LocalS3.
+#
+
+BUCKET = 'batch-test'
+IMAGES = ['input/img%02d.jpg' % i for i in range(10)]
+
+OPTIONS = {
+    'operations': image_ops.parse_operations('rotate,greyscale'),
+    'rotation_degrees': 90,
+    'scale_percent': 100,
+    'width': None,
+    'height': None,
+    'maintain_aspect_ratio': False,
+    'resize_policy': image_ops.DEFAULT_RESIZE_POLICY,
+    'greyscale_mode': 'L'
+}
+JOB = {'bucket': BUCKET, 'prefix': 'input/', 'output_prefix': 'output/', 'options': OPTIONS}
+
+def jpeg(color):
+    output = io.BytesIO()
+    Image.new('RGB', (24, 16), color).save(output, 'JPEG')
+    return output.getvalue()
+
+def make_bucket(broken=()):
+    s3 = LocalS3()
+    for i, key in enumerate(IMAGES):
+        s3.put_object(Bucket=BUCKET, Key=key, Body=b'not an image' if key in broken else jpeg((i * 20, 40, 80)))
+    s3.put_object(Bucket=BUCKET, Key='input/notes.txt', Body=b'skipped')
+    return s3
+
+def run(s3, path, limit=None):
+    checkpoint = Checkpoint(path, JOB)
+    job = BatchJob(s3, BUCKET, 'input/', 'output/', OPTIONS, checkpoint, workers=1, io_threads=2, in_flight=2)
+    try:
+        return job, job.run(limit)
+    finally:
+        checkpoint.close()
+
+def test_resume_after_limit(tmp_path):
+    s3 = make_bucket()
+    path = str(tmp_path / 'checkpoint.jsonl')
+
+    job, summary = run(s3, path, limit=4)
+    assert summary['processed'] == 4
+    assert summary['resume_after'] == IMAGES[3]
+    assert Checkpoint(path, JOB).start_after == IMAGES[3]
+
+    job, summary = run(s3, path)
+    assert summary['processed'] == 6
+    assert summary['failed'] == 0
+    assert s3.keys(BUCKET, 'output/') == ['output/img%02d.jpg' % i for i in range(10)]
+
+def test_failed_image_is_retried_and_later_images_skipped(tmp_path):
+    s3 = make_bucket(broken=[IMAGES[4]])
+    path = str(tmp_path / 'checkpoint.jsonl')
+
+    job, summary = run(s3, path)
+    assert summary['processed'] == 9
+    assert summary['failed'] == 1
+    # The failure holds the resume point, and nothing finished after it is kept in memory.
+    assert summary['resume_after'] == IMAGES[3]
+    assert len(job._finished) == 0
+    with open(path) as f:
+        entries = [json.loads(line) for line in f]
+    assert {'failed': IMAGES[4]} in [{'failed': entry['failed']} for entry in entries if 'failed' in entry]
+
+    checkpoint = Checkpoint(path, JOB)
+    assert checkpoint.start_after == IMAGES[3]
+    assert checkpoint.done == set(IMAGES[5:])
+    checkpoint.close()
+
+    # The fixed image is processed, the five done after it and notes.txt are skipped.
+    s3.put_object(Bucket=BUCKET, Key=IMAGES[4], Body=jpeg((0, 0, 0)))
+    job, summary = run(s3, path)
+    assert summary['processed'] == 1
+    assert summary['skipped'] == 6
+    assert summary['failed'] == 0
+    assert summary['resume_after'] == 'input/notes.txt'
+    assert len(s3.keys(BUCKET, 'output/')) == 10
+
+def test_checkpoint_of_another_job_is_refused(tmp_path):
+    path = str(tmp_path / 'checkpoint.jsonl')
+    Checkpoint(path, JOB).close()
+    try:
+        Checkpoint(path, dict(JOB, output_prefix='other/'))
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("a checkpoint of another job was accepted")
+    Checkpoint(path, dict(JOB, output_prefix='other/'), fresh=True).close()
@@ -0,0 +1,65 @@
+import io
+import json
+import os
+import sys
+
+from PIL import Image
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from local_pipeline import LocalS3, load_handler, s3_event
+
+#
+# batchItemFailures of the resize handler for SQS batches, against the in-memory LocalS3.
+#
+
+BUCKET = 'sqs-test'
+
+def jpeg():
+    output = io.BytesIO()
+    Image.new('RGB', (24, 16), (200, 40, 80)).save(output, 'JPEG')
+    return output.getvalue()
+
+def sqs_event(*bodies):
+    return {'Records': [{'messageId': 'msg-%d' % i, 'eventSource': 'aws:sqs', 'body': body} for i, body in enumerate(bodies)]}
+
+def make_handler():
+    handler = load_handler('python_lambda_resize')
+    handler.s3_client = LocalS3()
+    handler.s3_client.put_object(Bucket=BUCKET, Key='stage1/good.jpg', Body=jpeg())
+    return handler
+
+def failed_messages(result):
+    return sorted(failure['itemIdentifier'] for failure in result['batchItemFailures'])
+
+def test_invalid_message_fails_alone(capsys):
+    handler = make_handler()
+    result = handler.lambda_handler(sqs_event(json.dumps(s3_event(BUCKET, 'stage1/good.jpg')), 'not json'), None)
+
+    assert failed_messages(result) == ['msg-1']
+    assert result['records_succeeded'] == 1
+    assert handler.s3_client.keys(BUCKET, 'stage2/') == ['stage2/good.jpg']
+
+def test_missing_object_fails_its_message(capsys):
+    handler = make_handler()
+    result = handler.lambda_handler(sqs_event(json.dumps(s3_event(BUCKET, 'stage1/good.jpg')), json.dumps(s3_event(BUCKET, 'stage1/missing.jpg'))), None)
+
+    assert failed_messages(result) == ['msg-1']
+    assert handler.s3_client.keys(BUCKET, 'stage2/') == ['stage2/good.jpg']
+
+def test_handler_error_fails_every_message(monkeypatch, capsys):
+    monkeypatch.setenv('ENCODE_QUALITY', 'high')
+    handler = make_handler()
+    result = handler.lambda_handler(sqs_event(json.dumps(s3_event(BUCKET, 'stage1/good.jpg')), 'not json'), None)
+
+    assert 'error' in result
+    assert failed_messages(result) == ['msg-0', 'msg-1']
+    assert handler.s3_client.keys(BUCKET, 'stage2/') == []
+
+def test_test_event_is_acknowledged(capsys):
+    handler = make_handler()
+    result = handler.lambda_handler(sqs_event(json.dumps({'Event': 's3:TestEvent'})), None)
+
+    assert 'error' not in result
+    assert result['trigger_type'] == 'sqs_event'
+    assert result.get('batchItemFailures', []) == []
@@ -1,9 +1,24 @@
-import boto3
 import json
-import time
+import sys
 from datetime import datetime
 from statistics import mean, stdev
 
+sys.path.append('./tools')
+from insights_query import DEFAULT_MAX_WAIT, InsightsQueryEngine
+from log_ingest import index_by_function, ingest_logs, load_table, rows_in_window
+from quantile_sketch import QuantileSketch
+
+PERFORMANCE_QUERY = '''
+    fields @timestamp, @message, @type
+    | filter @type = "REPORT"
+    | parse @message /Duration:\\s*(?<DurationMS>[\\d.]+)\\s*ms/
+    | parse @message /Billed Duration:\\s*(?<BilledDuration>\\d+)\\s*ms/
+    | parse @message /Max Memory Used:\\s*(?<MemoryUsed>\\d+)\\s*MB/
+    | parse @message /Memory Size:\\s*(?<MemorySize>\\d+)\\s*MB/
+    | parse @message /Init Duration:\\s*(?<InitDuration>[\\d.]+)\\s*ms/
+    | sort @timestamp asc
+    '''
+
 def load_test_metadata(metadata_file):
     """Load test metadata from JSON file"""
     
@@ -12,60 +27,27 @@ def load_test_metadata(metadata_file):
     
     return data['tests']
 
-def query_cloudwatch_logs(log_group_name, query_string, start_time, end_time, max_wait=60):
+def query_cloudwatch_logs(log_group_name, query_string, start_time, end_time, max_wait=DEFAULT_MAX_WAIT):
     """Execute CloudWatch Logs Insights query"""
     
-    client = boto3.client('logs', region_name='us-east-2')
-    
-    try:
-        response = client.start_query(
-            logGroupName=log_group_name,
-            startTime=int(start_time.timestamp()),
-            endTime=int(end_time.timestamp()),
-            queryString=query_string
-        )
-    except Exception as e:
-        print(f"    Error: {e}")
-        return None
-    
-    query_id = response['queryId']
-    
-    waited = 0
-    while waited < max_wait:
-        result = client.get_query_results(queryId=query_id)
-        status = result['status']
-        
-        if status == 'Complete':
-            return result['results']
-        elif status == 'Failed':
-            return None
-        
-        time.sleep(2)
-        waited += 2
-    
-    return None
+    engine = InsightsQueryEngine(region_name='us-east-2', maxWait=max_wait)
+    return engine.query(log_group_name, query_string, start_time, end_time)
 
 def analyze_lambda_performance(function_name, start_time, end_time):
     """Analyze Lambda performance for specific time window"""
     
-    query = '''
-    fields @timestamp, @message, @type
-    | filter @type = "REPORT"
-    | parse @message /Duration:\\s*(?<DurationMS>[\\d.]+)\\s*ms/
-    | parse @message /Billed Duration:\\s*(?<BilledDuration>\\d+)\\s*ms/
-    | parse @message /Max Memory Used:\\s*(?<MemoryUsed>\\d+)\\s*MB/
-    | parse @message /Memory Size:\\s*(?<MemorySize>\\d+)\\s*MB/
-    | parse @message /Init Duration:\\s*(?<InitDuration>[\\d.]+)\\s*ms/
-    | sort @timestamp asc
-    '''
-    
     results = query_cloudwatch_logs(
         f'/aws/lambda/{function_name}',
-        query,
+        PERFORMANCE_QUERY,
         start_time,
         end_time
     )
     
+    return parse_performance_results(results)
+
+def parse_performance_results(results):
+    """Compute performance metrics from the rows of PERFORMANCE_QUERY"""
+    
     if not results:
         return None
     
@@ -95,9 +77,48 @@ def analyze_lambda_performance(function_name, start_time, end_time):
         if fields_dict.get('InitDuration'):
             cold_starts += 1
     
+    return performance_metrics(durations, billed_durations, memory_used, memory_size, cold_starts)
+
+def table_performance(table, index, function_name, start_time, end_time):
+    """Compute performance metrics of a function from an ingested log table"""
+    
+    # Same inclusive, whole second window as the Insights queries.
+    rows = rows_in_window(index, function_name, int(start_time.timestamp()) * 1000, int(end_time.timestamp()) * 1000 + 999)
+    
+    durations = []
+    billed_durations = []
+    memory_used = []
+    memory_size = None
+    cold_starts = 0
+    
+    for row in rows:
+        if table['DurationMS'][row] is None:
+            continue
+        durations.append(float(table['DurationMS'][row]))
+        
+        if table['BilledDuration'][row] is not None:
+            billed_durations.append(int(table['BilledDuration'][row]))
+        
+        if table['MemoryUsed'][row] is not None:
+            memory_used.append(int(table['MemoryUsed'][row]))
+        
+        if table['MemorySize'][row] is not None and memory_size is None:
+            memory_size = int(table['MemorySize'][row])
+        
+        if table['InitDuration'][row] is not None:
+            cold_starts += 1
+    
+    return performance_metrics(durations, billed_durations, memory_used, memory_size, cold_starts)
+
+def performance_metrics(durations, billed_durations, memory_used, memory_size, cold_starts):
+    """Summarize the durations, billing and memory of a function's invocations"""
+    
     if not durations:
         return None
     
+    sketch = QuantileSketch()
+    sketch.add_all(durations)
+    
     return {
         'invocations': len(durations),
         'cold_starts': cold_starts,
@@ -107,6 +128,11 @@ def analyze_lambda_performance(function_name, start_time, end_time):
         'cv': stdev(durations) / mean(durations) if len(durations) > 1 and mean(durations) > 0 else 0,
         'min_duration_ms': min(durations),
         'max_duration_ms': max(durations),
+        'p50_duration_ms': sketch.percentile(50),
+        'p95_duration_ms': sketch.percentile(95),
+        'p99_duration_ms': sketch.percentile(99),
+        'p999_duration_ms': sketch.percentile(99.9),
+        'duration_sketch': sketch.to_dict(),
         'avg_billed_ms': mean(billed_durations) if billed_durations else None,
         'avg_memory_mb': mean(memory_used) if memory_used else None,
         'memory_size_mb': memory_size
@@ -129,7 +155,7 @@ def format_scalability_report(results_by_concurrency):
         report.append(f"{lang.upper()} - SCALABILITY ACROSS CONCURRENCY LEVELS")
         report.append("=" * 100)
         report.append("")
-        report.append(f"{'Concur.':<8} {'Batch':<7} {'Invocs':<8} {'Avg RT (ms)':<12} {'StdDev':<10} {'CV':<8} {'Cold %':<8} {'Max (ms)':<12}")
+        report.append(f"{'Concur.':<8} {'Batch':<7} {'Invocs':<8} {'Avg RT (ms)':<12} {'StdDev':<10} {'CV':<8} {'Cold %':<8} {'P99 (ms)':<12} {'Max (ms)':<12}")
         report.append("-" * 100)
         
         for concurrency in sorted([k for k in results_by_concurrency.keys() if isinstance(k, int)]):
@@ -153,9 +179,16 @@ def format_scalability_report(results_by_concurrency):
             cold_pct = (total_cold / total_invocations * 100) if total_invocations > 0 else 0
             max_runtime = max([s['max_duration_ms'] for s in valid_stages])
             
+            # Tail across all stages, from the merged duration sketches
+            merged = QuantileSketch()
+            for stage in valid_stages:
+                if 'duration_sketch' in stage:
+                    merged.merge(QuantileSketch.from_dict(stage['duration_sketch']))
+            p99_runtime = f"{merged.percentile(99):.2f}" if merged.count > 0 else "N/A"
+            
             batch_size = data['batch_size']
             
-            report.append(f"{concurrency:<8} {batch_size:<7} {total_invocations:<8} {avg_runtime:<12.2f} {avg_stddev:<10.2f} {avg_cv:<8.4f} {cold_pct:<8.1f} {max_runtime:<12.2f}")
+            report.append(f"{concurrency:<8} {batch_size:<7} {total_invocations:<8} {avg_runtime:<12.2f} {avg_stddev:<10.2f} {avg_cv:<8.4f} {cold_pct:<8.1f} {p99_runtime:<12} {max_runtime:<12.2f}")
         
         report.append("")
     
@@ -192,6 +225,8 @@ def format_scalability_report(results_by_concurrency):
                 report.append(f"    Std Dev: {metrics['stddev_duration_ms']:.2f} ms")
                 report.append(f"    CV: {metrics['cv']:.4f}")
                 report.append(f"    Min/Max: {metrics['min_duration_ms']:.2f} / {metrics['max_duration_ms']:.2f} ms")
+                if 'p50_duration_ms' in metrics:
+                    report.append(f"    p50/p95/p99/p99.9: {metrics['p50_duration_ms']:.2f} / {metrics['p95_duration_ms']:.2f} / {metrics['p99_duration_ms']:.2f} / {metrics['p999_duration_ms']:.2f} ms")
                 if metrics['avg_memory_mb'] and metrics['memory_size_mb']:
                     report.append(f"    Memory: {metrics['avg_memory_mb']:.1f} MB / {metrics['memory_size_mb']} MB ({metrics['avg_memory_mb']/metrics['memory_size_mb']*100:.1f}%)")
                 
@@ -243,9 +278,9 @@ def main():
     for test in tests:
         print(f"  {test['language']:<12} concurrency={test['concurrency']:<3} : {test['start_time']} to {test['end_time']}")
     
-    print("\nQuerying CloudWatch for each test...")
-    
     results_by_concurrency = {}
+    queries = []
+    cells = []
     
     for test in tests:
         concurrency = test['concurrency']
@@ -254,8 +289,6 @@ def main():
         start_time = datetime.strptime(test['start_time'], '%Y-%m-%d %H:%M:%S')
         end_time = datetime.strptime(test['end_time'], '%Y-%m-%d %H:%M:%S')
         
-        print(f"\n{language:<12} @ concurrency {concurrency:<3} ... ", end="", flush=True)
-        
         if concurrency not in results_by_concurrency:
             results_by_concurrency[concurrency] = {}
         
@@ -267,11 +300,38 @@ def main():
         }
         
         for stage, func_name in functions[language].items():
-            metrics = analyze_lambda_performance(func_name, start_time, end_time)
-            results_by_concurrency[concurrency][lang_key]['stages'][stage] = metrics
+            queries.append((f'/aws/lambda/{func_name}', PERFORMANCE_QUERY, start_time, end_time))
+            cells.append((concurrency, lang_key, stage))
+    
+    if '--table' in sys.argv or '--logs' in sys.argv:
+        # Offline: use a table ingested by tools/log_ingest.py, or ingest exported logs now.
+        if '--table' in sys.argv:
+            table_file = sys.argv[sys.argv.index('--table') + 1]
+            print(f"\nLoading log table {table_file}...")
+            table = load_table(table_file)
+        else:
+            log_paths = [arg for arg in sys.argv[sys.argv.index('--logs') + 1:] if not arg.startswith('--')]
+            print(f"\nIngesting logs from {', '.join(log_paths)}...")
+            table = ingest_logs(log_paths)
+        index = index_by_function(table)
+        for (concurrency, lang_key, stage), (log_group, query, start_time, end_time) in zip(cells, queries):
+            function_name = log_group.rsplit('/', 1)[-1]
+            results_by_concurrency[concurrency][lang_key]['stages'][stage] = table_performance(table, index, function_name, start_time, end_time)
+    else:
+        print("\nQuerying CloudWatch for each test...")
+        
+        # Run every query at once, using cached results unless --refresh is given.
+        engine = InsightsQueryEngine(region_name='us-east-2', refresh='--refresh' in sys.argv)
+        for (concurrency, lang_key, stage), results in zip(cells, engine.run_queries(queries)):
+            results_by_concurrency[concurrency][lang_key]['stages'][stage] = parse_performance_results(results)
+    
+    for test in tests:
+        concurrency = test['concurrency']
+        language = test['language']
         
         # Show quick summary
-        stages = results_by_concurrency[concurrency][lang_key]['stages']
+        print(f"\n{language:<12} @ concurrency {concurrency:<3} ... ", end="", flush=True)
+        stages = results_by_concurrency[concurrency][language.lower()]['stages']
         valid = [s for s in stages.values() if s]
         if valid:
             total = sum(s['invocations'] for s in valid)
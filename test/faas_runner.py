@@ -34,6 +34,12 @@ defaultFunction = {
 defaultExperiment = {
     'callWithCLI': True,
     'callAsync': False,
+    'invoker': 'cli',
+    'engine': 'threads',
+    'arrivalSchedule': {'type': 'constant', 'rate': 10},
+    'maxInFlight': 1000,
+    'resultSink': 'memory',
+    'progressInterval': 1,
     'memorySettings': [],
     'parentPayload': {},
     'payloads': [{}],
@@ -48,12 +54,17 @@ defaultExperiment = {
     'outputRawOfGroup': [],
     'showAsList': [],
     'showAsSum': [],
+    'showAsPercentiles': [],
+    'percentiles': [50, 90, 95, 99, 99.9],
+    'percentileAccuracy': 0.01,
+    'histogramBins': 0,
     'ignoreFromAll': [],
     'ignoreFromGroups': [],
     'ignoreByGroup': [],
     'invalidators': {},
     'removeDuplicateContainers': False,
     'overlapFilter': "",
+    'overlapMethod': "sweep",
     'openCSV': True,
     'combineSheets': False,
     'warmupBuffer': 0,
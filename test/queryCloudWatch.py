@@ -1,46 +1,12 @@
-import boto3
 import json
-import time
-from datetime import datetime, timedelta
+import sys
+from datetime import datetime
 from statistics import mean, stdev
 
-def query_cloudwatch_logs(log_group_name, query_string, start_time, end_time, max_wait=60):
-    """Execute a CloudWatch Logs Insights query and wait for results"""
-    
-    client = boto3.client('logs', region_name='us-east-2')
-    
-    try:
-        response = client.start_query(
-            logGroupName=log_group_name,
-            startTime=int(start_time.timestamp()),
-            endTime=int(end_time.timestamp()),
-            queryString=query_string
-        )
-    except client.exceptions.ResourceNotFoundException:
-        print(f"  Log group not found: {log_group_name}")
-        return None
-    
-    query_id = response['queryId']
-    
-    waited = 0
-    while waited < max_wait:
-        result = client.get_query_results(queryId=query_id)
-        status = result['status']
-        
-        if status == 'Complete':
-            return result['results']
-        elif status == 'Failed':
-            raise Exception(f'Query failed for {log_group_name}')
-        
-        time.sleep(2)
-        waited += 2
-    
-    raise Exception(f'Query timed out after {max_wait}s')
+sys.path.append('./tools')
+from insights_query import DEFAULT_MAX_WAIT, InsightsQueryEngine
 
-def analyze_lambda_performance(function_name, start_time, end_time):
-    """Analyze Lambda performance for a specific time window"""
-    
-    query = '''
+PERFORMANCE_QUERY = '''
     fields @timestamp, @message, @type, @requestId
     | filter @type = "REPORT"
     | parse @message /Duration:\\s*(?<DurationMS>[\\d.]+)\\s*ms/
@@ -50,6 +16,18 @@ def analyze_lambda_performance(function_name, start_time, end_time):
     | parse @message /Init Duration:\\s*(?<InitDuration>[\\d.]+)\\s*ms/
     | sort @timestamp asc
     '''
+
+def query_cloudwatch_logs(log_group_name, query_string, start_time, end_time, max_wait=DEFAULT_MAX_WAIT):
+    """Execute a CloudWatch Logs Insights query and wait for results"""
+    
+    engine = InsightsQueryEngine(region_name='us-east-2', maxWait=max_wait)
+    results = engine.query(log_group_name, query_string, start_time, end_time)
+    if results is None:
+        raise Exception(f'Query failed for {log_group_name}')
+    return results
+
+def analyze_lambda_performance(function_name, start_time, end_time):
+    """Analyze Lambda performance for a specific time window"""
     
     print(f"Querying {function_name}...")
     print(f"  Time range: {start_time.strftime('%Y-%m-%d %H:%M:%S')} to {end_time.strftime('%Y-%m-%d %H:%M:%S')}")
@@ -57,7 +35,7 @@ def analyze_lambda_performance(function_name, start_time, end_time):
     try:
         results = query_cloudwatch_logs(
             f'/aws/lambda/{function_name}',
-            query,
+            PERFORMANCE_QUERY,
             start_time,
             end_time
         )
@@ -65,8 +43,13 @@ def analyze_lambda_performance(function_name, start_time, end_time):
         print(f"  Error: {e}")
         return None
     
+    return parse_performance_results(function_name, results)
+
+def parse_performance_results(function_name, results):
+    """Compute performance metrics from the rows of PERFORMANCE_QUERY"""
+    
     if not results:
-        print(f"  No data found")
+        print(f"  No data found for {function_name}")
         return None
     
     # Parse results
@@ -97,7 +80,7 @@ def analyze_lambda_performance(function_name, start_time, end_time):
             cold_starts += 1
     
     if not durations:
-        print(f"  No valid data")
+        print(f"  No valid data for {function_name}")
         return None
     
     batch_duration_s = (max(timestamps) - min(timestamps)).total_seconds()
@@ -121,7 +104,7 @@ def analyze_lambda_performance(function_name, start_time, end_time):
         'last_invocation': max(timestamps).isoformat()
     }
     
-    print(f"  ✓ Found {len(durations)} invocations")
+    print(f"  ✓ Found {len(durations)} invocations for {function_name}")
     
     return metrics
 
@@ -280,13 +263,19 @@ def main():
     
     all_metrics = {}
     
+    # Query every function at once, using cached results unless --refresh is given.
+    engine = InsightsQueryEngine(region_name='us-east-2', refresh='--refresh' in sys.argv)
+    queries = []
+    cells = []
     for lang, func_dict in functions.items():
-        print(f"\nAnalyzing {lang.upper()}...")
         all_metrics[lang] = {}
-        
         for stage, func_name in func_dict.items():
-            metrics = analyze_lambda_performance(func_name, start_time, end_time)
-            all_metrics[lang][stage] = metrics
+            queries.append((f'/aws/lambda/{func_name}', PERFORMANCE_QUERY, start_time, end_time))
+            cells.append((lang, stage, func_name))
+    
+    print(f"Querying {len(queries)} functions...")
+    for (lang, stage, func_name), results in zip(cells, engine.run_queries(queries)):
+        all_metrics[lang][stage] = parse_performance_results(func_name, results)
     
     print("\n" + "=" * 80)
     print("Generating report...")
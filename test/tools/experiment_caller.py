@@ -16,12 +16,22 @@ import subprocess
 import sys
 import time
 from decimal import Decimal
-from threading import Thread
+from threading import Lock, Thread
 from pipeline_transition import transition_function
+from result_sink import DEFAULT_PROGRESS_INTERVAL, ResultSink, StoredResults, write_progress
 
-# Results of calls will be placed into this array.
+# Results of calls will be placed into this array, or streamed to result_sink when one is open.
 run_results = []
 max_runs = 0
+result_sink = None
+progress_lock = Lock()
+last_progress = 0
+
+# Shared clients for the in-process ('sdk') invoker, created once and pooled across threads.
+lambda_client = None
+http_session = None
+client_pool_size = 0
+client_lock = Lock()
 
 
 def get_aws_version():
@@ -40,14 +50,16 @@ def get_aws_version():
     except Exception as e:
         raise f"An error occurred: {e}"
 
-# Example usage:
-aws_version = get_aws_version()
+# Detected on the first CLI call, so the 'sdk' invoker works without the AWS CLI installed.
+aws_version = None
 
 #
 # Make a call using AWS CLI
 #
 def callAWS(function, payload, callAsync):
     global aws_version
+    if (aws_version == None):
+        aws_version = get_aws_version()
     
     if (aws_version >= 2):
         cmd = ['aws', 'lambda', 'invoke', '--invocation-type', 'RequestResponse', '--cli-read-timeout', 
@@ -110,11 +122,137 @@ def callHTTP(function, payload):
     return response.text
 
 #
-# Called after a request is made, appends extra data to the payload.
+# Create (or grow) the shared clients used by the 'sdk' invoker. The connection pools
+# are sized for the number of concurrent callers so no thread waits for a connection.
+#
+# @param poolSize The maximum number of concurrent requests.
+#
+def prepareSDKClients(poolSize):
+    global lambda_client
+    global http_session
+    global client_pool_size
+
+    with client_lock:
+        if poolSize <= client_pool_size:
+            return
+        client_pool_size = max(poolSize, 10)
+
+        import boto3
+        from botocore.config import Config
+        config = Config(max_pool_connections=client_pool_size, read_timeout=900, connect_timeout=10,
+                        tcp_keepalive=True, retries={'total_max_attempts': 1, 'mode': 'standard'})
+        lambda_client = boto3.client('lambda', config=config)
+
+        http_session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=client_pool_size, pool_maxsize=client_pool_size)
+        http_session.mount('http://', adapter)
+        http_session.mount('https://', adapter)
+
+#
+# Make a call with the shared boto3 Lambda client (no process is started per call).
+# Retries are disabled so every call measures a single platform round trip.
+#
+def callAWSSDK(function, payload, callAsync):
+    if (lambda_client == None):
+        prepareSDKClients(10)
+
+    if (callAsync):
+        lambda_client.invoke(FunctionName=str(function['endpoint']), InvocationType='Event', Payload=payload.encode('utf-8'))
+        return '{"RESPONSE": "USE S3 PULL TO RETRIEVE RESPONSES", "version":42}'
+
+    response = lambda_client.invoke(FunctionName=str(function['endpoint']), InvocationType='RequestResponse', Payload=payload.encode('utf-8'))
+    body = response['Payload'].read().decode('utf-8')
+    if 'FunctionError' in response:
+        print("FunctionError: " + body)
+    return body
+
+#
+# Make a HTTP request with the shared, connection-pooled session (e.g. Lambda function URLs).
+#
+def callHTTPSession(function, payload):
+    if (http_session == None):
+        prepareSDKClients(10)
+
+    response = http_session.post(function['endpoint'], data=payload, headers={'content-type': 'application/json'})
+    return response.text
+
+#
+# Make a call with the invoker selected by the experiment:
+#
+# cli: A platform CLI process per call (or a new HTTP connection per call).
+# sdk: In-process calls through shared, pooled clients (AWS Lambda and HTTP only).
+#
+def callFunction(function, payload, exp):
+    platform = function['platform']
+    invoker = exp.get('invoker', 'cli')
+
+    if (platform == 'HTTP' or platform == 'Azure'):
+        if (invoker == 'sdk'):
+            return callHTTPSession(function, payload)
+        return callHTTP(function, payload)
+    elif (platform == 'AWS Lambda'):
+        if (invoker == 'sdk'):
+            return callAWSSDK(function, payload, exp['callAsync'])
+        return callAWS(function, payload, exp['callAsync'])
+    elif (platform == 'Google'):
+        return callGoogle(function, payload)
+    elif (platform == 'IBM'):
+        return callIBM(function, payload)
+    return ""
+
+#
+# Milliseconds (2 decimal places) since a time.perf_counter_ns() start time.
+#
+def elapsedMilliseconds(startTime):
+    return round((time.perf_counter_ns() - startTime) / 10000) / 100
+
+#
+# Keep a successful result: stream it to the result sink, or add it to run_results.
+# The progress file is updated at most once per DEFAULT_PROGRESS_INTERVAL.
+#
+def storeResult(dictionary):
+    global last_progress
+    if result_sink != None:
+        result_sink.write(dictionary)
+        return
+
+    run_results.append(dictionary)
+    with progress_lock:
+        now = time.monotonic()
+        if now - last_progress >= DEFAULT_PROGRESS_INTERVAL or len(run_results) == max_runs:
+            last_progress = now
+            write_progress(len(run_results), max_runs)
+
+#
+# Start streaming results to a JSON Lines file instead of keeping them in memory.
+#
+def openResultSink(resultFile, exp):
+    global result_sink
+    result_sink = ResultSink(resultFile, max_runs, exp.get('progressInterval', DEFAULT_PROGRESS_INTERVAL))
+
+#
+# Stop streaming. The results stay in the file and are read back when the report is built.
+#
+def closeResultSink():
+    global result_sink
+    sink = result_sink
+    result_sink = None
+    sink.close()
+    if sink.count == 0:
+        return []
+    return StoredResults(sink.path, sink.count)
+
+#
+# Called after a request is made, appends extra data to the payload. extraAttributes are
+# added to the result before it is stored (e.g. the send times of the open-loop engine).
 #
-def callPostProcessor(function, response, thread_id, run_id, payload, roundTripTime, pipelineStage):
+def callPostProcessor(function, response, thread_id, run_id, payload, roundTripTime, pipelineStage, extraAttributes=None):
     try:
-        dictionary = ast.literal_eval(response)
+        # Responses are JSON (true/false/null), older CLIs may print Python literals.
+        try:
+            dictionary = json.loads(response)
+        except ValueError:
+            dictionary = ast.literal_eval(response)
         dictionary['2_thread_id'] = thread_id
         dictionary['1_run_id'] = run_id
         if pipelineStage != -1:
@@ -132,17 +270,8 @@ def callPostProcessor(function, response, thread_id, run_id, payload, roundTripT
         if (len(function)) > 1 and 'platform' not in dictionary:
             dictionary['endpoint'] = function['endpoint']
 
-        if 'version' in dictionary:
-            run_results.append(dictionary)
-            parts = 50
-            progress = len(run_results) / max_runs
-            pieces = round(progress * parts) % (parts + 1)
-            percent = round((len(run_results) / max_runs) * 100)
-            progressString = "[" + ("#" * pieces) + ("-" * (parts - pieces)) + "] " + str(percent) + "%"
-            progressString = str(percent)
-            f = open(".progress.txt", "w")
-            f.write(progressString)
-            f.close()
+        if extraAttributes != None:
+            dictionary.update(extraAttributes)
 
         key_list = list(dictionary.keys())
         for key in key_list:
@@ -150,6 +279,9 @@ def callPostProcessor(function, response, thread_id, run_id, payload, roundTripT
             dictionary[key] = str(dictionary[key]).replace(
                 ',', ';').replace('\t', '\\t').replace('\n', '\\n')
 
+        if 'version' in dictionary:
+            storeResult(dictionary)
+
         print("Run " + str(thread_id) + "." + str(run_id) + " successful.")
 
         return dictionary
@@ -167,8 +299,6 @@ def callPostProcessor(function, response, thread_id, run_id, payload, roundTripT
 # Define a function to be called by each thread.
 #
 def callThread(thread_id, runs, function, exp, myPayloads):
-    callAsync = exp['callAsync']
-
     for i in range(0, runs): 
 
         callPayload = myPayloads[i]
@@ -180,21 +310,10 @@ def callThread(thread_id, runs, function, exp, myPayloads):
         # Format payload for CLIs.
         payload = str(json.dumps(callPayload))
 
-        startTime = time.time()
-        platform = function['platform']
-        response = ""
-
-        # Make call depending on platform.
-        if (platform == 'HTTP' or platform == 'Azure'):
-            response = callHTTP(function, payload)
-        elif (platform == 'AWS Lambda'):
-            response = callAWS(function, payload, callAsync)
-        elif (platform == 'Google'):
-            response = callGoogle(function, payload)
-        elif (platform == 'IBM'):
-            response = callIBM(function, payload)
-
-        timeSinceStart = round((time.time() - startTime) * 100000) / 100
+        # Make call depending on platform and invoker.
+        startTime = time.perf_counter_ns()
+        response = callFunction(function, payload, exp)
+        timeSinceStart = elapsedMilliseconds(startTime)
 
         callPostProcessor(function, response, thread_id, i, payload, timeSinceStart, -1)
 
@@ -213,8 +332,6 @@ def callPipelineThread(thread_id, seqIterations, functions, experiments, myPaylo
             exp = experiments[i]
             callPayload = myPayloads[i + (j * len(functions))]
 
-            callAsync = exp['callAsync']
-
             startTime = 0
             response = None
 
@@ -233,22 +350,10 @@ def callPipelineThread(thread_id, seqIterations, functions, experiments, myPaylo
             print("Call Function: " + str(function))
             print("Call Payload: " + str(callPayload))
 
-            startTime = time.time()
-            platform = function['platform']
-            response = ""
-
-            # Make call depending on platform.
-            if (platform == 'HTTP' or platform == 'Azure'):
-                response = callHTTP(function, payload)
-            elif (platform == 'AWS Lambda'):
-                response = callAWS(function, payload, callAsync)
-            elif (platform == 'Google'):
-                response = callGoogle(function, payload)
-            elif (platform == 'IBM'):
-                response = callIBM(function, payload)
-
-            # Calculate round trip time
-            timeSinceStart = round((time.time() - startTime) * 100000) / 100
+            # Make call depending on platform and invoker, and calculate round trip time.
+            startTime = time.perf_counter_ns()
+            response = callFunction(function, payload, exp)
+            timeSinceStart = elapsedMilliseconds(startTime)
 
             passOn = callPostProcessor(function, response, thread_id, j, payload, timeSinceStart, i)
 
@@ -261,28 +366,10 @@ def callPipelineThread(thread_id, seqIterations, functions, experiments, myPaylo
             passOn = trans[4]
 
 #
-# Run a partest with multiple functions and an experiment all functions will be called concurrently.
+# Resolve how each function is called: by platform CLI/SDK with its function name,
+# or over HTTP with its endpoint.
 #
-def callExperiment(functionList, exp):
-
-    print("\n-----------------------------------------------------------------")
-    print("CREATING AND RUNNING THREADS FOR EXPERIMENT (experiment_caller.py)")
-    print("-----------------------------------------------------------------\n")
-
-    global run_results
-    run_results = []
-
-    threads = exp['threads']
-    total_runs = exp['runs']
-    global max_runs
-    max_runs = total_runs
-    runs_per_thread = int(total_runs / threads)
-    payload = exp['payloads']
-    useCLI = exp['callWithCLI']
-    randomSeed = exp['randomSeed']
-    shufflePayloads = exp['shufflePayloads']
-    random.seed(randomSeed)
-
+def getFunctionCalls(functionList, useCLI):
     function_calls = []
     for i in range(0, len(functionList)):
         func = functionList[i]
@@ -302,14 +389,54 @@ def callExperiment(functionList, exp):
                 'platform': "HTTP",
                 'endpoint': func['endpoint']
             })
+    return function_calls
 
-    # Duplicate payloads so that the number of payloads >= number of runs.
-    # Shuffle if needed.
+#
+# Duplicate payloads so that the number of payloads >= number of runs.
+# Shuffle if needed.
+#
+def getPayloadList(payload, total_runs, shufflePayloads):
     payloadList = payload
     while (len(payloadList) < total_runs):
         payloadList += payload
     if (shufflePayloads):
         random.shuffle(payloadList)
+    return payloadList
+
+#
+# Run a partest with multiple functions and an experiment all functions will be called concurrently.
+#
+# If resultFile is given, results are streamed to that JSON Lines file as they arrive,
+# and StoredResults reading them from the file are returned instead of a list.
+#
+def callExperiment(functionList, exp, resultFile=None):
+
+    print("\n-----------------------------------------------------------------")
+    print("CREATING AND RUNNING THREADS FOR EXPERIMENT (experiment_caller.py)")
+    print("-----------------------------------------------------------------\n")
+
+    global run_results
+    run_results = []
+
+    threads = exp['threads']
+    total_runs = exp['runs']
+    global max_runs
+    max_runs = total_runs
+    runs_per_thread = int(total_runs / threads)
+    payload = exp['payloads']
+    useCLI = exp['callWithCLI']
+    randomSeed = exp['randomSeed']
+    shufflePayloads = exp['shufflePayloads']
+    random.seed(randomSeed)
+
+    function_calls = getFunctionCalls(functionList, useCLI)
+    payloadList = getPayloadList(payload, total_runs, shufflePayloads)
+
+    if (exp.get('invoker', 'cli') == 'sdk'):
+        prepareSDKClients(threads * len(function_calls))
+
+    if (resultFile != None):
+        openResultSink(resultFile, exp)
 
     #
     # Create threads and distribute payloads to threads.
@@ -333,6 +460,9 @@ def callExperiment(functionList, exp):
     except Exception as e:
         print("Error making request: " + str(e))
 
+    if (resultFile != None):
+        run_results = closeResultSink()
+
     #
     # Print results of each run.
     #
@@ -396,6 +526,9 @@ def callPipelineExperiment(functionList, experimentList):
 
     random.seed(randomSeed)
 
+    if (experimentList[0].get('invoker', 'cli') == 'sdk'):
+        prepareSDKClients(threads)
+
     #
     # Create threads and distribute payloads to threads.
     #
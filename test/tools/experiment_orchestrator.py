@@ -16,8 +16,11 @@ from enum import Enum
 
 from experiment_caller import callExperiment
 from experiment_caller import callPipelineExperiment
+from load_generator import callOpenLoopExperiment
 from report_generator import report
 from report_generator import write_file
+from quantile_sketch import merge_sketches
+from result_sink import load_runs
 
 #
 # Some platforms require you to redeploy you code to change
@@ -196,25 +199,43 @@ def run_experiment(functions, experiments, outDir):
         print("Sleeping after setting memory value...")
         time.sleep(sleepTime)
         runList = []
+        sketchList = []
 
         for i in range(iterations):
             print("Running test " + str(i) + ": ")
 
+            # Stream results to <report name>.jsonl instead of keeping them in memory.
+            resultFile = None
+            if exp.get('resultSink', 'memory') == 'jsonl':
+                baseFileName = outDir + "/" + functionName + "-" + str(
+                        expName) + "-" + str(mem) + "MBs-run" + str(i)
+                resultFile = baseFileName + ".jsonl"
+                duplicates = 1
+                while (os.path.isfile(resultFile)):
+                    resultFile = baseFileName + "-" + str(duplicates) + ".jsonl"
+                    duplicates += 1
+
             if (len(experiments) > 1 and len(functions) > 1 and len(experiments) == len(functions)):
                 print("Running in pipeline mode... " + str(functions))
                 runList.append(callPipelineExperiment(functions, experiments))
+            elif exp.get('engine', 'threads') == 'asyncio':
+                runList.append(callOpenLoopExperiment([func], exp, resultFile))
             else:
-                runList.append(callExperiment([func], exp))
+                runList.append(callExperiment([func], exp, resultFile))
 
+            sketchList.append({})
             if runList[i] != None:
                 print("Test complete! Generating report...")
-                partestResult = report(runList[i], exp)
+                # Streamed results are read back for the report only; runList keeps the file.
+                runs = load_runs(runList[i])
+                partestResult = report(runs, exp, sketchList[i])
 
                 print(partestResult)
 
                 baseFileName = outDir + "/" + functionName + "-" + str(
                         expName) + "-" + str(mem) + "MBs-run" + str(i)
-                write_file(baseFileName, partestResult, openCSV, runList[i])
+                write_file(baseFileName, partestResult, openCSV, runs)
+                runs = None
 
             print("Sleeping before next test...")
             time.sleep(sleepTime)
@@ -222,18 +243,39 @@ def run_experiment(functions, experiments, outDir):
         if (combineSheets):
             print("Generating Combined Report:")
             finalRunList = []
+            finalSketches = {}
+            combined = []
             for i in range(iterations):
                 if (i > warmupBuffer - 1):
                     if runList[i] == None:
                         continue
-                    for run in runList[i]:
+                    combined.append(i)
+                    runs = load_runs(runList[i])
+                    for run in runs:
                         run['iteration'] = i
                         if 'vmID' in run:
                             run['vmID[iteration]'] = run['vmID'] + "[" + str(i) + "]"
-                    finalRunList.extend(runList[i])
+                    finalRunList.extend(runs)
+
+            # Percentiles are merged from iteration sketches only where the combined report
+            # would sketch the same values. runtimeOverlap and the values filled in for
+            # attributes some iterations lack are recomputed over the combined runs, and
+            # tenancy groups and duplicate containers depend on all iterations, so those
+            # are sketched from the combined runs instead.
+            if not exp['removeDuplicateContainers'] and len(finalRunList) > 0:
+                commonKeys = set(finalRunList[0])
+                allKeys = set()
+                for run in finalRunList:
+                    commonKeys.intersection_update(run)
+                    allKeys.update(run)
+                rebuilt = (allKeys - commonKeys) | {'runtimeOverlap'}
+                for i in combined:
+                    merge_sketches(finalSketches, {key: sketch for key, sketch in sketchList[i].items()
+                                                   if key[0] not in rebuilt and key[2] not in rebuilt
+                                                   and not str(key[0]).startswith(('zTenancy', 'tenants'))})
             print(str(finalRunList))
             if (len(finalRunList) > 0):
-                partestResult = report(finalRunList, exp)
+                partestResult = report(finalRunList, exp, finalSketches)
 
                 baseFileName = outDir + "/" + functionName + "-" + str(
                         expName) + "-" + str(mem) + "MBs-COMBINED"
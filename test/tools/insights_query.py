@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+
+import hashlib
+import json
+import os
+import time
+
+import boto3
+from botocore.exceptions import ClientError
+
+#
+# Concurrent, cached CloudWatch Logs Insights queries for the analysis scripts.
+#
+# Every query of an analysis is submitted up front, up to the number of queries Insights
+# runs at once, and all running queries are polled together with a growing delay, so an
+# analysis takes about as long as its slowest query. Insights returns at most 10,000
+# rows: a window that hits the limit is split in two and each half is queried again.
+# Results are cached on disk by log group, query and time window, so running an analysis
+# again is answered from the cache without calling CloudWatch.
+#
+
+# Rows returned by one Insights query at most.
+MAX_ROWS = 10000
+
+# Insights queries that may run at once in an account (default quota).
+DEFAULT_MAX_CONCURRENT = 20
+
+# Insights cancels queries after 60 minutes.
+DEFAULT_MAX_WAIT = 3600
+
+# Delay between polls of running queries, growing by POLL_BACKOFF while nothing finishes.
+MIN_POLL_DELAY = 0.5
+MAX_POLL_DELAY = 5.0
+POLL_BACKOFF = 1.5
+
+DEFAULT_CACHE_DIR = './.insights_cache'
+
+# Windows ending less than this many seconds ago are not cached, logs may still arrive.
+CACHE_SETTLE_SECONDS = 300
+
+#
+# Cache key of a query over a window.
+#
+def cache_key(log_group_name, query_string, start, end):
+    key = json.dumps([log_group_name, query_string, start, end, MAX_ROWS])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+#
+# Runs Insights queries concurrently.
+#
+# @param client A CloudWatch Logs client, or None to create one in region_name.
+# @param cacheDir Folder of cached results, or None to disable the cache.
+# @param refresh Ignore cached results (new results are still cached).
+#
+class InsightsQueryEngine:
+
+    def __init__(self, region_name='us-east-2', client=None, maxConcurrent=DEFAULT_MAX_CONCURRENT,
+                 maxWait=DEFAULT_MAX_WAIT, cacheDir=DEFAULT_CACHE_DIR, refresh=False):
+        self.client = client if client != None else boto3.client('logs', region_name=region_name)
+        self.maxConcurrent = maxConcurrent
+        self.maxWait = maxWait
+        self.cacheDir = cacheDir
+        self.refresh = refresh
+
+    #
+    # Run one query. Returns the result rows, or None if the query failed.
+    #
+    def query(self, log_group_name, query_string, start_time, end_time):
+        return self.run_queries([(log_group_name, query_string, start_time, end_time)])[0]
+
+    #
+    # Run a list of (log group, query, start datetime, end datetime) queries at once.
+    #
+    # Returns a list with the result rows of each query, in order, or None for queries
+    # that failed. Rows of split windows are returned in window order.
+    #
+    def run_queries(self, queries):
+        results = [None] * len(queries)
+        windows = {}
+        pending = []
+        for index, (log_group_name, query_string, start_time, end_time) in enumerate(queries):
+            start = int(start_time.timestamp())
+            end = int(end_time.timestamp())
+            cached = self.__read_cache(log_group_name, query_string, start, end)
+            if cached != None:
+                results[index] = cached
+            else:
+                windows[index] = {}
+                pending.append((index, start, end))
+
+        failed = set()
+        running = {}
+        delay = MIN_POLL_DELAY
+        while len(pending) > 0 or len(running) > 0:
+
+            # Start queries until the concurrency limit is reached.
+            while len(pending) > 0 and len(running) < self.maxConcurrent:
+                index, start, end = pending[0]
+                log_group_name, query_string = queries[index][0], queries[index][1]
+                try:
+                    response = self.client.start_query(logGroupName=log_group_name, startTime=start,
+                                                       endTime=end, queryString=query_string, limit=MAX_ROWS)
+                except ClientError as e:
+                    code = e.response['Error']['Code']
+                    if code == 'LimitExceededException' or code == 'ThrottlingException':
+                        break
+                    pending.pop(0)
+                    if code == 'ResourceNotFoundException':
+                        print(f"  Log group not found: {log_group_name}")
+                    else:
+                        print(f"  Error querying {log_group_name}: {e}")
+                    failed.add(index)
+                    continue
+                pending.pop(0)
+                running[response['queryId']] = (index, start, end, time.monotonic())
+
+            if len(running) == 0:
+                time.sleep(delay)
+                delay = min(delay * POLL_BACKOFF, MAX_POLL_DELAY)
+                continue
+
+            time.sleep(delay)
+            finished = False
+            for query_id, (index, start, end, started) in list(running.items()):
+                log_group_name = queries[index][0]
+                try:
+                    response = self.client.get_query_results(queryId=query_id)
+                except ClientError as e:
+                    if e.response['Error']['Code'] == 'ThrottlingException':
+                        break
+                    raise
+                status = response['status']
+
+                if status == 'Complete':
+                    del running[query_id]
+                    finished = True
+                    rows = response['results']
+                    if len(rows) >= MAX_ROWS and end > start:
+                        # Too many rows for one query, query each half of the window.
+                        middle = (start + end) // 2
+                        pending.append((index, start, middle))
+                        pending.append((index, middle + 1, end))
+                    else:
+                        if len(rows) >= MAX_ROWS:
+                            print(f"  Warning: {log_group_name} has more than {MAX_ROWS} rows in one second, results are incomplete")
+                        windows[index][start] = rows
+                elif status in ['Failed', 'Cancelled', 'Timeout', 'Unknown']:
+                    del running[query_id]
+                    finished = True
+                    print(f"  Query {status.lower()} for {log_group_name}")
+                    failed.add(index)
+                elif time.monotonic() - started > self.maxWait:
+                    del running[query_id]
+                    finished = True
+                    print(f"  Query timed out after {self.maxWait}s for {log_group_name}")
+                    try:
+                        self.client.stop_query(queryId=query_id)
+                    except ClientError:
+                        pass
+                    failed.add(index)
+
+            delay = MIN_POLL_DELAY if finished else min(delay * POLL_BACKOFF, MAX_POLL_DELAY)
+
+        # Join the windows of every query.
+        for index, parts in windows.items():
+            if index in failed:
+                continue
+            rows = []
+            for start in sorted(parts):
+                rows.extend(parts[start])
+            results[index] = rows
+            log_group_name, query_string, start_time, end_time = queries[index]
+            self.__write_cache(log_group_name, query_string, int(start_time.timestamp()), int(end_time.timestamp()), rows)
+        return results
+
+    def __cache_path(self, log_group_name, query_string, start, end):
+        return os.path.join(self.cacheDir, cache_key(log_group_name, query_string, start, end) + '.json')
+
+    def __read_cache(self, log_group_name, query_string, start, end):
+        if self.cacheDir == None or self.refresh:
+            return None
+        path = self.__cache_path(log_group_name, query_string, start, end)
+        if not os.path.isfile(path):
+            return None
+        try:
+            with open(path) as f:
+                return json.load(f)['results']
+        except (ValueError, KeyError):
+            return None
+
+    def __write_cache(self, log_group_name, query_string, start, end, rows):
+        if self.cacheDir == None or end > time.time() - CACHE_SETTLE_SECONDS:
+            return
+        os.makedirs(self.cacheDir, exist_ok=True)
+        path = self.__cache_path(log_group_name, query_string, start, end)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'logGroupName': log_group_name, 'queryString': query_string,
+                       'startTime': start, 'endTime': end, 'results': rows}, f)
+        os.replace(path + '.tmp', path)
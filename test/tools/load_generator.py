@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+
+#
+# Open-loop load generator for FaaS Runner. An alternative to the thread model in
+# experiment_caller.py: requests are sent on an arrival schedule, whether or not earlier
+# requests have returned, so offered load does not drop when the platform slows down and
+# queueing shows up in the results instead of being hidden.
+#
+# Selected with "engine": "asyncio" in an experiment. The schedule is given by
+# "arrivalSchedule":
+#
+#   {"type": "constant", "rate": 50}                         50 requests/s, evenly spaced
+#   {"type": "poisson", "rate": 50}                          50 requests/s on average, Poisson arrivals
+#   {"type": "step", "steps": [{"rate": 10, "duration": 30},
+#                              {"rate": 100, "duration": 30}]}  piecewise constant rates
+#   {"type": "ramp", "startRate": 1, "endRate": 100, "duration": 60}   linear ramp
+#
+# Step and ramp schedules take "poisson": true for Poisson arrivals at the scheduled rate.
+# Once a schedule ends its last rate continues until "runs" requests have been sent.
+#
+import asyncio
+import json
+import math
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import experiment_caller
+from experiment_caller import callFunction, callPostProcessor, getFunctionCalls, getPayloadList, prepareSDKClients
+
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+#
+# Split an arrival schedule into linear rate segments: (duration, startRate, endRate).
+# The last segment has an infinite duration.
+#
+def getRateSegments(schedule):
+    scheduleType = schedule.get('type', 'constant')
+
+    if scheduleType == 'constant' or scheduleType == 'poisson':
+        rate = schedule['rate']
+        segments = [(math.inf, rate, rate)]
+    elif scheduleType == 'step':
+        segments = [(step['duration'], step['rate'], step['rate']) for step in schedule['steps']]
+        lastRate = schedule['steps'][-1]['rate']
+        segments.append((math.inf, lastRate, lastRate))
+    elif scheduleType == 'ramp':
+        segments = [(schedule['duration'], schedule['startRate'], schedule['endRate'])]
+        segments.append((math.inf, schedule['endRate'], schedule['endRate']))
+    else:
+        raise ValueError("Unknown arrivalSchedule type: " + str(scheduleType))
+
+    if segments[-1][1] <= 0:
+        raise ValueError("The final rate of an arrivalSchedule must be > 0")
+    return segments
+
+#
+# Time within a segment at which `count` expected arrivals have occurred, i.e. solve
+# startRate * t + (endRate - startRate) * t^2 / (2 * duration) = count for t.
+#
+def solveSegmentTime(duration, startRate, endRate, count):
+    if startRate == endRate or math.isinf(duration):
+        return count / startRate if startRate > 0 else math.inf
+    a = (endRate - startRate) / (2 * duration)
+    return (-startRate + math.sqrt(startRate * startRate + 4 * a * count)) / (2 * a)
+
+#
+# Send times, in seconds from the start of the experiment, for `count` requests.
+#
+# Arrivals are spaced in "operational time" (the expected number of arrivals so far): one
+# apart for a deterministic schedule, or exponentially distributed for Poisson arrivals,
+# then mapped back to wall time through the piecewise linear rate.
+#
+def getArrivalTimes(schedule, count, randomSeed):
+    segments = getRateSegments(schedule)
+    poisson = schedule.get('type') == 'poisson' or schedule.get('poisson', False)
+    rng = random.Random(randomSeed)
+
+    times = []
+    segmentIndex = 0
+    segmentStart = 0.0
+    segmentArrivals = 0.0
+    target = 0.0
+    for i in range(count):
+        if i > 0:
+            target += rng.expovariate(1.0) if poisson else 1.0
+
+        while True:
+            duration, startRate, endRate = segments[segmentIndex]
+            expected = (startRate + endRate) / 2 * duration
+            if target - segmentArrivals < expected:
+                break
+            segmentArrivals += expected
+            segmentStart += duration
+            segmentIndex += 1
+
+        times.append(segmentStart + solveSegmentTime(duration, startRate, endRate, target - segmentArrivals))
+    return times
+
+#
+# Make a blocking call on a worker thread, returning its send and receive times.
+#
+def timedCall(function, payload, exp):
+    sendTime = time.perf_counter_ns()
+    response = callFunction(function, payload, exp)
+    return sendTime, response, time.perf_counter_ns()
+
+#
+# Make a HTTP call natively in the event loop (used when aiohttp is installed).
+#
+async def timedHTTPCall(session, function, payload):
+    sendTime = time.perf_counter_ns()
+    async with session.post(function['endpoint'], data=payload, headers={'content-type': 'application/json'}) as response:
+        text = await response.text()
+    return sendTime, text, time.perf_counter_ns()
+
+#
+# Send one request and record when it was scheduled, when it was actually sent and how
+# far behind schedule the generator was. Waiting for an in-flight slot counts as lag.
+#
+async def sendRequest(loop, executor, session, inFlight, function, exp, callPayload, runId, scheduledTime, startTime):
+    payload = str(json.dumps(callPayload))
+    try:
+        async with inFlight:
+            if session != None and function['platform'] == 'HTTP':
+                sendTime, response, endTime = await timedHTTPCall(session, function, payload)
+            else:
+                sendTime, response, endTime = await loop.run_in_executor(executor, timedCall, function, payload, exp)
+    except Exception as e:
+        print("Run " + str(runId) + " failed with exception: " + str(e))
+        return
+
+    roundTripTime = round((endTime - sendTime) / 10000) / 100
+    sendTimes = {
+        'scheduledTime': str(round(scheduledTime * 1000, 2)),
+        'sendTime': str(round((sendTime - startTime) / 1000000, 2)),
+        'sendLag': str(round((sendTime - startTime) / 1000000 - scheduledTime * 1000, 2))
+    }
+    callPostProcessor(function, response, 0, runId, payload, roundTripTime, -1, sendTimes)
+
+#
+# Dispatch every request at its scheduled time and wait for all of them to finish.
+#
+async def runSchedule(function_calls, exp, payloadList, arrivalTimes):
+    maxInFlight = exp.get('maxInFlight', 1000)
+    loop = asyncio.get_running_loop()
+    executor = ThreadPoolExecutor(max_workers=maxInFlight)
+    inFlight = asyncio.Semaphore(maxInFlight)
+
+    session = None
+    if aiohttp != None:
+        session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=maxInFlight),
+                                        timeout=aiohttp.ClientTimeout(total=900))
+
+    try:
+        tasks = []
+        startTime = time.perf_counter_ns()
+        for runId, scheduledTime in enumerate(arrivalTimes):
+            delay = scheduledTime - (time.perf_counter_ns() - startTime) / 1000000000
+            if delay > 0:
+                await asyncio.sleep(delay)
+            for function in function_calls:
+                tasks.append(loop.create_task(sendRequest(loop, executor, session, inFlight, function, exp,
+                                                          payloadList[runId], runId, scheduledTime, startTime)))
+        await asyncio.gather(*tasks)
+    finally:
+        if session != None:
+            await session.close()
+        executor.shutdown(wait=False)
+
+#
+# Run an open-loop experiment. Returns the run results like callExperiment, including
+# streaming them to resultFile (and returning StoredResults) when one is given.
+#
+def callOpenLoopExperiment(functionList, exp, resultFile=None):
+
+    print("\n-----------------------------------------------------------------")
+    print("RUNNING OPEN-LOOP EXPERIMENT (load_generator.py)")
+    print("-----------------------------------------------------------------\n")
+
+    total_runs = exp['runs']
+    experiment_caller.run_results = []
+    random.seed(exp['randomSeed'])
+
+    function_calls = getFunctionCalls(functionList, exp['callWithCLI'])
+    experiment_caller.max_runs = total_runs * len(function_calls)
+    payloadList = getPayloadList(exp['payloads'], total_runs, exp['shufflePayloads'])
+
+    if (exp.get('invoker', 'cli') == 'sdk'):
+        prepareSDKClients(exp.get('maxInFlight', 1000))
+
+    if (resultFile != None):
+        experiment_caller.openResultSink(resultFile, exp)
+
+    arrivalTimes = getArrivalTimes(exp.get('arrivalSchedule', {'type': 'constant', 'rate': 10}), total_runs, exp['randomSeed'])
+    print("Sending " + str(total_runs) + " requests over " + str(round(arrivalTimes[-1], 2)) + " seconds...")
+
+    try:
+        asyncio.run(runSchedule(function_calls, exp, payloadList, arrivalTimes))
+    except Exception as e:
+        print("Error making request: " + str(e))
+
+    if (resultFile != None):
+        experiment_caller.run_results = experiment_caller.closeResultSink()
+
+    run_results = experiment_caller.run_results
+    if len(run_results) == 0:
+        print ("ERROR - ALL REQUESTS FAILED")
+        return None
+    return run_results
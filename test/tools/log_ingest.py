@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+
+import bisect
+import gzip
+import json
+import os
+import re
+import sys
+from datetime import datetime
+
+import run_store
+
+#
+# Offline ingestion of exported Lambda logs.
+#
+# Reads logs exported from CloudWatch (create-export-task files, `aws logs
+# filter-log-events` / `get-log-events` output, subscription / Firehose records, or plain
+# text), gzip compressed or not, in one streaming pass. The SAAF JSON record each handler
+# prints and the REPORT line Lambda writes after it are joined by request ID into a
+# columnar table (a dictionary of attribute -> list of values, one entry per request),
+# so analysis can run without Logs Insights queries.
+#
+# Usage: ./tools/log_ingest.py {OUTPUT FILE} {LOG FILE OR FOLDER} ...
+#
+
+REPORT_LINE = re.compile(r'REPORT RequestId: (\S+)\s+Duration: ([\d.]+) ms\s+Billed Duration: (\d+) ms\s+'
+                         r'Memory Size: (\d+) MB\s+Max Memory Used: (\d+) MB(?:\s+Init Duration: ([\d.]+) ms)?')
+START_LINE = re.compile(r'START RequestId: (\S+)')
+
+# Columns taken from REPORT lines, named as in the Insights queries of the analysis scripts.
+REPORT_COLUMNS = ['DurationMS', 'BilledDuration', 'MemorySize', 'MemoryUsed', 'InitDuration']
+
+#
+# Open a log file as text, gzip compressed or not.
+#
+def open_log(path):
+    with open(path, 'rb') as f:
+        compressed = f.read(2) == b'\x1f\x8b'
+    if compressed:
+        return gzip.open(path, 'rt', encoding='utf-8', errors='replace')
+    return open(path, 'r', encoding='utf-8', errors='replace')
+
+#
+# Milliseconds since the epoch of an ISO 8601 timestamp, or None.
+#
+def parse_timestamp(text):
+    try:
+        return int(datetime.fromisoformat(text.replace('Z', '+00:00')).timestamp() * 1000)
+    except ValueError:
+        return None
+
+#
+# Log events of a JSON export as (log group, log stream, timestamp ms, message).
+#
+def json_events(data, log_group_name=None):
+    if isinstance(data, list):
+        for item in data:
+            yield from json_events(item, log_group_name)
+        return
+    if not isinstance(data, dict):
+        return
+    log_group_name = data.get('logGroup', log_group_name)
+    if 'events' in data or 'logEvents' in data:
+        stream = data.get('logStream')
+        for event in data.get('events', data.get('logEvents', [])):
+            yield log_group_name, event.get('logStreamName', stream), event.get('timestamp'), event.get('message', '')
+    elif 'message' in data:
+        yield log_group_name, data.get('logStreamName'), data.get('timestamp'), data['message']
+
+#
+# Log events of a file as (log group, log stream, timestamp ms, message), in file order.
+#
+def log_events(path):
+    with open_log(path) as f:
+        first = f.read(1)
+        while first.isspace():
+            first = f.read(1)
+        f.seek(0)
+
+        if first == '{' or first == '[':
+            text = f.read()
+            try:
+                yield from json_events(json.loads(text))
+                return
+            except ValueError:
+                pass
+            # JSON Lines (one record per line), or plain text that begins with a brace.
+            lines = text.splitlines()
+            try:
+                records = [json.loads(line) for line in lines if line.strip() != '']
+            except ValueError:
+                records = None
+            if records != None and all(isinstance(record, dict) and ('message' in record or 'events' in record or 'logEvents' in record) for record in records):
+                yield from json_events(records)
+                return
+        else:
+            lines = f
+
+        # Plain text, each line optionally prefixed by the timestamp of its event.
+        for line in lines:
+            line = line.rstrip('\n')
+            timestamp = None
+            if len(line) > 20 and line[4] == '-' and line[10] == 'T':
+                space = line.find(' ')
+                if space > 0:
+                    timestamp = parse_timestamp(line[:space])
+                    if timestamp != None:
+                        line = line[space + 1:]
+            yield None, path, timestamp, line
+
+#
+# Joins SAAF records and REPORT lines into one row per request.
+#
+class LogIngester:
+
+    def __init__(self):
+        self.rows = {}
+        self.streams = {}
+        self.unmatched = 0
+
+    def __row(self, request_id):
+        if request_id not in self.rows:
+            self.rows[request_id] = {'requestId': request_id}
+        return self.rows[request_id]
+
+    def __stream(self, stream):
+        if stream not in self.streams:
+            self.streams[stream] = {'request': None, 'block': None, 'timestamp': None}
+        return self.streams[stream]
+
+    #
+    # Add the events of a log file or of every file in a folder.
+    #
+    def add_path(self, path):
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for filename in sorted(files):
+                    self.add_events(log_events(os.path.join(root, filename)))
+        else:
+            self.add_events(log_events(path))
+
+    #
+    # Add (log group, log stream, timestamp ms, message) events in order.
+    #
+    def add_events(self, events):
+        for log_group_name, stream, timestamp, message in events:
+            state = self.__stream(stream)
+            for line in message.split('\n') if '\n' in message else [message]:
+                self.__add_line(state, log_group_name, timestamp, line)
+
+    def __add_line(self, state, log_group_name, timestamp, line):
+        # Lines of an indented SAAF record printed over many log events.
+        if state['block'] != None:
+            state['block'].append(line)
+            if line.startswith('}'):
+                text = '\n'.join(state['block'])
+                state['block'] = None
+                self.__add_json(state, log_group_name, state['timestamp'], text)
+            return
+
+        if line.startswith('REPORT RequestId:'):
+            match = REPORT_LINE.search(line)
+            if match != None:
+                row = self.__row(match.group(1))
+                row['DurationMS'] = float(match.group(2))
+                row['BilledDuration'] = int(match.group(3))
+                row['MemorySize'] = int(match.group(4))
+                row['MemoryUsed'] = int(match.group(5))
+                row['InitDuration'] = float(match.group(6)) if match.group(6) != None else None
+                row['timestamp'] = timestamp
+                if log_group_name != None:
+                    row['logGroup'] = log_group_name
+                state['request'] = None
+        elif line.startswith('START RequestId:'):
+            match = START_LINE.match(line)
+            if match != None:
+                state['request'] = match.group(1)
+        elif line.startswith('{'):
+            stripped = line.rstrip()
+            if stripped == '{':
+                state['block'] = [line]
+                state['timestamp'] = timestamp
+            else:
+                self.__add_json(state, log_group_name, timestamp, stripped)
+
+    def __add_json(self, state, log_group_name, timestamp, text):
+        try:
+            record = json.loads(text)
+        except ValueError:
+            return
+        if not isinstance(record, dict):
+            return
+
+        # Lambda's JSON log format reports platform events as records.
+        if record.get('type') == 'platform.start':
+            state['request'] = record.get('record', {}).get('requestId')
+            return
+        if record.get('type') == 'platform.report':
+            report = record.get('record', {})
+            metrics = report.get('metrics', {})
+            row = self.__row(report.get('requestId'))
+            row['DurationMS'] = metrics.get('durationMs')
+            row['BilledDuration'] = metrics.get('billedDurationMs')
+            row['MemorySize'] = metrics.get('memorySizeMB')
+            row['MemoryUsed'] = metrics.get('maxMemoryUsedMB')
+            row['InitDuration'] = metrics.get('initDurationMs')
+            row['timestamp'] = parse_timestamp(record['time']) if 'time' in record else timestamp
+            if log_group_name != None:
+                row['logGroup'] = log_group_name
+            state['request'] = None
+            return
+
+        # A SAAF record belongs to the request the stream is running.
+        if 'version' not in record or 'runtime' not in record:
+            return
+        request_id = state['request']
+        if request_id == None:
+            self.unmatched += 1
+            request_id = 'unmatched-' + str(self.unmatched)
+        row = self.__row(request_id)
+        for key, value in record.items():
+            if key not in row or key == 'functionName':
+                row[key] = value
+        if log_group_name != None and 'logGroup' not in row:
+            row['logGroup'] = log_group_name
+
+    #
+    # The joined requests as columns. functionName comes from the SAAF record, or else
+    # from the log group, and timestamp is the time of the REPORT line in milliseconds.
+    #
+    def table(self):
+        keys = {'requestId': None, 'functionName': None, 'timestamp': None}
+        for key in REPORT_COLUMNS:
+            keys[key] = None
+        for row in self.rows.values():
+            for key in row:
+                keys[key] = None
+
+        columns = {key: [] for key in keys}
+        for row in self.rows.values():
+            if 'functionName' not in row and 'logGroup' in row:
+                row['functionName'] = row['logGroup'].rsplit('/', 1)[-1]
+            if row.get('timestamp') == None and isinstance(row.get('startTime'), int):
+                row['timestamp'] = row['startTime']
+            for key in keys:
+                columns[key].append(row.get(key))
+        return columns
+
+#
+# Index the rows of a table by function, sorted by timestamp. Rows without a timestamp
+# are left out.
+#
+# @return A dictionary of function name -> (timestamps, row indexes).
+#
+def index_by_function(columns):
+    functions = {}
+    for index, (name, timestamp) in enumerate(zip(columns['functionName'], columns['timestamp'])):
+        if timestamp != None:
+            functions.setdefault(name, []).append((timestamp, index))
+    index = {}
+    for name, entries in functions.items():
+        entries.sort()
+        index[name] = ([timestamp for timestamp, i in entries], [i for timestamp, i in entries])
+    return index
+
+#
+# Indexes of the rows of a function with start_ms <= timestamp <= end_ms, in time order.
+#
+def rows_in_window(index, function_name, start_ms, end_ms):
+    if function_name not in index:
+        return []
+    timestamps, rows = index[function_name]
+    return rows[bisect.bisect_left(timestamps, start_ms):bisect.bisect_right(timestamps, end_ms)]
+
+#
+# Ingest log files and folders into a table.
+#
+def ingest_logs(paths):
+    ingester = LogIngester()
+    for path in paths:
+        ingester.add_path(path)
+    return ingester.table()
+
+#
+# Save a table as a columnar file, or as JSON without pyarrow.
+#
+def save_table(path, columns):
+    count = len(columns['requestId'])
+    if run_store.is_available() and path.endswith(run_store.RUN_FILE_EXTENSION):
+        run_store.write_columns(path, dict(columns), count)
+    else:
+        with open(path, 'w') as f:
+            json.dump(columns, f)
+
+def load_table(path):
+    if path.endswith(run_store.RUN_FILE_EXTENSION):
+        return run_store.read_columns(path)
+    with open(path) as f:
+        return json.load(f)
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print("Usage: ./tools/log_ingest.py {OUTPUT FILE} {LOG FILE OR FOLDER} ...")
+        print("OUTPUT FILE is written as Arrow if it ends in " + run_store.RUN_FILE_EXTENSION + ", otherwise as JSON.")
+        sys.exit(1)
+    table = ingest_logs(sys.argv[2:])
+    save_table(sys.argv[1], table)
+    reports = sum(1 for value in table['DurationMS'] if value != None)
+    print("Ingested " + str(len(table['requestId'])) + " requests (" + str(reports) + " with REPORT lines) into " + sys.argv[1])
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+
+import math
+
+import numpy as np
+
+#
+# Mergeable streaming quantile sketch for FaaS Runner reports.
+#
+# Values are counted in logarithmic buckets (the DDSketch / HDR histogram approach): a
+# bucket i holds values in (gamma^(i-1), gamma^i], so every percentile is estimated
+# within relativeAccuracy of a real value (1% by default) no matter how skewed the
+# distribution is. Memory depends on the range of values, not on how many are added, and
+# is capped at maxBuckets by folding the smallest magnitudes together (which keeps the
+# tail accurate). Two sketches with the same accuracy merge exactly by adding bucket
+# counts, so sketches of iterations can be combined without the runs.
+#
+
+DEFAULT_RELATIVE_ACCURACY = 0.01
+DEFAULT_MAX_BUCKETS = 2048
+DEFAULT_PERCENTILES = [50, 90, 95, 99, 99.9]
+
+# Magnitudes below this are counted as zero.
+MIN_MAGNITUDE = 1e-9
+
+class QuantileSketch:
+
+    def __init__(self, relativeAccuracy=DEFAULT_RELATIVE_ACCURACY, maxBuckets=DEFAULT_MAX_BUCKETS):
+        self.relativeAccuracy = relativeAccuracy
+        self.maxBuckets = maxBuckets
+        self.gamma = (1 + relativeAccuracy) / (1 - relativeAccuracy)
+        self.__logGamma = math.log(self.gamma)
+        self.positive = {}
+        self.negative = {}
+        self.zero = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    #
+    # Add one value.
+    #
+    def add(self, value, count=1):
+        value = float(value)
+        if value > MIN_MAGNITUDE:
+            index = math.ceil(math.log(value) / self.__logGamma)
+            self.positive[index] = self.positive.get(index, 0) + count
+        elif value < -MIN_MAGNITUDE:
+            index = math.ceil(math.log(-value) / self.__logGamma)
+            self.negative[index] = self.negative.get(index, 0) + count
+        else:
+            self.zero += count
+        self.count += count
+        self.sum += value * count
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+        self.__collapse()
+
+    #
+    # Add a sequence or NumPy array of values at once.
+    #
+    def add_all(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        if values.size == 0:
+            return
+        self.__add_buckets(self.positive, values[values > MIN_MAGNITUDE])
+        self.__add_buckets(self.negative, -values[values < -MIN_MAGNITUDE])
+        self.zero += int(np.count_nonzero(np.abs(values) <= MIN_MAGNITUDE))
+        self.count += int(values.size)
+        self.sum += float(values.sum())
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.__collapse()
+
+    def __add_buckets(self, store, magnitudes):
+        if magnitudes.size == 0:
+            return
+        indexes, counts = np.unique(np.ceil(np.log(magnitudes) / self.__logGamma).astype(np.int64), return_counts=True)
+        for index, count in zip(indexes.tolist(), counts.tolist()):
+            store[index] = store.get(index, 0) + count
+
+    #
+    # Add the values of another sketch to this one.
+    #
+    def merge(self, other):
+        if other.gamma != self.gamma:
+            raise ValueError("Cannot merge sketches with different relative accuracy")
+        for index, count in other.positive.items():
+            self.positive[index] = self.positive.get(index, 0) + count
+        for index, count in other.negative.items():
+            self.negative[index] = self.negative.get(index, 0) + count
+        self.zero += other.zero
+        self.count += other.count
+        self.sum += other.sum
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.__collapse()
+        return self
+
+    def __collapse(self):
+        for store in [self.positive, self.negative]:
+            if len(store) > self.maxBuckets:
+                indexes = sorted(store)
+                folded = indexes[:len(store) - self.maxBuckets + 1]
+                total = 0
+                for index in folded:
+                    total += store.pop(index)
+                store[folded[-1]] = total
+
+    #
+    # Buckets in value order as (representative value, count).
+    #
+    def __buckets(self):
+        for index in sorted(self.negative, reverse=True):
+            yield -self.__bucket_value(index), self.negative[index]
+        if self.zero > 0:
+            yield 0.0, self.zero
+        for index in sorted(self.positive):
+            yield self.__bucket_value(index), self.positive[index]
+
+    def __bucket_value(self, index):
+        return 2 * self.gamma ** index / (self.gamma + 1)
+
+    #
+    # Estimate the q-th quantile (0 <= q <= 1). q = 0 and q = 1 give the exact min and max.
+    #
+    def quantile(self, q):
+        if self.count == 0:
+            return None
+        if q <= 0:
+            return self.min
+        if q >= 1:
+            return self.max
+
+        rank = q * (self.count - 1)
+        seen = 0
+        for value, count in self.__buckets():
+            seen += count
+            if seen > rank:
+                return min(max(value, self.min), self.max)
+        return self.max
+
+    #
+    # Estimate a percentile (0 to 100).
+    #
+    def percentile(self, p):
+        return self.quantile(p / 100)
+
+    def mean(self):
+        return self.sum / self.count if self.count > 0 else None
+
+    #
+    # Counts in `bins` equal width bins between min and max.
+    #
+    # @return A list of [lower edge, count].
+    #
+    def histogram(self, bins):
+        if self.count == 0:
+            return []
+        width = (self.max - self.min) / bins
+        counts = [0] * bins
+        for value, count in self.__buckets():
+            if width > 0:
+                binIndex = int((value - self.min) / width)
+            else:
+                binIndex = 0
+            counts[max(0, min(bins - 1, binIndex))] += count
+        return [[self.min + width * i, counts[i]] for i in range(bins)]
+
+    #
+    # JSON friendly form of the sketch, readable with from_dict.
+    #
+    def to_dict(self):
+        return {
+            'relativeAccuracy': self.relativeAccuracy,
+            'maxBuckets': self.maxBuckets,
+            'positive': {str(index): count for index, count in self.positive.items()},
+            'negative': {str(index): count for index, count in self.negative.items()},
+            'zero': self.zero,
+            'count': self.count,
+            'sum': self.sum,
+            'min': self.min if self.count > 0 else None,
+            'max': self.max if self.count > 0 else None
+        }
+
+    @staticmethod
+    def from_dict(data):
+        sketch = QuantileSketch(data['relativeAccuracy'], data['maxBuckets'])
+        sketch.positive = {int(index): count for index, count in data['positive'].items()}
+        sketch.negative = {int(index): count for index, count in data['negative'].items()}
+        sketch.zero = data['zero']
+        sketch.count = data['count']
+        sketch.sum = data['sum']
+        if sketch.count > 0:
+            sketch.min = data['min']
+            sketch.max = data['max']
+        return sketch
+
+#
+# Merge a dictionary of sketches into another, key by key. Sketches are copied, never shared.
+#
+def merge_sketches(target, sketches):
+    for key, sketch in sketches.items():
+        if key in target:
+            target[key].merge(sketch)
+        else:
+            target[key] = QuantileSketch(sketch.relativeAccuracy, sketch.maxBuckets).merge(sketch)
+    return target
+
+#
+# Column label of a percentile, e.g. 99.9 -> "p99.9".
+#
+def percentile_label(p):
+    return "p" + format(p, 'g')
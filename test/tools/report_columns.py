@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+
+import math
+import re
+from decimal import Decimal
+
+import numpy as np
+
+from quantile_sketch import QuantileSketch
+
+#
+# Columnar aggregation backend for report_generator.
+#
+# Runs are read into one list per attribute, and numeric attributes are parsed once
+# into scaled int64 arrays, so group sums and averages are computed with a few NumPy
+# passes instead of a Decimal parse per cell per category. Results are the exact
+# Decimal values the row-by-row report produced, so output is unchanged.
+#
+
+# Plain decimal literals ("12", "-3.250") that can be summed exactly as scaled integers.
+PLAIN_NUMBER = re.compile(r'-?\d+(?:\.(\d+))?\Z')
+
+# Largest scaled magnitude summed in int64 without any chance of overflow.
+MAX_SCALED_TOTAL = 2 ** 62
+
+#
+# Collect every attribute of the runs, in first-seen order, and give runs missing an
+# attribute the -999999999999 placeholder.
+#
+def fill_missing_keys(run_results):
+    key_order = {}
+    for run in run_results:
+        for key in run:
+            key_order[key] = None
+
+    warned = False
+    for run in run_results:
+        if len(run) == len(key_order):
+            continue
+        for key in key_order:
+            if key not in run:
+                if not warned:
+                    print("PAYLOADS DO NOT CONTAIN EQUIVALENT ATTRIBUTES. MISSING ATTRIBUTES WILL BE FILLED WITH -999999999999 PURPOSEFULLY MAKING SUMS AND AVERAGES INCORRECT AS THEY CAN NO LONGER BE CALCULATED PROPERLY.")
+                    warned = True
+                run[key] = -999999999999
+    return list(key_order)
+
+#
+# Find runs that match an invalidator or reuse a container seen earlier in the run list.
+#
+# Returns (number of runs flagged, indexes of the runs to remove). A run flagged by more
+# than one rule is counted each time, as in the original report.
+#
+def find_invalid_runs(run_results, invalidators, removeDuplicateContainers):
+    flagged = 0
+    invalid = set()
+    containers = set()
+    invalidValues = {key: str(value) for key, value in invalidators.items()}
+    for index, run in enumerate(run_results):
+        if removeDuplicateContainers:
+            if run['uuid'] in containers:
+                flagged += 1
+                invalid.add(index)
+            else:
+                containers.add(run['uuid'])
+
+        for key, value in invalidValues.items():
+            if key in run and str(run[key]) == value:
+                flagged += 1
+                invalid.add(index)
+    return flagged, invalid
+
+#
+# Group runs by the value of an attribute.
+#
+# Returns a dictionary of value -> list of run indexes, with values in first-seen order
+# and indexes in run order.
+#
+def group_runs(run_results, key):
+    groups = {}
+    for index, run in enumerate(run_results):
+        if key in run:
+            value = run[key]
+            if value in groups:
+                groups[value].append(index)
+            else:
+                groups[value] = [index]
+    return groups
+
+#
+# Attribute values of the runs, read once per attribute and shared by every category.
+#
+class RunColumns:
+
+    def __init__(self, run_results):
+        self.run_results = run_results
+        self.__columns = {}
+        self.__scaled = {}
+        self.__decimals = {}
+        self.__floats = {}
+
+    #
+    # All values of an attribute, in run order.
+    #
+    def column(self, attribute):
+        if attribute not in self.__columns:
+            self.__columns[attribute] = [run[attribute] for run in self.run_results]
+        return self.__columns[attribute]
+
+    #
+    # The attribute as (scaled int64 values, decimal places of each value, scale), where
+    # value = scaled / 10^scale, or None when a value is not a plain decimal literal or
+    # totals could overflow.
+    #
+    def scaled(self, attribute):
+        if attribute not in self.__scaled:
+            self.__scaled[attribute] = self.__parse_scaled(self.column(attribute))
+        return self.__scaled[attribute]
+
+    def __parse_scaled(self, values):
+        digits = []
+        places = []
+        for value in values:
+            if isinstance(value, str):
+                match = PLAIN_NUMBER.match(value)
+                if match == None:
+                    return None
+                fraction = match.group(1)
+                if fraction == None:
+                    digits.append(int(value))
+                    places.append(0)
+                else:
+                    digits.append(int(value.replace('.', '', 1)))
+                    places.append(len(fraction))
+            elif type(value) == int:
+                digits.append(value)
+                places.append(0)
+            else:
+                return None
+
+        scale = max(places) if len(places) > 0 else 0
+        if scale > 18:
+            return None
+        scaled = [digit * 10 ** (scale - place) for digit, place in zip(digits, places)]
+        largest = max(abs(value) for value in scaled) if len(scaled) > 0 else 0
+        if largest * len(scaled) >= MAX_SCALED_TOTAL:
+            return None
+        return np.array(scaled, dtype=np.int64), np.array(places, dtype=np.int64), scale
+
+    #
+    # The attribute parsed with Decimal, or the exception raised for values that cannot be.
+    #
+    def decimals(self, attribute):
+        if attribute not in self.__decimals:
+            parsed = []
+            for value in self.column(attribute):
+                try:
+                    parsed.append(Decimal(value))
+                except Exception as e:
+                    parsed.append(e)
+            self.__decimals[attribute] = parsed
+        return self.__decimals[attribute]
+
+    #
+    # The attribute as a float64 array, NaN where a value is not a number.
+    #
+    def floats(self, attribute):
+        if attribute not in self.__floats:
+            scaled = self.scaled(attribute)
+            if scaled != None:
+                values, places, scale = scaled
+                self.__floats[attribute] = values / float(10 ** scale)
+            else:
+                self.__floats[attribute] = np.array([math.nan if isinstance(value, Exception) else float(value)
+                                                     for value in self.decimals(attribute)], dtype=np.float64)
+        return self.__floats[attribute]
+
+    #
+    # A QuantileSketch of an attribute for each group (lists of run indexes). Values that
+    # are not finite numbers are left out.
+    #
+    def sketches(self, attribute, groups, relativeAccuracy):
+        values = self.floats(attribute)
+        sketches = []
+        for indexes in groups:
+            groupValues = values[np.asarray(indexes, dtype=np.int64)]
+            sketch = QuantileSketch(relativeAccuracy)
+            sketch.add_all(groupValues[np.isfinite(groupValues)])
+            sketches.append(sketch)
+        return sketches
+
+    #
+    # Decimal total of an attribute for each group (lists of run indexes), equal to adding
+    # Decimal(value) for every run of the group in order, starting from 0. Values that
+    # cannot be parsed are reported with errorMessage and skipped.
+    #
+    def totals(self, attribute, groups, errorMessage):
+        scaled = self.scaled(attribute)
+        if scaled != None and len(groups) > 0:
+            return self.__vector_totals(scaled, groups)
+
+        parsed = self.decimals(attribute)
+        totals = []
+        for indexes in groups:
+            total_value = 0
+            for index in indexes:
+                value = parsed[index]
+                if isinstance(value, Exception):
+                    print(errorMessage + str(value))
+                else:
+                    total_value += value
+            totals.append(total_value)
+        return totals
+
+    def __vector_totals(self, scaled, groups):
+        values, places, scale = scaled
+        order = np.concatenate([np.asarray(indexes, dtype=np.int64) for indexes in groups])
+        sizes = np.array([len(indexes) for indexes in groups], dtype=np.int64)
+        starts = np.concatenate(([0], np.cumsum(sizes)[:-1]))
+        sums = np.add.reduceat(values[order], starts)
+        groupPlaces = np.maximum.reduceat(places[order], starts)
+
+        # A Decimal sum keeps the most decimal places of any of its terms.
+        totals = []
+        for total, place in zip(sums.tolist(), groupPlaces.tolist()):
+            totals.append(Decimal(total // 10 ** (scale - place)).scaleb(-place))
+        return totals
+
+#
+# Sorted unique values of an attribute for each group (lists of run indexes).
+#
+def unique_values(values, groups):
+    lists = []
+    for indexes in groups:
+        try:
+            attribute_list = list(dict.fromkeys([values[index] for index in indexes]))
+        except TypeError:
+            attribute_list = []
+            for index in indexes:
+                if values[index] not in attribute_list:
+                    attribute_list.append(values[index])
+        try:
+            attribute_list.sort()
+        except Exception as e:
+            print("Could not perform sort... " + str(e))
+        lists.append(attribute_list)
+    return lists
@@ -1,6 +1,7 @@
 #!/usr/bin/env python3
 
 import ast
+import bisect
 import datetime
 import json
 import os
@@ -11,20 +12,165 @@ import time
 import uuid
 from decimal import Decimal
 
+from quantile_sketch import DEFAULT_PERCENTILES, DEFAULT_RELATIVE_ACCURACY, percentile_label
+from report_columns import RunColumns, fill_missing_keys, find_invalid_runs, group_runs, unique_values
+import run_store
+
+#
+# Insert runtimeOverlap into runs by comparing every pair of runs. O(n^2), kept as a
+# reference for runtime_overlap_sweep.
+#
+def runtime_overlap_pairwise(run_results, overlapFilter):
+    for i in range(len(run_results)):
+        run1 = run_results[i]
+        start1 = int(run1['startTime'])
+        end1 = int(run1['endTime'])
+        length1 = max(end1 - start1, 1)
+        totalDist = 0
+        for j in range(len(run_results)):
+            if i == j: continue
+            run2 = run_results[j]
+            if (overlapFilter != "" and overlapFilter != None):
+                if (overlapFilter in run1 and overlapFilter in run2):
+                    if (run1[overlapFilter] != run2[overlapFilter]):
+                        continue
+                else:
+                    continue
+            start2 = max(min(int(run2['startTime']), end1), start1)
+            end2 = max(min(int(run2['endTime']), end1), start1)
+            length2 = end2 - start2
+            totalDist += length2 / length1
+        run1['runtimeOverlap'] = str(round(totalDist, 2))
+
+#
+# Runs of a group indexed by the earlier of their start and end times, to find the runs
+# that can overlap a time window without scanning the whole group.
+#
+class RunWindow:
+
+    def __init__(self, runs):
+        self.runs = runs
+        bounds = sorted((min(int(run['startTime']), int(run['endTime'])), index) for index, run in enumerate(runs))
+        self.lows = [low for low, index in bounds]
+        self.indexes = [index for low, index in bounds]
+        self.maxLength = max(abs(int(run['endTime']) - int(run['startTime'])) for run in runs)
+
+    #
+    # Runs that may overlap [start, end], in their original order.
+    #
+    def overlapping(self, start, end):
+        first = bisect.bisect_left(self.lows, start - self.maxLength)
+        last = bisect.bisect_right(self.lows, end)
+        return [self.runs[index] for index in sorted(self.indexes[first:last])]
+
+#
+# Insert runtimeOverlap into runs with a sweep line. O(n log n), same results as
+# runtime_overlap_pairwise.
+#
+# Within each overlapFilter group, the number of runs executing at time t is a step
+# function that changes only at start and end times. Sweeping the sorted times once gives
+# its running integral F, and the total time other runs overlap run [start, end] is
+# F(end) - F(start) minus the run itself. A run whose endTime is before its startTime
+# counts negatively, as in the pairwise calculation.
+#
+# The sweep gives the exact overlap, while the pairwise loop adds up one float per run and
+# can be off by a few ulps. That only changes the rounded value (or the sign of 0.0) when
+# the exact overlap is within the summation's error bound of a half-cent or of 0, so those
+# runs are summed pairwise, in the same order, to round the same way.
+#
+def runtime_overlap_sweep(run_results, overlapFilter):
+    groups = {}
+    for run in run_results:
+        if (overlapFilter != "" and overlapFilter != None):
+            if overlapFilter not in run:
+                run['runtimeOverlap'] = str(round(0, 2))
+                continue
+            key = run[overlapFilter]
+        else:
+            key = None
+        groups.setdefault(key, []).append(run)
+
+    for group in groups.values():
+        # Concurrent runs, and concurrent inverted runs for the summation error bound
+        changes = {}
+        inverted = {}
+        for run in group:
+            start = int(run['startTime'])
+            end = int(run['endTime'])
+            changes[start] = changes.get(start, 0) + 1
+            changes[end] = changes.get(end, 0) - 1
+            if end < start:
+                inverted[end] = inverted.get(end, 0) + 1
+                inverted[start] = inverted.get(start, 0) - 1
+
+        integral = {}
+        invertedIntegral = {}
+        total = 0
+        invertedTotal = 0
+        running = 0
+        invertedRunning = 0
+        previous = None
+        for point in sorted(changes):
+            if previous != None:
+                total += running * (point - previous)
+                invertedTotal += invertedRunning * (point - previous)
+            integral[point] = total
+            invertedIntegral[point] = invertedTotal
+            running += changes[point]
+            invertedRunning += inverted.get(point, 0)
+            previous = point
+
+        window = None
+        for run in group:
+            start = int(run['startTime'])
+            end = int(run['endTime'])
+            if len(group) == 1:
+                run['runtimeOverlap'] = str(round(0, 2))
+                continue
+            if end < start:
+                run['runtimeOverlap'] = str(round(0.0, 2))
+                continue
+
+            length = max(end - start, 1)
+            overlap = integral[end] - integral[start] - (end - start)
+            absoluteOverlap = overlap + 2 * (invertedIntegral[end] - invertedIntegral[start])
+
+            # Distance of overlap / length from the nearest half-cent, or from 0 where the
+            # sign decides between 0.0 and -0.0, times 200 * length
+            distance = min(abs((200 * overlap) % (2 * length) - length), abs(200 * overlap))
+            if absoluteOverlap > 0 and distance <= 400 * len(group) * absoluteOverlap * 2 ** -52:
+                if window == None:
+                    window = RunWindow(group)
+                # Runs outside [start, end] add 0.0, which leaves a float sum unchanged
+                totalDist = 0.0
+                for other in window.overlapping(start, end):
+                    if other is run: continue
+                    otherStart = max(min(int(other['startTime']), end), start)
+                    otherEnd = max(min(int(other['endTime']), end), start)
+                    totalDist += (otherEnd - otherStart) / length
+            else:
+                totalDist = overlap / length
+            run['runtimeOverlap'] = str(round(totalDist, 2))
+
 #
 # Parse a list of FaaS Response objects into a report.
 #
 # Reports can be broken into groups.
 #
+# sketches is an optional dictionary of QuantileSketches keyed by (category, group,
+# attribute) for showAsPercentiles attributes. Sketches already in it are used instead of
+# the runs (e.g. sketches merged from earlier iterations), and every sketch the report
+# builds is added to it so it can be merged into later reports.
+#
 # @author Robert Cordingly
 #
-def report(responses, exp):
+def report(responses, exp, sketches=None):
     print("\n-----------------------------------------------------------------")    
     print("GENERATING REPORT... (report_generator.py)")
     print("-----------------------------------------------------------------\n")
 
 
-    output = ""
+    output = []
     threads = exp['threads']
     total_runs = exp['runs']
     runs_per_thread = int(total_runs / threads)
@@ -59,6 +205,14 @@ def report(responses, exp):
 
     overlapFilter = exp['overlapFilter']
 
+    # In the category breakdown, these numeric attributes also get min, percentile and max columns (and histograms).
+    percentile_category = exp.get('showAsPercentiles', [])
+    percentiles = exp.get('percentiles', DEFAULT_PERCENTILES)
+    histogram_bins = exp.get('histogramBins', 0)
+    relative_accuracy = exp.get('percentileAccuracy', DEFAULT_RELATIVE_ACCURACY)
+    if sketches == None:
+        sketches = {}
+
     for dictionary in responses:
         if 'vmID' in dictionary and 'vmuptime' in categories:
             categories.remove('vmuptime')
@@ -75,41 +229,16 @@ def report(responses, exp):
     #
     # Fill in missing keys.
     #
-    runKeyList = []
-    for run in run_results:
-        for key in list(run.keys()):
-            if key not in runKeyList:
-                runKeyList.append(key)
-    for run in run_results:
-        for key in runKeyList:
-            if key not in run:
-                print("PAYLOADS DO NOT CONTAIN EQUIVALENT ATTRIBUTES. MISSING ATTRIBUTES WILL BE FILLED WITH -999999999999 PURPOSEFULLY MAKING SUMS AND AVERAGES INCORRECT AS THEY CAN NO LONGER BE CALCULATED PROPERLY.")
-                run[key] = -999999999999
+    fill_missing_keys(run_results)
 
     #
     # Insert runtimeOverlap into runs.  
     #
     if 'startTime' in run_results[0] and 'endTime' in run_results[0]:
-        for i in range(len(run_results)):
-            run1 = run_results[i]
-            start1 = int(run1['startTime'])
-            end1 = int(run1['endTime'])
-            length1 = max(end1 - start1, 1)
-            totalDist = 0
-            for j in range(len(run_results)):
-                if i == j: continue
-                run2 = run_results[j]
-                if (overlapFilter != "" and overlapFilter != None):
-                    if (overlapFilter in run1 and overlapFilter in run2):
-                        if (run1[overlapFilter] != run2[overlapFilter]):
-                            continue
-                    else:
-                        continue
-                start2 = max(min(int(run2['startTime']), end1), start1)
-                end2 = max(min(int(run2['endTime']), end1), start1)
-                length2 = end2 - start2
-                totalDist += length2 / length1
-            run1['runtimeOverlap'] = str(round(totalDist, 2))
+        if exp.get('overlapMethod', 'sweep') == 'pairwise':
+            runtime_overlap_pairwise(run_results, overlapFilter)
+        else:
+            runtime_overlap_sweep(run_results, overlapFilter)
 
     # Calculate pipline metrics.
     if '3_pipeline_stage' in run_results[0]:
@@ -169,60 +298,27 @@ def report(responses, exp):
     #
     # Print starter information
     #
-    output += str(datetime.datetime.now()) + " - Python Partest Version 0.5\n"
-    output += "Setting up test: runsperthread=" + str(runs_per_thread) + " threads=" + str(
-        threads) + " totalruns=" + str(total_runs) + " payload=" + str(payload).replace(",","") + "\n"
-
-    csv_header = ""
-    key_list = list(run_results[0].keys())
-    key_list.sort()
-    for i in range(len(key_list)):
-        if key_list[i] not in ignore_attributes:
-            csv_header += key_list[i] + ","
-    csv_header = csv_header[:-1]
-    output += "\n"
-    output += "Raw results of each run:\n"
-    output += csv_header + "\n"
+    output.append(str(datetime.datetime.now()) + " - Python Partest Version 0.5\n")
+    output.append("Setting up test: runsperthread=" + str(runs_per_thread) + " threads=" + str(
+        threads) + " totalruns=" + str(total_runs) + " payload=" + str(payload).replace(",","") + "\n")
 
-    for i in range(len(run_results)):
-        line = ""
-        run = run_results[i]
-        for i in range(len(key_list)):
-            if key_list[i] not in ignore_attributes:
-                if key_list[i] in run:
-                    line += str(run[key_list[i]]) + ","
-                else:
-                    line += "NONE,"
-        line = line[:-1]
-        output += line + "\n"
-    output += "Successful Runs: " + str(len(run_results)) + "\n"
+    key_list = [key for key in sorted(run_results[0].keys()) if key not in ignore_attributes]
+    output.append("\n")
+    output.append("Raw results of each run:\n")
+    output.append(",".join(key_list) + "\n")
+
+    for run in run_results:
+        output.append(",".join([str(run[key]) if key in run else "NONE" for key in key_list]) + "\n")
+    output.append("Successful Runs: " + str(len(run_results)) + "\n")
 
     #
     # Purge runs list of runs with specific invalid parameters or duplicate containers.
     #
-    invalidRuns = []
-    invalidKeys = list(invalidators.keys())
-    containers = []
-    for i in range(len(run_results)):
-        run = run_results[i]
-
-        if removeDuplicateContainers:
-            if run['uuid'] in containers:
-                invalidRuns.append(run)
-            else:
-                containers.append(run['uuid'])
-
-        for j in range(len(invalidKeys)):
-            key_value = invalidKeys[j]
-            if key_value in list(run.keys()) and str(run[key_value]) == str(invalidators[key_value]):
-                invalidRuns.append(run)
-
-    if len(invalidRuns) > 0:
-        output += "\n" + str(len(invalidRuns)) + \
-            " runs removed from categories....\n"
-        for i in range(len(invalidRuns)):
-            if invalidRuns[i] in run_results:
-                run_results.remove(invalidRuns[i])
+    invalidCount, invalidRuns = find_invalid_runs(run_results, invalidators, removeDuplicateContainers)
+    if invalidCount > 0:
+        output.append("\n" + str(invalidCount) + \
+            " runs removed from categories....\n")
+        run_results[:] = [run for i, run in enumerate(run_results) if i not in invalidRuns]
 
     #
     # Insert zTenancy attribute as a combination of CPU Type and VM uses.
@@ -256,63 +352,45 @@ def report(responses, exp):
 
     #
     # Build new dictionaries for each category.
-    # key_map defines the dictionary to put runs with unique keys into.
+    # key_map maps each category to its unique values and the runs (indexes) with them.
     #
     key_map = {}
-    for i in range(len(categories)):
-        key_map[categories[i]] = {}
-
-    master_key_list = list(key_map.keys())
-    for i in range(len(run_results)):
-        run = run_results[i]
-        for i in range(len(master_key_list)):
-            target_key = master_key_list[i]
-            if target_key in list(run.keys()):
-                if run[target_key] not in list(key_map[target_key].keys()):
-                    key_map[target_key][run[target_key]] = [run]
-                else:
-                    key_map[target_key][run[target_key]].append(run)
+    for category in categories:
+        key_map[category] = group_runs(run_results, category)
+    columns = RunColumns(run_results)
 
     #
     # Loop through every dictionary created previously.
     # Find values that can be parsed into doubles and calculate the average of them.
     #
-    master_key_list.sort()
-    for i in range(len(master_key_list)):
-        key_value = master_key_list[i]
+    master_key_list = sorted(key_map.keys())
+    for key_value in master_key_list:
         sub_key_list = list(key_map[key_value].keys())
         if len(sub_key_list) != 0:
-            output += "\n"
-            output += "Category " + \
-                str(key_value) + ":\n"
-
-            csv_header = str(key_value) + ",uses,"
-            run_dict = key_map[key_value][sub_key_list[0]][0]
-            run_attributes = list(run_dict.keys())
-            run_attributes.sort()
-            number_attributes = []
+            output.append("\n")
+            output.append("Category " + \
+                str(key_value) + ":\n")
 
-            # Build CSV Header Line
-            for i in range(len(run_attributes)):
-                attribute = run_attributes[i]
+            ignored = set(ignore_attributes) | set(ignore_attributes_from_all_categories)
+            if key_value in ignore_attributes_from_specific_categories:
+                ignored |= set(ignore_attributes_from_specific_categories[key_value])
 
-                valid = True
-                if attribute in ignore_attributes or attribute in ignore_attributes_from_all_categories:
-                    valid = False
-
-                if key_value in ignore_attributes_from_specific_categories:
-                    if attribute in list(ignore_attributes_from_specific_categories[key_value]):
-                        valid = False
+            csv_header = [str(key_value), "uses"]
+            run_dict = run_results[key_map[key_value][sub_key_list[0]][0]]
+            run_attributes = sorted(run_dict.keys())
+            number_attributes = []
 
-                if valid:
+            # Build CSV Header Line
+            for attribute in run_attributes:
+                if attribute not in ignored:
                     if attribute in list_category:
-                        csv_header += str(attribute) + "_list,"
+                        csv_header.append(str(attribute) + "_list")
                         number_attributes.append(attribute)
                     elif attribute in sum_category:
                         try:
                             value = run_dict[attribute]
                             Decimal(value)
-                            csv_header += "sum_" + str(attribute) + ","
+                            csv_header.append("sum_" + str(attribute))
                             number_attributes.append(attribute)
                         except:
                             pass
@@ -320,115 +398,88 @@ def report(responses, exp):
                         try:
                             value = run_dict[attribute]
                             Decimal(value)
-                            csv_header += "avg_" + str(attribute) + ","
+                            csv_header.append("avg_" + str(attribute))
                             number_attributes.append(attribute)
                         except:
                             pass
 
-            csv_header = csv_header[:-1]
-            output += csv_header + "\n"
+                    if attribute in percentile_category and attribute in number_attributes and attribute not in list_category:
+                        csv_header.append("min_" + str(attribute))
+                        for p in percentiles:
+                            csv_header.append(percentile_label(p) + "_" + str(attribute))
+                        csv_header.append("max_" + str(attribute))
+                        if histogram_bins > 0:
+                            csv_header.append(str(attribute) + "_hist")
+
+            output.append(",".join(csv_header) + "\n")
 
             # Print out each run of this category.
             try:
                 sub_key_list.sort()
             except Exception as e:
                 print(str(e))
-            for i in range(len(sub_key_list)):
-                run_list = key_map[key_value][sub_key_list[i]]
-                uses_of_category = len(run_list)
-                line = str(sub_key_list[i]) + "," + str(uses_of_category) + ","
-                for j in range(len(number_attributes)):
-                    attribute = number_attributes[j]
-
-                    valid = True
-                    if attribute in ignore_attributes or attribute in ignore_attributes_from_all_categories:
-                        valid = False
-
-                    if key_value in ignore_attributes_from_specific_categories:
-                        if attribute in list(ignore_attributes_from_specific_categories[key_value]):
-                            valid = False
-
-                    if valid:
-                        if attribute in list_category:
-                            attribute_list = []
-                            for k in range(len(run_list)):
-                                run_dict = run_list[k]
-                                if run_dict[attribute] not in attribute_list:
-                                    attribute_list.append(run_dict[attribute])
-                            try:
-                                attribute_list.sort()
-                            except Exception as e:
-                                print("Could not perform sort... " + str(e))
-                            line += str(attribute_list).replace(',', ';') + ","
-                        elif attribute in sum_category:
-                            total_value = 0
-                            for k in range(len(run_list)):
-                                run_dict = run_list[k]
-                                try:
-                                    total_value += Decimal(run_dict[attribute])
-                                except Exception as e:
-                                    print("Could not perform math... " + str(e))
-                            line += str(total_value) + ","
-                        else:
-                            total_value = 0
-                            for k in range(len(run_list)):
-                                run_dict = run_list[k]
-                                try:
-                                    total_value += Decimal(run_dict[attribute])
-                                except Exception as e:
-                                    print("Could not perform math..." + str(e))
-                            line += str(round((total_value /
-                                               len(run_list)), 2)) + ","
-                line = line[:-1]
-                output += line + "\n"				
-            output += "Total number of unique " + str(key_value) + "s: " + str(len(sub_key_list)) + "\n"
+            groups = [key_map[key_value][sub_key] for sub_key in sub_key_list]
+
+            # Aggregate one attribute at a time over every group.
+            cells = [[str(sub_key), str(len(run_list))] for sub_key, run_list in zip(sub_key_list, groups)]
+            for attribute in number_attributes:
+                if attribute in list_category:
+                    for cell, attribute_list in zip(cells, unique_values(columns.column(attribute), groups)):
+                        cell.append(str(attribute_list).replace(',', ';'))
+                elif attribute in sum_category:
+                    totals = columns.totals(attribute, groups, "Could not perform math... ")
+                    for cell, total_value in zip(cells, totals):
+                        cell.append(str(total_value))
+                else:
+                    totals = columns.totals(attribute, groups, "Could not perform math...")
+                    for cell, total_value, run_list in zip(cells, totals, groups):
+                        cell.append(str(round((total_value /
+                                               len(run_list)), 2)))
+
+                if attribute in percentile_category and attribute not in list_category:
+                    keys = [(key_value, str(sub_key), attribute) for sub_key in sub_key_list]
+                    missing = [i for i, key in enumerate(keys) if key not in sketches]
+                    if len(missing) > 0:
+                        built = columns.sketches(attribute, [groups[i] for i in missing], relative_accuracy)
+                        for i, sketch in zip(missing, built):
+                            sketches[keys[i]] = sketch
+                    for cell, key in zip(cells, keys):
+                        sketch = sketches[key]
+                        cell.append(format_statistic(sketch.quantile(0)))
+                        for p in percentiles:
+                            cell.append(format_statistic(sketch.percentile(p)))
+                        cell.append(format_statistic(sketch.quantile(1)))
+                        if histogram_bins > 0:
+                            histogram = [[round(edge, 2), count] for edge, count in sketch.histogram(histogram_bins)]
+                            cell.append(str(histogram).replace(',', ';'))
+            for cell in cells:
+                output.append(",".join(cell) + "\n")
+            output.append("Total number of unique " + str(key_value) + "s: " + str(len(sub_key_list)) + "\n")
 
             # Print out raw results of category.
             if key_value in list_runs_of_category:
 
-                output += "\n--- Runs of Group " + str(key_value) + " ---\n"
+                output.append("\n--- Runs of Group " + str(key_value) + " ---\n")
 
-                for i in range(len(sub_key_list)):
-                    run_list = key_map[key_value][sub_key_list[i]]
-                    output += "\nCategory " + str(key_value) + " with " + str(sub_key_list[i]) + ":\n"
-                    
-                    run_attributes = list(run_list[0].keys())
-                    run_attributes.sort()
+                for sub_key, run_list in zip(sub_key_list, groups):
+                    output.append("\nCategory " + str(key_value) + " with " + str(sub_key) + ":\n")
 
                     # Build CSV Header Line
-                    csv_header = ""
-                    for i in range(len(run_attributes)):
-                        attribute = run_attributes[i]
-
-                        valid = True
-                        if attribute in ignore_attributes or attribute in ignore_attributes_from_all_categories:
-                            valid = False
-
-                        if key_value in ignore_attributes_from_specific_categories:
-                            if attribute in list(ignore_attributes_from_specific_categories[key_value]):
-                                valid = False
-
-                        if valid:
-                            csv_header += str(attribute) + ","
-                    csv_header = csv_header[:-1]
-                    output += csv_header + "\n"
-
-                    for run in run_list:
-                        line = ""
-                        for attribute in run_attributes:
-                            valid = True
-                            if attribute in ignore_attributes or attribute in ignore_attributes_from_all_categories:
-                                valid = False
-
-                            if key_value in ignore_attributes_from_specific_categories:
-                                if attribute in list(ignore_attributes_from_specific_categories[key_value]):
-                                    valid = False
-
-                            if valid:
-                                line += str(run[attribute]) + ","
-                        line = line[:-1]
-                        output += line + "\n"
-    return output
+                    run_attributes = [attribute for attribute in sorted(run_results[run_list[0]].keys()) if attribute not in ignored]
+                    output.append(",".join(run_attributes) + "\n")
+
+                    for index in run_list:
+                        run = run_results[index]
+                        output.append(",".join([str(run[attribute]) for attribute in run_attributes]) + "\n")
+    return "".join(output)
+
+#
+# Format a sketch statistic for a report cell.
+#
+def format_statistic(value):
+    if value == None:
+        return "NONE"
+    return str(round(value, 2))
 
 #
 # Generate a report based off of a folder of payloads.
@@ -439,21 +490,14 @@ def report_from_folder(path, exp):
     print("-----------------------------------------------------------------\n")
 
 
-    if (not os.path.isdir(path)):
+    # A single columnar file of runs can be given instead of a folder.
+    if (os.path.isfile(path) and path.endswith(run_store.RUN_FILE_EXTENSION)):
+        run_list = run_store.read_runs(path)
+    elif (not os.path.isdir(path)):
         print("Directory does not exist!")
         return ""
-
-    run_list = []
-    for filename in os.listdir(path):
-        if filename.endswith(".json"):
-            try:
-                run = json.load(open(path + '/' + str(filename)))
-                run_list.append(run)
-            except Exception as e:
-                print("Error loading: " + path + '/' + str(filename) + " with exception " + str(e))
-                pass
-        else:
-            continue
+    else:
+        run_list = run_store.read_run_folder(path)
 
     print(str(run_list))
     return report(run_list, exp)
@@ -473,8 +517,11 @@ def write_file(baseFileName, data, openFile, runList = []):
                 duplicates += 1
             baseFileName += "-" + str(duplicates)
 
-        # Write runs to folder if needed.
-        if (len(runList) > 0):
+        # Write runs to a columnar file, or a folder of JSON files without pyarrow.
+        if (len(runList) > 0 and run_store.is_available()):
+            print("Writing raw runs to " + baseFileName + run_store.RUN_FILE_EXTENSION)
+            run_store.write_runs(baseFileName + run_store.RUN_FILE_EXTENSION, runList)
+        elif (len(runList) > 0):
             print("Writing raw runs to folder " + baseFileName)
             if not os.path.exists(baseFileName):
                 os.makedirs(baseFileName)
@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+
+import json
+import os
+import time
+from threading import Lock
+
+#
+# Streaming result sink for FaaS Runner experiments.
+#
+# Each result is appended to a JSON Lines file as soon as it arrives, so memory use does
+# not grow with the length of an experiment and every completed run is already on disk
+# if the driver crashes. Lines are flushed as they are written.
+#
+
+PROGRESS_FILE = '.progress.txt'
+
+# Minimum number of seconds between progress file updates.
+DEFAULT_PROGRESS_INTERVAL = 1.0
+
+#
+# Write the percentage of runs completed to the progress file.
+#
+def write_progress(count, maxRuns):
+    percent = round((count / maxRuns) * 100) if maxRuns > 0 else 100
+    f = open(PROGRESS_FILE, "w")
+    f.write(str(percent))
+    f.close()
+
+#
+# Appends results to a JSON Lines file. Safe to share between threads.
+#
+class ResultSink:
+
+    def __init__(self, path, maxRuns, progressInterval=DEFAULT_PROGRESS_INTERVAL):
+        self.path = path
+        self.maxRuns = maxRuns
+        self.progressInterval = progressInterval
+        self.count = 0
+        self.__lastProgress = 0
+        self.__lock = Lock()
+        directory = os.path.dirname(path)
+        if directory != "" and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.__file = open(path, "a")
+
+    #
+    # Append one result.
+    #
+    def write(self, result):
+        line = json.dumps(result) + "\n"
+        with self.__lock:
+            self.__file.write(line)
+            self.__file.flush()
+            self.count += 1
+            now = time.monotonic()
+            if now - self.__lastProgress >= self.progressInterval or self.count == self.maxRuns:
+                self.__lastProgress = now
+                write_progress(self.count, self.maxRuns)
+
+    def close(self):
+        with self.__lock:
+            if not self.__file.closed:
+                self.__file.close()
+                write_progress(self.count, self.maxRuns)
+
+#
+# Read the results of a JSON Lines file in order, one at a time. A final line cut short
+# by a crash is skipped.
+#
+def iter_results(path):
+    with open(path) as file:
+        for line in file:
+            if not line.endswith("\n"):
+                print("Skipping incomplete result at the end of " + str(path))
+                break
+            yield json.loads(line)
+
+def read_results(path):
+    return list(iter_results(path))
+
+#
+# The results of a finished experiment that were streamed to a JSON Lines file. They
+# stay on disk and are read again each time they are iterated, so an experiment's runs
+# are only in memory while its report is built.
+#
+class StoredResults:
+
+    def __init__(self, path, count):
+        self.path = path
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return iter_results(self.path)
+
+#
+# The runs of an experiment as a list: results kept in memory are returned as they are,
+# StoredResults are read from their file.
+#
+def load_runs(results):
+    if isinstance(results, StoredResults):
+        return read_results(results.path)
+    return results
@@ -0,0 +1,243 @@
+#!/usr/bin/env python3
+
+import json
+import os
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.ipc as ipc
+except ImportError:
+    pa = None
+
+#
+# Columnar storage for the runs of an experiment.
+#
+# All runs of a report are written to one compressed Arrow IPC (Feather v2) file instead
+# of one JSON file per run, and are read back through a memory map. Each attribute is a
+# typed column: SAAF attributes that are always numbers are stored as int64 / float64
+# even though experiment_caller stringifies them, and text columns with few unique values
+# (cpuType, containerID, ...) are dictionary encoded. Every value is restored exactly as
+# it was written, so reports built from the file are unchanged.
+#
+# Requires pyarrow. Without it runs are written as one JSON file per run, as before.
+#
+
+RUN_FILE_EXTENSION = '.arrow'
+
+# Arrow types of the attributes reported by SAAF and added by FaaS Runner. Other
+# attributes get a type inferred from their values.
+SAAF_SCHEMA = {
+    'version': 'float64',
+    'runtime': 'int64',
+    'startTime': 'int64',
+    'endTime': 'int64',
+    'roundTripTime': 'float64',
+    'latency': 'float64',
+    'newcontainer': 'int64',
+    'vmuptime': 'int64',
+    'cpuUsr': 'int64',
+    'cpuNice': 'int64',
+    'cpuKrn': 'int64',
+    'cpuIdle': 'int64',
+    'cpuIowait': 'int64',
+    'cpuIrq': 'int64',
+    'cpuSoftIrq': 'int64',
+    'vmcpusteal': 'int64',
+    'contextSwitches': 'int64',
+    'totalMemory': 'int64',
+    'freeMemory': 'int64',
+    'pageFaults': 'int64',
+    'majorPageFaults': 'int64',
+    'frameworkRuntime': 'int64',
+    '1_run_id': 'int64',
+    '2_thread_id': 'int64',
+    '3_pipeline_stage': 'int64',
+    'cpuType': 'string',
+    'cpuModel': 'string',
+    'uuid': 'string',
+    'containerID': 'string',
+    'vmID': 'string',
+    'platform': 'string',
+    'lang': 'string',
+    'zAll': 'string'
+}
+
+# Text columns with at most this fraction of unique values are dictionary encoded.
+DICTIONARY_RATIO = 0.5
+
+#
+# Whether runs can be stored in columnar files (pyarrow is installed).
+#
+def is_available():
+    return pa != None
+
+#
+# Write runs (a list of dictionaries) to a single columnar file.
+#
+def write_runs(path, runs, compression='zstd'):
+    # Build the columns in one pass. Runs without an attribute get None.
+    columns = {}
+    nullable = set()
+    for index, run in enumerate(runs):
+        for key, value in run.items():
+            if key not in columns:
+                columns[key] = [None] * len(runs)
+            columns[key][index] = value
+            if value is None:
+                nullable.add(key)
+
+    for key in nullable:
+        # Tell real None values apart from missing attributes.
+        columns[key] = [run.get(key, MISSING) for run in runs]
+    write_columns(path, columns, len(runs), compression, nullable)
+
+#
+# Write columns (a dictionary of attribute -> list of values, None where a run has no
+# value) to a columnar file. The columns are consumed. In the columns named by nullable,
+# None is a value and MISSING marks runs without the attribute.
+#
+def write_columns(path, columns, count, compression='zstd', nullable=()):
+    keys = list(columns.keys())
+    arrays = []
+    encodings = {}
+    for key in keys:
+        array, encoding = encode_column(key, columns.pop(key), key in nullable)
+        arrays.append(array)
+        encodings[key] = encoding
+
+    schema = pa.schema([pa.field(key, array.type) for key, array in zip(keys, arrays)],
+                       metadata={'faas_runner': json.dumps({'encodings': encodings, 'runs': count})})
+    table = pa.Table.from_arrays(arrays, schema=schema)
+    options = ipc.IpcWriteOptions(compression=compression)
+    with pa.OSFile(path, 'wb') as sink:
+        with ipc.new_file(sink, schema, options=options) as writer:
+            writer.write_table(table)
+
+# Marks an attribute a run does not have, in columns that also hold None values.
+class Missing:
+    pass
+MISSING = Missing()
+
+#
+# Choose the storage of one attribute. Returns (Arrow array, encoding), where encoding
+# tells decode_column how to turn stored values back into the original ones:
+#   'value' - stored as is, 'str' - numbers stored for strings, 'json' - JSON text.
+# Missing attributes are stored as nulls: None values, or MISSING when nullable is set
+# and None values are kept as JSON null.
+#
+def encode_column(key, values, nullable=False):
+    if nullable:
+        return pa.array([None if value is MISSING else json.dumps(value) for value in values], type=pa.string()), 'json'
+
+    types = set(map(type, values))
+    types.discard(type(None))
+    preferred = SAAF_SCHEMA.get(key)
+
+    if types == {str}:
+        array = pa.array(values, type=pa.string())
+
+        # Strings holding numbers (experiment_caller stringifies every value) are stored as
+        # numbers when converting them back gives the same text.
+        if preferred != 'string':
+            numberTypes = [pa.int64()]
+            if preferred == 'float64' or preferred == 'int64':
+                numberTypes.append(pa.float64())
+            for numberType in numberTypes:
+                try:
+                    numbers = pc.cast(array, numberType)
+                except (pa.ArrowInvalid, pa.ArrowNotImplementedError):
+                    continue
+                if pc.all(pc.equal(pc.cast(numbers, pa.string()), array)).as_py() != False:
+                    return numbers, 'str'
+
+        if pc.count_distinct(array).as_py() <= max(1, len(values) * DICTIONARY_RATIO):
+            array = array.dictionary_encode()
+        return array, 'value'
+
+    if types == {int}:
+        try:
+            return pa.array(values, type=pa.int64()), 'value'
+        except OverflowError:
+            pass
+    elif types == {float}:
+        return pa.array(values, type=pa.float64()), 'value'
+    elif types == {bool}:
+        return pa.array(values, type=pa.bool_()), 'value'
+
+    # Mixed types, None values and nested objects are kept as JSON.
+    return pa.array([None if value is None else json.dumps(value) for value in values], type=pa.string()), 'json'
+
+#
+# Turn a stored column back into the original values. Missing values are None.
+#
+def decode_column(column, encoding):
+    if isinstance(column, pa.ChunkedArray):
+        column = column.combine_chunks()
+    if encoding == 'str':
+        return pc.cast(column, pa.string()).to_numpy(zero_copy_only=False).tolist()
+    if pa.types.is_dictionary(column.type) and column.null_count == 0:
+        dictionary = column.dictionary.to_pylist()
+        return [dictionary[index] for index in column.indices.to_numpy().tolist()]
+    values = column.to_numpy(zero_copy_only=False).tolist() if column.null_count == 0 else column.to_pylist()
+    if encoding == 'json':
+        return [None if value == None else json.loads(value) for value in values]
+    return values
+
+#
+# Open a columnar file through a memory map. Returns (Arrow table, encodings).
+#
+def read_table(path):
+    with pa.memory_map(path, 'r') as source:
+        table = ipc.open_file(source).read_all()
+    metadata = json.loads(table.schema.metadata[b'faas_runner'])
+    return table, metadata['encodings']
+
+#
+# Read a columnar file as columns: attribute -> list of values, with None for runs
+# without the attribute.
+#
+def read_columns(path):
+    table, encodings = read_table(path)
+    columns = {}
+    for name in table.column_names:
+        columns[name] = decode_column(table.column(name), encodings.get(name, 'value'))
+    return columns
+
+#
+# Read the runs of a columnar file as a list of dictionaries, like write_runs was given.
+#
+def read_runs(path):
+    table, encodings = read_table(path)
+    keys = table.column_names
+    columns = [decode_column(table.column(name), encodings.get(name, 'value')) for name in keys]
+    runs = [dict(zip(keys, row)) for row in zip(*columns)]
+
+    # Remove the attributes of runs that did not have them.
+    for name in keys:
+        column = table.column(name)
+        if column.null_count > 0:
+            missing = column.is_null().to_pylist()
+            for run, isMissing in zip(runs, missing):
+                if isMissing:
+                    del run[name]
+    return runs
+
+#
+# Read every run in a folder: columnar files and legacy one-run-per-file JSON.
+#
+def read_run_folder(path):
+    run_list = []
+    for filename in sorted(os.listdir(path)):
+        filePath = os.path.join(path, filename)
+        if filename.endswith(RUN_FILE_EXTENSION):
+            if is_available():
+                run_list.extend(read_runs(filePath))
+            else:
+                print("pyarrow is required to load " + filePath)
+        elif filename.endswith(".json"):
+            try:
+                run_list.append(json.load(open(filePath)))
+            except Exception as e:
+                print("Error loading: " + filePath + " with exception " + str(e))
+    return run_list
@@ -0,0 +1,64 @@
+import json
+import os
+import sys
+from datetime import datetime
+
+TESTS = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(TESTS, '..'))
+sys.path.insert(0, os.path.join(TESTS, '..', '..'))
+
+from analyze_scalability import format_scalability_report, parse_performance_results, table_performance
+from log_ingest import index_by_function, ingest_logs
+
+#
+# Fixture logs of three functions with two bursts of four requests each:
+#   logs/export_task: create-export-task text, gzip compressed (rotate) and plain (resize)
+#   logs/filter_log_events: filter-log-events JSON pages, plain and gzip compressed (greyscale)
+# The first request of each burst is a cold start with an Init Duration. SAAF records are
+# printed indented, over many lines. insights_rows.json holds the rows PERFORMANCE_QUERY
+# returns for the same requests, by function and burst.
+#
+FIXTURES = os.path.join(TESTS, 'fixtures')
+STAGES = {'rotate': 'python_lambda_rotate', 'resize': 'python_lambda_resize', 'greyscale': 'python_lambda_greyscale'}
+
+def load_insights():
+    with open(os.path.join(FIXTURES, 'insights_rows.json')) as f:
+        return json.load(f)
+
+def ingest_fixtures():
+    return ingest_logs([os.path.join(FIXTURES, 'logs')])
+
+def test_reports_and_saaf_records_are_joined():
+    table = ingest_fixtures()
+    assert len(table['requestId']) == 24
+    assert all(value != None for value in table['DurationMS'])
+    assert sorted(set(table['functionName'])) == sorted(STAGES.values())
+    assert all(runtime != None for runtime in table['runtime'])
+    assert sum(1 for value in table['InitDuration'] if value != None) == 6
+    # The REPORT line's Init Duration and the SAAF record of the same request agree.
+    for init, newcontainer in zip(table['InitDuration'], table['newcontainer']):
+        assert (init != None) == (newcontainer == 1)
+
+def test_offline_report_matches_insights():
+    insights = load_insights()
+    table = ingest_fixtures()
+    index = index_by_function(table)
+
+    offline = {}
+    online = {}
+    for burst, (start_ms, end_ms) in enumerate(insights['windows']):
+        concurrency = burst + 1
+        start_time = datetime.fromtimestamp(start_ms // 1000)
+        end_time = datetime.fromtimestamp(end_ms // 1000)
+        offline[concurrency] = {'python': {'batch_size': 4, 'concurrency': concurrency, 'stages': {}}}
+        online[concurrency] = {'python': {'batch_size': 4, 'concurrency': concurrency, 'stages': {}}}
+        for stage, function_name in STAGES.items():
+            metrics = table_performance(table, index, function_name, start_time, end_time)
+            expected = parse_performance_results(insights['results'][function_name][burst])
+            assert metrics['invocations'] == 4
+            assert metrics == expected
+            offline[concurrency]['python']['stages'][stage] = metrics
+            online[concurrency]['python']['stages'][stage] = expected
+
+    generated = lambda text: [line for line in text.split('\n') if not line.startswith('Generated:')]
+    assert generated(format_scalability_report(offline)) == generated(format_scalability_report(online))
@@ -0,0 +1,52 @@
+import copy
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from report_generator import runtime_overlap_pairwise, runtime_overlap_sweep
+
+#
+# runtime_overlap_sweep must give the same runtimeOverlap strings as the pairwise
+# reference, so reports do not change with overlapMethod.
+#
+
+def random_runs(rng):
+    runs = []
+    for i in range(rng.randint(1, 40)):
+        start = rng.randint(0, 60)
+        # Zero-length and inverted runs, and lengths that put many overlaps on a half-cent
+        length = rng.choice([0, 1, 2, 3, 4, 5, 7, 8, 10, 16, 20, 40, -3])
+        run = {'startTime': str(start), 'endTime': str(start + length)}
+        # Mixed 1 / 1.0 keys, and runs without the key
+        key = rng.choice([None, 1, 1.0, 2, 'a'])
+        if key != None:
+            run['group'] = key
+        runs.append(run)
+    return runs
+
+def overlaps(method, runs, overlapFilter):
+    runs = copy.deepcopy(runs)
+    method(runs, overlapFilter)
+    return [run['runtimeOverlap'] for run in runs]
+
+def test_sweep_matches_pairwise():
+    rng = random.Random(462)
+    for i in range(1500):
+        runs = random_runs(rng)
+        for overlapFilter in [None, "", "group"]:
+            assert overlaps(runtime_overlap_sweep, runs, overlapFilter) == overlaps(runtime_overlap_pairwise, runs, overlapFilter)
+
+def test_sweep_matches_pairwise_at_millisecond_scale():
+    rng = random.Random(7)
+    runs = []
+    for i in range(1500):
+        start = 1765000000000 + rng.randint(0, 60000)
+        runs.append({'startTime': start, 'endTime': start + rng.randint(0, 4000)})
+    assert overlaps(runtime_overlap_sweep, runs, None) == overlaps(runtime_overlap_pairwise, runs, None)
+
+def test_half_cent_rounds_like_pairwise():
+    # The exact overlap of the first run is 0.475: 19 runs each covering 1 of its 40 ms.
+    runs = [{'startTime': 0, 'endTime': 40}] + [{'startTime': i * 2, 'endTime': i * 2 + 1} for i in range(19)]
+    assert overlaps(runtime_overlap_sweep, runs, None)[0] == overlaps(runtime_overlap_pairwise, runs, None)[0]
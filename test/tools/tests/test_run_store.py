@@ -0,0 +1,36 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import run_store
+
+pytestmark = pytest.mark.skipif(not run_store.is_available(), reason="pyarrow is not installed")
+
+#
+# Runs must come back from a columnar file exactly as they were written.
+#
+
+def round_trip(tmp_path, runs):
+    path = str(tmp_path / ("runs" + run_store.RUN_FILE_EXTENSION))
+    run_store.write_runs(path, [dict(run) for run in runs])
+    return run_store.read_runs(path)
+
+def test_saaf_runs(tmp_path):
+    runs = [{'version': '0.5', 'runtime': str(100 + i), 'startTime': str(1765000000000 + i), 'cpuType': 'Intel',
+             'uuid': 'u' + str(i), 'latency': str(i / 4), 'zAll': 'Final Results:'} for i in range(20)]
+    assert round_trip(tmp_path, runs) == runs
+
+def test_none_is_kept_apart_from_missing(tmp_path):
+    # Every run has x, some with None.
+    assert round_trip(tmp_path, [{'x': None}]) == [{'x': None}]
+    assert round_trip(tmp_path, [{'x': None}, {'x': 'a'}]) == [{'x': None}, {'x': 'a'}]
+    # Runs without the attribute next to runs with None.
+    runs = [{'x': None}, {'y': 1}, {'x': 2, 'y': None}]
+    assert round_trip(tmp_path, runs) == runs
+
+def test_missing_attributes_and_mixed_types(tmp_path):
+    runs = [{'a': '1', 'b': 1.5, 'c': True}, {'a': 'x', 'd': {'nested': [1, None]}}, {'b': 2.5, 'e': 7, 'f': '007'}]
+    assert round_trip(tmp_path, runs) == runs